@@ -0,0 +1 @@
+stub
\ No newline at end of file
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+EVE start-up time
+
+Checks that loading `eve.py` (as done for `eve.py --help`, and for runs which
+only map reads or run the variant detectors) stays within an import-time
+budget, and does not import any of the dependencies which are only needed by
+the later pipeline stages.
+
+Each measurement is made in a fresh interpreter using `python -X importtime`,
+and the fastest of several runs is used. Exits with status 1 if the budget is
+exceeded or a heavy dependency is imported.
+
+Example
+-------
+python benchmarks/import_time.py --budget=0.25
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# default import-time budget, in seconds
+BUDGET = 0.25
+
+# modules which should only be imported by the stages that need them
+HEAVY_MODULES = ['pandas', 'sklearn', 'scipy', 'vcf', 'matplotlib', 'pyarrow',
+                 'pysam', 'joblib']
+
+# loads eve.py (which shares its name with the eve package) the same way as
+# running it does, without running the pipeline
+LOAD_SCRIPT = """
+import sys
+import importlib.util
+
+sys.path.insert(0, %r)
+spec = importlib.util.spec_from_file_location('eve_main', %r)
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+
+print(",".join(sorted(sys.modules)))
+"""
+
+def measure(code):
+    """Runs Python code in a new interpreter and measures its imports
+
+    Returns
+    -------
+    seconds : float
+        Total time spent importing modules.
+    modules : set
+        Names of the modules which were loaded.
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True, cwd=REPO_DIR)
+
+    if process.returncode != 0:
+        raise RuntimeError("Loading EVE failed:\n%s" % process.stderr)
+
+    total = 0
+
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        fields = line[len('import time:'):].split('|')
+
+        # only count top-level imports, which include their dependencies
+        if fields[1].strip().isdigit() and not fields[2].startswith('  '):
+            total += int(fields[1])
+
+    modules = set(process.stdout.strip().split(','))
+
+    return (total / 1e6, modules)
+
+def load_script():
+    """Returns the code used to load eve.py"""
+    return LOAD_SCRIPT % (REPO_DIR, os.path.join(REPO_DIR, 'eve.py'))
+
+def main(argv):
+    """Checks the import time of eve.py"""
+    parser = argparse.ArgumentParser(description='Check EVE start-up time')
+    parser.add_argument('--budget', type=float, default=BUDGET,
+                        help=('Maximum import time in seconds (default: '
+                              '%.2f)' % BUDGET))
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of measurements to make')
+    args = parser.parse_args(argv[1:])
+
+    measurements = [measure(load_script()) for i in range(args.repeat)]
+
+    seconds = min(x[0] for x in measurements)
+    modules = measurements[0][1]
+
+    heavy = [x for x in HEAVY_MODULES if x in modules]
+
+    print("Import time: %.3fs (budget: %.3fs)" % (seconds, args.budget))
+
+    status = 0
+
+    if seconds > args.budget:
+        print("Import time exceeds the budget")
+        status = 1
+
+    if heavy:
+        print("Modules imported at start-up: %s" % ", ".join(heavy))
+        status = 1
+
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+EVE benchmarks
+
+Runs the complete pipeline on a synthetic data set (see `synthetic.py`),
+using the stand-in tools in `benchmarks/bin` in place of the real mapping and
+variant calling tools, so that changes to the Python stages can be measured
+offline.
+
+Each stage is run in a forked child process, and its wall-clock time, CPU time
+and peak memory usage are recorded:
+
+    mapping       Mapping (stand-in tools only)
+    detection     Variant detection (stand-in tools, driven by EVE)
+    combine       Combining the detector VCFs into the combined matrix
+    training_set  Labelling the combined matrix using the truth set
+    training      Cross-validation and training (first sample only)
+    prediction    Scoring the combined matrix and writing the final VCF
+    cohort        Merging the matrices of all samples (multiple samples only)
+
+The results are written to a JSON file, which can be compared against an
+earlier run to catch regressions.
+
+Examples
+--------
+python benchmarks/run.py run --sites=1000000 --contigs=8 -o new.json
+python benchmarks/run.py compare baseline.json new.json --threshold=0.1
+"""
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import pickle
+import platform
+import argparse
+import datetime
+import resource
+import tempfile
+import traceback
+import subprocess
+import importlib.util
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+sys.path.insert(0, BENCHMARK_DIR)
+
+import synthetic
+from stubs import DATA_VARIABLE
+
+# stages, in the order they are run
+STAGES = ['mapping', 'detection', 'combine', 'training_set', 'training',
+          'prediction', 'cohort']
+
+# metrics compared between runs (lower is better for each)
+COMPARED_METRICS = ['wall_time', 'cpu_time', 'peak_rss_kb']
+
+# Python packages whose versions are recorded with the results
+PACKAGES = ['numpy', 'pandas', 'scikit-learn', 'joblib', 'pyarrow', 'PyVCF']
+
+def load_eve():
+    """Loads the `eve.py` script as a module
+
+    The script shares its name with the `eve` package, so it is loaded from
+    its file location under a different name.
+    """
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+
+    spec = importlib.util.spec_from_file_location(
+        'eve_main', os.path.join(REPO_DIR, 'eve.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+def read_rss_kb():
+    """Returns the current resident set size of the process in KB (0 where
+    /proc is not available)"""
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+
+    return 0
+
+def measure(function):
+    """Runs a function in a forked child process and measures its resource
+    usage
+
+    Running each stage in a separate process means that the peak memory usage
+    of one stage does not hide that of the next. Changes made by the function
+    to the state of the parent process are lost, so any values needed by
+    later stages must be returned.
+
+    Returns
+    -------
+    metrics : dict
+        Wall-clock time and CPU time (in seconds), and peak memory usage (in
+        KB) of the stage. CPU time and memory usage of the external commands
+        run by the stage are reported separately.
+    result : object
+        Return value of the function.
+    """
+    (read_fd, write_fd) = os.pipe()
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+
+        try:
+            start_rss = read_rss_kb()
+            start = resource.getrusage(resource.RUSAGE_SELF)
+            start_time = time.perf_counter()
+
+            result = function()
+
+            wall_time = time.perf_counter() - start_time
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+            metrics = {
+                'wall_time': wall_time,
+                'user_time': usage.ru_utime - start.ru_utime,
+                'system_time': usage.ru_stime - start.ru_stime,
+                'cpu_time': (usage.ru_utime - start.ru_utime +
+                             usage.ru_stime - start.ru_stime),
+                'children_cpu_time': children.ru_utime + children.ru_stime,
+                'peak_rss_kb': usage.ru_maxrss,
+                'rss_increase_kb': max(0, usage.ru_maxrss - start_rss),
+                'children_peak_rss_kb': children.ru_maxrss
+            }
+            outcome = (True, metrics, result)
+        except BaseException:
+            outcome = (False, traceback.format_exc(), None)
+            status = 1
+
+        with os.fdopen(write_fd, 'wb') as fp:
+            pickle.dump(outcome, fp)
+
+        os._exit(status)
+
+    os.close(write_fd)
+
+    with os.fdopen(read_fd, 'rb') as fp:
+        data = fp.read()
+
+    os.waitpid(pid, 0)
+
+    if not data:
+        raise RuntimeError("Benchmark process terminated unexpectedly")
+
+    (success, metrics, result) = pickle.loads(data)
+
+    if not success:
+        raise RuntimeError("Benchmark stage failed:\n%s" % metrics)
+
+    return (metrics, result)
+
+class SampleRun(object):
+    """Pipeline run for a single sample of the synthetic data set"""
+    def __init__(self, eve_module, data_dir, output_dir, sample, args):
+        """Create a sample run
+
+        Parameters
+        ----------
+        eve_module : module
+            The loaded `eve.py` script.
+        data_dir : str
+            Location of the synthetic data set.
+        output_dir : str
+            EVE output directory for the sample.
+        sample : str
+            Sample name.
+        args : argparse.Namespace
+            Benchmark arguments.
+        """
+        self.sample = sample
+        self.data_dir = data_dir
+        self.sample_dir = os.path.join(data_dir, sample)
+
+        argv = ['eve.py',
+                '-f', os.path.join(data_dir, 'reference.fasta'),
+                '-o', output_dir,
+                '-t', os.path.join(self.sample_dir, 'truth.vcf'),
+                '-d', ",".join(synthetic.Scale(detectors=args.detectors)
+                               .detector_names),
+                '--detector-registry', os.path.join(data_dir,
+                                                    'detectors.cfg'),
+                '--num-threads', str(args.num_threads),
+                '--chunk-size', str(args.chunk_size),
+                '--retries', '0']
+        argv += shlex.split(args.eve_args or '')
+        argv += [os.path.join(self.sample_dir, 'reads_1.fastq'),
+                 os.path.join(self.sample_dir, 'reads_2.fastq')]
+
+        # the stand-in tools serve the data of the current sample
+        os.environ[DATA_VARIABLE] = self.sample_dir
+
+        self.app = eve_module.EVE(argv)
+        self.vcf_files = None
+
+    def run_stage(self, stage, model_filepath):
+        """Runs a single stage, and returns its metrics"""
+        app = self.app
+        os.environ[DATA_VARIABLE] = self.sample_dir
+
+        if stage == 'mapping':
+            (metrics, bam) = measure(app.run_mapping)
+            app.args.bam = bam
+            app.load_detectors()
+        elif stage == 'detection':
+            (metrics, self.vcf_files) = measure(app.run_detectors)
+        elif stage == 'combine':
+            (metrics, _) = measure(lambda: app.run_combine(self.vcf_files))
+        elif stage == 'training_set':
+            (metrics, _) = measure(app.build_training_set)
+        elif stage == 'training':
+            (metrics, _) = measure(lambda: app.train_model(model_filepath))
+        elif stage == 'prediction':
+            from eve import model
+
+            (metrics, _) = measure(lambda: app.score_variants(
+                model.load_model(model_filepath)))
+        else:
+            raise ValueError("Unknown stage: %s" % stage)
+
+        return metrics
+
+def combine_cohort(output_dir, samples, fasta):
+    """Merges the combined matrices of all samples"""
+    from eve import cohort, regions, storage
+
+    matrices = [(x, storage.read_matrix(os.path.join(output_dir, x,
+                                                     'combined')))
+                for x in samples]
+    contigs = regions.ContigIndex.from_fasta_index("%s.fai" % fasta)
+
+    df = cohort.combine_samples(matrices, contigs)
+    storage.write_matrix(df, os.path.join(output_dir, 'cohort_combined'))
+
+def prepare_data(data_dir, scale):
+    """Generates the synthetic data set, unless a data set of the same scale
+    already exists in the directory"""
+    params_file = os.path.join(data_dir, 'scale.json')
+    params = vars(scale)
+
+    if os.path.isfile(params_file):
+        with open(params_file) as fp:
+            if json.load(fp) == params:
+                print("Using existing data in %s" % data_dir)
+                return
+
+    print("Generating synthetic data in %s" % data_dir)
+    start = time.perf_counter()
+    synthetic.generate(data_dir, scale)
+
+    with open(params_file, 'w') as fp:
+        json.dump(params, fp, indent=2)
+
+    print("Generated data in %.1fs" % (time.perf_counter() - start))
+
+def run_benchmarks(args):
+    """Runs the benchmarks and writes the results"""
+    scale = synthetic.scale_from_args(args)
+    stages = args.stages.split(',') if args.stages else STAGES
+
+    for stage in stages:
+        if stage not in STAGES:
+            raise ValueError("Unknown stage: %s (available: %s)" % (
+                stage, ", ".join(STAGES)))
+
+    work_dir = os.path.abspath(args.work_dir or
+                               tempfile.mkdtemp(prefix='eve-benchmark-'))
+    data_dir = os.path.join(work_dir, 'data')
+
+    prepare_data(data_dir, scale)
+
+    # the stand-in tools are found through PATH, and EVE reads its
+    # configuration relative to the repository
+    os.environ['PATH'] = os.pathsep.join([os.path.join(BENCHMARK_DIR, 'bin'),
+                                          os.environ.get('PATH', '')])
+    os.chdir(REPO_DIR)
+
+    eve_module = load_eve()
+    records = []
+
+    # EVE imports the modules of the later stages when they are first used;
+    # import them here so that the import time (see `import_time.py`) is not
+    # counted towards those stages
+    from eve import cohort, combine, model, storage, trainer, training, vcfio
+
+    # output of earlier runs would be picked up by the run journal
+    shutil.rmtree(os.path.join(work_dir, 'output'), ignore_errors=True)
+
+    for repeat in range(args.repeat):
+        output_dir = os.path.join(work_dir, 'output', str(repeat))
+        model_filepath = os.path.join(output_dir, 'random_forest.pkl')
+
+        for sample in scale.sample_names:
+            run = SampleRun(eve_module, data_dir,
+                            os.path.join(output_dir, sample), sample, args)
+
+            for stage in STAGES[:-1]:
+                # the model trained on the first sample is used for all
+                # samples
+                if stage == 'training' and sample != scale.sample_names[0]:
+                    continue
+
+                # stages which are not benchmarked are still run, since
+                # later stages depend on their output
+                metrics = run.run_stage(stage, model_filepath)
+
+                if stage in stages:
+                    records.append(record(stage, sample, repeat, metrics,
+                                          scale.sites))
+
+        if 'cohort' in stages and scale.samples > 1:
+            (metrics, _) = measure(lambda: combine_cohort(
+                output_dir, scale.sample_names,
+                os.path.join(data_dir, 'reference.fasta')))
+            records.append(record('cohort', None, repeat, metrics,
+                                  scale.sites * scale.samples))
+
+    results = {
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'params': dict(vars(scale), num_threads=args.num_threads,
+                       chunk_size=args.chunk_size, eve_args=args.eve_args,
+                       repeat=args.repeat),
+        'environment': environment(),
+        'records': records
+    }
+
+    write_results(results, args.output)
+    print_summary(records)
+
+    return 0
+
+def record(stage, sample, repeat, metrics, sites):
+    """Creates a result record for a single stage"""
+    metrics = dict(metrics)
+
+    if metrics['wall_time'] > 0:
+        metrics['sites_per_second'] = sites / metrics['wall_time']
+
+    print("%-14s %-10s %8.2fs %10d KB" % (stage, sample or '',
+                                          metrics['wall_time'],
+                                          metrics['peak_rss_kb']))
+
+    return {'stage': stage, 'sample': sample, 'repeat': repeat,
+            'metrics': metrics}
+
+def environment():
+    """Describes the environment the benchmarks were run in"""
+    from importlib import metadata
+
+    versions = {}
+
+    for name in PACKAGES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'packages': versions
+    }
+
+def write_results(results, filepath):
+    """Writes the results as JSON, and as a tab-delimited table next to it"""
+    with open(filepath, 'w') as fp:
+        json.dump(results, fp, indent=2)
+
+    names = sorted(set(x for r in results['records'] for x in r['metrics']))
+
+    with open("%s.tsv" % os.path.splitext(filepath)[0], 'w') as fp:
+        fp.write("\t".join(['stage', 'sample', 'repeat'] + names) + "\n")
+
+        for r in results['records']:
+            fp.write("\t".join([r['stage'], r['sample'] or '',
+                                str(r['repeat'])] +
+                               [str(r['metrics'].get(x, '')) for x in names])
+                     + "\n")
+
+    print("Results written to %s" % filepath)
+
+def summarize(records):
+    """Summarizes the results for each stage
+
+    Repeated measurements are summarized by their median, and stages run for
+    several samples by their total time and the largest peak memory usage.
+
+    Returns
+    -------
+    summary : dict
+        Mapping from stage to a dict of metric values.
+    """
+    runs = {}
+
+    for r in records:
+        runs.setdefault(r['stage'], {}).setdefault(r['repeat'], []).append(
+            r['metrics'])
+
+    summary = {}
+
+    for (stage, repeats) in runs.items():
+        values = {x: [] for x in COMPARED_METRICS}
+
+        for samples in repeats.values():
+            for name in COMPARED_METRICS:
+                if name == 'peak_rss_kb':
+                    values[name].append(max(x[name] for x in samples))
+                else:
+                    values[name].append(sum(x[name] for x in samples))
+
+        summary[stage] = {x: median(v) for (x, v) in values.items()}
+
+    return summary
+
+def median(values):
+    """Returns the median of a list of values"""
+    values = sorted(values)
+    middle = len(values) // 2
+
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def print_summary(records):
+    """Prints the summarized results of a run"""
+    summary = summarize(records)
+
+    print("\n%-14s %12s %12s %14s" % ('stage', 'wall (s)', 'cpu (s)',
+                                      'peak RSS (KB)'))
+
+    for stage in [x for x in STAGES if x in summary]:
+        values = summary[stage]
+        print("%-14s %12.2f %12.2f %14d" % (stage, values['wall_time'],
+                                            values['cpu_time'],
+                                            values['peak_rss_kb']))
+
+def compare_results(args):
+    """Compares two sets of results, and reports any regressions
+
+    Returns
+    -------
+    status : int
+        1 if any of the compared metrics of a stage increased by more than the
+        threshold, and 0 otherwise.
+    """
+    results = []
+
+    for filepath in [args.baseline, args.results]:
+        with open(filepath) as fp:
+            results.append(json.load(fp))
+
+    if results[0]['params'] != results[1]['params']:
+        print("Warning: the results were obtained using different "
+              "parameters")
+
+    (baseline, current) = [summarize(x['records']) for x in results]
+    metrics = args.metrics.split(',')
+    regressions = []
+
+    print("%-14s %-12s %14s %14s %9s" % ('stage', 'metric', 'baseline',
+                                         'current', 'change'))
+
+    for stage in [x for x in STAGES if x in baseline and x in current]:
+        for name in metrics:
+            before = baseline[stage][name]
+            after = current[stage][name]
+
+            # very short stages are too noisy to compare
+            if name.endswith('_time') and before < args.min_time:
+                continue
+
+            change = (after - before) / before if before else 0.0
+            flag = ''
+
+            if change > args.threshold:
+                regressions.append((stage, name))
+                flag = ' REGRESSION'
+
+            print("%-14s %-12s %14.2f %14.2f %+8.1f%%%s" % (
+                stage, name, before, after, 100 * change, flag))
+
+    if regressions:
+        print("\n%d regression(s) above %.0f%%" % (len(regressions),
+                                                   100 * args.threshold))
+        return 1
+
+    return 0
+
+def parse_args(argv):
+    """Parses input arguments"""
+    parser = argparse.ArgumentParser(description='EVE benchmarks')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run = commands.add_parser('run', help='Run the benchmarks')
+    synthetic.add_scale_arguments(run)
+    run.add_argument('-o', '--output', default='benchmark.json',
+                     help='File to write the results to')
+    run.add_argument('-w', '--work-dir',
+                     help=('Directory for the synthetic data and EVE output '
+                           '(default: a new temporary directory). Data of '
+                           'the same scale is reused'))
+    run.add_argument('--stages',
+                     help=('Comma-separated list of the stages to report '
+                           '(default: all)'))
+    run.add_argument('--repeat', type=int, default=1,
+                     help='Number of times to run each stage')
+    run.add_argument('-n', '--num-threads', type=int, default=4,
+                     help='Number of threads used by EVE')
+    run.add_argument('--chunk-size', type=int, default=100000,
+                     help='Chunk size used by EVE')
+    run.add_argument('--eve-args',
+                     help='Additional arguments to pass to EVE')
+
+    compare = commands.add_parser('compare',
+                                  help='Compare two sets of results')
+    compare.add_argument('baseline', help='Results to compare against')
+    compare.add_argument('results', help='Results to compare')
+    compare.add_argument('--threshold', type=float, default=0.1,
+                         help=('Relative increase treated as a regression '
+                               '(default: 0.1)'))
+    compare.add_argument('--metrics', default=",".join(COMPARED_METRICS),
+                         help='Comma-separated list of metrics to compare')
+    compare.add_argument('--min-time', type=float, default=0.5,
+                         help=('Stages taking less than this many seconds '
+                               'are not compared by time'))
+
+    return parser.parse_args(argv[1:])
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv)
+
+    if args.command == 'run':
+        sys.exit(run_benchmarks(args))
+    sys.exit(compare_results(args))
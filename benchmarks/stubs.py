@@ -0,0 +1,374 @@
+"""
+Stand-in tools
+
+Minimal replacements for the external tools run by EVE (BWA, SAMtools,
+BCFtools, vcfutils.pl, tabix, and the GATK, VarScan and Picard jars run
+using `java -jar`), used to benchmark the pipeline without the real tools. They
+accept the command lines EVE uses, and create output files in the expected
+formats:
+
+  * the mapping tools produce a SAM file of the input reads (passed along
+    in place of the BAM files),
+  * `samtools mpileup` lists the candidate sites of the sample (limited to
+    the requested region), and
+  * each variant detector reports its calls (from the synthetic data set)
+    at the sites it is given, or within the requested region.
+
+The data for the sample being processed is located using the EVE_STUB_DATA
+environment variable (see `synthetic.py` for its layout). Each tool is a
+symbolic link to `bin/stub`, which dispatches on the name it is invoked as.
+"""
+import os
+import sys
+import shutil
+
+# environment variable pointing to the synthetic data of the current sample
+DATA_VARIABLE = 'EVE_STUB_DATA'
+
+def main(tool, args):
+    """Runs a stand-in tool
+
+    Returns
+    -------
+    status : int
+        Exit status.
+    """
+    tools = {
+        'bwa': bwa,
+        'samtools': samtools,
+        'bcftools': bcftools,
+        'java': java,
+        'vcfutils.pl': vcfutils,
+        'tabix': tabix,
+        'stubcaller': stubcaller
+    }
+
+    if tool not in tools:
+        sys.stderr.write("Unknown stand-in tool: %s\n" % tool)
+        return 127
+
+    try:
+        tools[tool](args)
+    except UsageError as e:
+        sys.stderr.write("%s: %s\n" % (tool, e))
+        return 1
+
+    return 0
+
+class UsageError(Exception):
+    """Raised for command lines the stand-in tools do not support"""
+
+def data_path(filename):
+    """Returns the location of a file in the synthetic data of the current
+    sample"""
+    if DATA_VARIABLE not in os.environ:
+        raise UsageError("%s is not set" % DATA_VARIABLE)
+    return os.path.join(os.environ[DATA_VARIABLE], filename)
+
+def options(args, flags=()):
+    """Splits a command line into options and positional arguments
+
+    Parameters
+    ----------
+    args : list
+        Command-line arguments.
+    flags : iterable
+        Options which do not take a value.
+
+    Returns
+    -------
+    options : dict
+        Mapping from option to value (True for flags).
+    positional : list
+        Positional arguments.
+    """
+    result = {}
+    positional = []
+    i = 0
+
+    while i < len(args):
+        arg = args[i]
+
+        if arg.startswith('-') and arg != '-':
+            if arg in flags:
+                result[arg] = True
+            else:
+                result[arg] = args[i + 1]
+                i += 1
+        else:
+            positional.append(arg)
+
+        i += 1
+
+    return (result, positional)
+
+def parse_region(region):
+    """Parses a region string (contig or contig:start-end)
+
+    Returns
+    -------
+    region : tuple
+        (contig, start, end) tuple, or None if no region was given.
+    """
+    if region is None:
+        return None
+
+    if ':' not in region:
+        return (region, 1, float('inf'))
+
+    (contig, span) = region.rsplit(':', 1)
+    (start, end) = span.replace(',', '').split('-')
+
+    return (contig, int(start), int(end))
+
+def in_region(chrom, pos, region):
+    """Checks whether a site lies in a region"""
+    return (region is None or
+            (chrom == region[0] and region[1] <= pos <= region[2]))
+
+def read_calls(name):
+    """Reads the calls of a detector from the synthetic data
+
+    Returns
+    -------
+    header : list
+        Header lines.
+    records : list
+        (chrom, pos, line) tuple for each record.
+    """
+    header = []
+    records = []
+
+    with open(data_path("%s.vcf" % name)) as fp:
+        for line in fp:
+            if line.startswith('#'):
+                header.append(line)
+            else:
+                (chrom, pos, _) = line.split('\t', 2)
+                records.append((chrom, int(pos), line))
+
+    return (header, records)
+
+def write_calls(name, out, region=None, sites=None):
+    """Writes the calls of a detector within a region, or at a set of sites"""
+    (header, records) = read_calls(name)
+
+    out.writelines(header)
+
+    for (chrom, pos, line) in records:
+        if not in_region(chrom, pos, region):
+            continue
+        if sites is not None and (chrom, pos) not in sites:
+            continue
+        out.write(line)
+
+def read_pileup(fp):
+    """Returns the set of (chrom, pos) sites listed in a pileup"""
+    sites = set()
+
+    for line in fp:
+        fields = line.split('\t', 2)
+
+        if len(fields) > 1:
+            sites.add((fields[0], int(fields[1])))
+
+    return sites
+
+def drain(filepath):
+    """Reads a file to the end (so that a writer on the other end of a named
+    pipe is not blocked)"""
+    with open(filepath, 'rb') as fp:
+        while fp.read(1 << 20):
+            pass
+
+def read_fasta_index(fasta):
+    """Returns the (contig, length) pairs listed in a FASTA index"""
+    with open("%s.fai" % fasta) as fp:
+        return [(x.split('\t')[0], int(x.split('\t')[1])) for x in fp
+                if x.strip()]
+
+def bwa(args):
+    """bwa index / bwa mem"""
+    command = args[0]
+
+    if command == 'index':
+        for ext in ['amb', 'ann', 'bwt', 'pac', 'sa']:
+            open("%s.%s" % (args[-1], ext), 'w').close()
+        return
+
+    if command != 'mem':
+        raise UsageError("unsupported command: %s" % command)
+
+    (opts, (reference, fastq1, fastq2)) = options(args[1:])
+    out = sys.stdout
+
+    out.write("@HD\tVN:1.0\tSO:unsorted\n")
+
+    contigs = read_fasta_index(reference)
+
+    for (contig, length) in contigs:
+        out.write("@SQ\tSN:%s\tLN:%d\n" % (contig, length))
+
+    if '-R' in opts:
+        out.write(opts['-R'].replace('\\t', '\t') + "\n")
+
+    (contig, length) = contigs[0]
+
+    with open(fastq1) as fp1, open(fastq2) as fp2:
+        for (i, (read1, read2)) in enumerate(zip(fastq_records(fp1),
+                                                 fastq_records(fp2))):
+            pos = 1 + (i * 97) % max(1, length - 300)
+
+            for (flag, mate, mate_pos, other_pos, tlen) in [
+                    (99, read1, pos, pos + 200, 300),
+                    (147, read2, pos + 200, pos, -300)]:
+                (name, sequence, quality) = mate
+                out.write("%s\t%d\t%s\t%d\t60\t%dM\t=\t%d\t%d\t%s\t%s\n" % (
+                    name, flag, contig, mate_pos, len(sequence), other_pos,
+                    tlen, sequence, quality))
+
+def fastq_records(fp):
+    """Iterates over the (name, sequence, quality) records of a FASTQ file"""
+    while True:
+        lines = [fp.readline().rstrip('\n') for i in range(4)]
+
+        if not lines[0]:
+            return
+
+        yield (lines[0][1:].split('/')[0], lines[1], lines[3])
+
+def samtools(args):
+    """samtools faidx / view / sort / index / mpileup"""
+    command = args[0]
+
+    if command == 'faidx':
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from synthetic import write_fasta_index
+        write_fasta_index(args[1])
+    elif command == 'view':
+        (opts, positional) = options(args[1:], flags=['-bS', '-b', '-S'])
+        with open(positional[0]) as fp:
+            shutil.copyfileobj(fp, sys.stdout)
+    elif command == 'sort':
+        (opts, positional) = options(args[1:])
+
+        if '-o' in opts:
+            source = positional[0]
+            output = opts['-o']
+        else:
+            # samtools < 1.0: sort <in.bam> <out.prefix>
+            (source, prefix) = positional
+            output = "%s.bam" % prefix
+
+        with open(output, 'w') as out:
+            if source == '-':
+                shutil.copyfileobj(sys.stdin, out)
+            else:
+                with open(source) as fp:
+                    shutil.copyfileobj(fp, out)
+    elif command == 'index':
+        with open("%s.bai" % args[1], 'w') as fp:
+            fp.write("BAI\n")
+    elif command == 'mpileup':
+        (opts, positional) = options(args[1:], flags=['-u'])
+        region = parse_region(opts.get('-r'))
+
+        # read all of the alignments, as the real tool would
+        drain(positional[0])
+
+        with open(data_path('sites.tsv')) as fp:
+            for line in fp:
+                (chrom, pos, ref, depth) = line.rstrip('\n').split('\t')
+
+                if in_region(chrom, int(pos), region):
+                    sys.stdout.write("%s\t%s\t%s\t%s\t%s\t%s\n" % (
+                        chrom, pos, ref, depth, '.' * min(int(depth), 10),
+                        'I' * min(int(depth), 10)))
+    else:
+        raise UsageError("unsupported command: %s" % command)
+
+def bcftools(args):
+    """bcftools view
+
+    The "BCF" files created are plain VCF files.
+    """
+    if args[0] != 'view':
+        raise UsageError("unsupported command: %s" % args[0])
+
+    (opts, positional) = options(args[1:], flags=['-bvcg'])
+
+    if positional[-1] == '-':
+        # calling from a pileup
+        write_calls('mpileup', sys.stdout, sites=read_pileup(sys.stdin))
+    else:
+        with open(positional[-1]) as fp:
+            shutil.copyfileobj(fp, sys.stdout)
+
+def vcfutils(args):
+    """vcfutils.pl varFilter (passes all records)"""
+    if args[0] != 'varFilter':
+        raise UsageError("unsupported command: %s" % args[0])
+
+    shutil.copyfileobj(sys.stdin, sys.stdout)
+
+def tabix(args):
+    """tabix -p vcf <file.vcf.gz> (creates an empty index)"""
+    (opts, positional) = options(args, flags=['-f'])
+
+    open("%s.tbi" % positional[-1], 'w').close()
+
+def java(args):
+    """java -jar <GATK / VarScan / Picard jar>"""
+    if args[0] != '-jar':
+        raise UsageError("only -jar is supported")
+
+    jar = os.path.basename(args[1])
+    args = args[2:]
+
+    if 'GenomeAnalysisTK' in jar:
+        (opts, positional) = options(args)
+
+        if opts['-T'] == 'UnifiedGenotyper':
+            with open(opts['-o'], 'w') as out:
+                write_calls('gatk', out, parse_region(opts.get('-L')))
+        elif opts['-T'] == 'VariantFiltration':
+            shutil.copyfile(opts['-V'], opts['-o'])
+        else:
+            raise UsageError("unsupported GATK tool: %s" % opts['-T'])
+    elif 'VarScan' in jar:
+        if args[0] == 'mpileup2snp':
+            write_calls('varscan', sys.stdout, sites=read_pileup(sys.stdin))
+        elif args[0] == 'mpileup2indel':
+            (header, records) = read_calls('varscan')
+            read_pileup(sys.stdin)
+            sys.stdout.writelines(header)
+        else:
+            raise UsageError("unsupported VarScan command: %s" % args[0])
+    elif 'CreateSequenceDictionary' in jar:
+        opts = dict(x.split('=', 1) for x in args)
+
+        with open(opts['O'], 'w') as out:
+            out.write("@HD\tVN:1.0\tSO:unsorted\n")
+
+            for (contig, length) in read_fasta_index(opts['R']):
+                out.write("@SQ\tSN:%s\tLN:%d\n" % (contig, length))
+    elif 'AddOrReplaceReadGroups' in jar:
+        opts = dict(x.split('=', 1) for x in args)
+        shutil.copyfile(opts['I'], opts['O'])
+    else:
+        raise UsageError("unsupported jar: %s" % jar)
+
+def stubcaller(args):
+    """stubcaller <output.vcf> <bam> [-r region]
+
+    Generic detector used for detectors beyond the built-in ones; reports the
+    calls in <name>.vcf of the synthetic data, where <name> is the name of
+    the output file.
+    """
+    (opts, (output, bam)) = options(args)
+    name = os.path.splitext(os.path.basename(output))[0]
+
+    drain(bam)
+
+    with open(output, 'w') as out:
+        write_calls(name, out, parse_region(opts.get('-r')))
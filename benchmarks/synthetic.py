@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic benchmark data
+
+Generates a reference genome, paired-end reads, a truth set and the calls made
+by each variant detector, at a configurable scale. The detector calls are
+served by the stand-in tools in `benchmarks/bin`, so that the complete
+pipeline can be run without the real mapping and variant calling tools.
+
+Layout of the generated data
+----------------------------
+reference.fasta(.fai)       Reference genome
+detectors.cfg               Registry for detectors beyond the built-in ones
+detectors/stubcaller.cmd    Command template for those detectors
+<sample>/reads_1.fastq      Paired-end reads
+<sample>/reads_2.fastq
+<sample>/truth.vcf          True variants
+<sample>/sites.tsv          Candidate sites (reported by the pileup stub)
+<sample>/<detector>.vcf     Calls made by each detector
+
+Example
+-------
+python benchmarks/synthetic.py --sites=1000000 --contigs=8 bench-data
+"""
+import os
+import sys
+import argparse
+import numpy as np
+
+# built-in detectors, and the VCF file served for each of them
+BUILTIN_DETECTORS = ['gatk', 'mpileup', 'varscan']
+
+BASES = np.array(list('ACGT'))
+
+# average distance between candidate sites
+SITE_SPACING = 20
+
+# FASTA line length
+LINE_LENGTH = 60
+
+class Scale(object):
+    """Size of a synthetic data set"""
+    def __init__(self, sites=100000, contigs=4, detectors=3, samples=1,
+                 read_pairs=1000, variant_rate=0.2, seed=0):
+        """Create a data set scale
+
+        Parameters
+        ----------
+        sites : int
+            Number of candidate sites (sites called by at least one
+            detector) per sample.
+        contigs : int
+            Number of contigs in the reference.
+        detectors : int
+            Number of variant detectors. The first three are the built-in
+            detectors; any further ones are declared in a separate registry.
+        samples : int
+            Number of samples.
+        read_pairs : int
+            Number of read pairs per sample.
+        variant_rate : float
+            Fraction of the candidate sites which are true variants.
+        seed : int
+            Random seed.
+        """
+        self.sites = sites
+        self.contigs = contigs
+        self.detectors = detectors
+        self.samples = samples
+        self.read_pairs = read_pairs
+        self.variant_rate = variant_rate
+        self.seed = seed
+
+    @property
+    def detector_names(self):
+        """Names of the detectors to use"""
+        names = BUILTIN_DETECTORS[:self.detectors]
+        names += ["caller%d" % (i + 1)
+                  for i in range(len(names), self.detectors)]
+        return names
+
+    @property
+    def sample_names(self):
+        """Names of the samples"""
+        return ["sample%d" % (i + 1) for i in range(self.samples)]
+
+    def contig_length(self):
+        """Length of each contig"""
+        return max(1000, (self.sites // self.contigs + 1) * SITE_SPACING)
+
+def generate(directory, scale):
+    """Generates a synthetic data set in the specified directory"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    rng = np.random.default_rng(scale.seed)
+
+    contigs = ["chr%d" % (i + 1) for i in range(scale.contigs)]
+    reference = write_reference(os.path.join(directory, 'reference.fasta'),
+                                contigs, scale.contig_length(), rng)
+
+    write_registry(directory, scale.detector_names)
+
+    for name in scale.sample_names:
+        generate_sample(os.path.join(directory, name), reference, scale, rng)
+
+def write_reference(filepath, contigs, length, rng):
+    """Writes a random reference genome and its FASTA index
+
+    Returns
+    -------
+    reference : dict
+        Mapping from contig name to its sequence (as an array of bases).
+    """
+    reference = {}
+
+    with open(filepath, 'w') as fp:
+        for contig in contigs:
+            sequence = BASES[rng.integers(0, 4, length)]
+            reference[contig] = sequence
+
+            fp.write(">%s\n" % contig)
+
+            for start in range(0, length, LINE_LENGTH):
+                fp.write("".join(sequence[start:start + LINE_LENGTH]))
+                fp.write("\n")
+
+    write_fasta_index(filepath)
+
+    return reference
+
+def write_fasta_index(filepath):
+    """Writes a SAMtools FASTA index (.fai) for a FASTA file"""
+    entries = []
+
+    with open(filepath, 'rb') as fp:
+        offset = 0
+        entry = None
+
+        for line in fp:
+            if line.startswith(b'>'):
+                entry = [line[1:].split()[0].decode(), 0,
+                         offset + len(line), None, None]
+                entries.append(entry)
+            elif entry is not None:
+                if entry[3] is None:
+                    entry[3] = len(line.rstrip(b'\n'))
+                    entry[4] = len(line)
+                entry[1] += len(line.rstrip(b'\n'))
+
+            offset += len(line)
+
+    with open("%s.fai" % filepath, 'w') as fp:
+        for entry in entries:
+            fp.write("\t".join(str(x) for x in entry) + "\n")
+
+def write_registry(directory, detectors):
+    """Declares the detectors beyond the built-in ones, which are all served
+    by the `stubcaller` stand-in tool"""
+    extra = [x for x in detectors if x not in BUILTIN_DETECTORS]
+
+    cmd_dir = os.path.join(directory, 'detectors')
+
+    if not os.path.isdir(cmd_dir):
+        os.makedirs(cmd_dir)
+
+    with open(os.path.join(cmd_dir, 'stubcaller.cmd'), 'w') as fp:
+        fp.write("stubcaller {vcf} {bam} {region_args}\n")
+
+    with open(os.path.join(directory, 'detectors.cfg'), 'w') as fp:
+        for name in extra:
+            fp.write("[%s]\n" % name)
+            fp.write("commands    = stubcaller.cmd\n")
+            fp.write("files       = vcf=%s.vcf\n" % name)
+            fp.write("output      = vcf\n")
+            fp.write("max_threads = 1\n")
+            fp.write("memory      = 0.5\n\n")
+
+def generate_sample(directory, reference, scale, rng):
+    """Generates the reads, truth set and detector calls for one sample"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    contigs = list(reference)
+    length = scale.contig_length()
+
+    # candidate sites, in reference order
+    per_contig = np.bincount(rng.integers(0, len(contigs), scale.sites),
+                             minlength=len(contigs))
+    sites = []
+
+    for (contig, n) in zip(contigs, per_contig):
+        positions = np.sort(rng.choice(np.arange(1, length + 1),
+                                       size=min(n, length), replace=False))
+        sites.append((contig, positions))
+
+    n = sum(len(x[1]) for x in sites)
+    chroms = np.concatenate([np.full(len(p), c, dtype=object)
+                             for (c, p) in sites])
+    positions = np.concatenate([p for (c, p) in sites])
+    refs = np.concatenate([reference[c][p - 1] for (c, p) in sites])
+
+    # alternate allele (never the reference base)
+    alts = BASES[(np.searchsorted(BASES, refs) + rng.integers(1, 4, n)) % 4]
+    depth = rng.integers(2, 80, n)
+    is_variant = rng.random(n) < scale.variant_rate
+
+    write_truth(os.path.join(directory, 'truth.vcf'), reference,
+                chroms[is_variant], positions[is_variant], refs[is_variant],
+                alts[is_variant])
+
+    with open(os.path.join(directory, 'sites.tsv'), 'w') as fp:
+        for i in range(n):
+            fp.write("%s\t%d\t%s\t%d\n" % (chroms[i], positions[i], refs[i],
+                                          depth[i]))
+
+    # true variants are called by most detectors, and other candidate sites
+    # by a few; every candidate site is called by at least one detector
+    calls = np.where(is_variant[:, None],
+                     rng.random((n, scale.detectors)) < 0.9,
+                     rng.random((n, scale.detectors)) < 0.3)
+    missed = np.flatnonzero(~calls.any(axis=1))
+    calls[missed, rng.integers(0, scale.detectors, len(missed))] = True
+
+    for (i, name) in enumerate(scale.detector_names):
+        called = calls[:, i]
+        quals = rng.gamma(2.0, 20.0, n) + np.where(is_variant, 30, 0)
+
+        write_calls(os.path.join(directory, "%s.vcf" % name), reference,
+                    chroms[called], positions[called], refs[called],
+                    alts[called], quals[called], depth[called])
+
+    write_reads(directory, reference, scale.read_pairs, rng)
+
+def vcf_header(reference, info=True):
+    """Returns the header lines of a VCF file"""
+    lines = ["##fileformat=VCFv4.1"]
+
+    for (contig, sequence) in reference.items():
+        lines.append("##contig=<ID=%s,length=%d>" % (contig, len(sequence)))
+
+    if info:
+        lines.append('##INFO=<ID=DP,Number=1,Type=Integer,'
+                     'Description="Read depth">')
+        lines.append('##FILTER=<ID=DepthFilter,Description="DP < 5">')
+
+    lines.append("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO")
+
+    return lines
+
+def write_truth(filepath, reference, chroms, positions, refs, alts):
+    """Writes the true variants as a VCF file"""
+    with open(filepath, 'w') as fp:
+        fp.write("\n".join(vcf_header(reference, info=False)) + "\n")
+
+        for record in zip(chroms, positions, refs, alts):
+            fp.write("%s\t%d\t.\t%s\t%s\t.\tPASS\t.\n" % record)
+
+def write_calls(filepath, reference, chroms, positions, refs, alts, quals,
+                depth):
+    """Writes the calls made by a single detector as a VCF file"""
+    with open(filepath, 'w') as fp:
+        fp.write("\n".join(vcf_header(reference)) + "\n")
+
+        for (chrom, pos, ref, alt, qual, dp) in zip(chroms, positions, refs,
+                                                    alts, quals, depth):
+            status = 'PASS' if dp >= 5 else 'DepthFilter'
+            fp.write("%s\t%d\t.\t%s\t%s\t%.2f\t%s\tDP=%d\n" % (
+                chrom, pos, ref, alt, qual, status, dp))
+
+def write_reads(directory, reference, read_pairs, rng, read_length=100):
+    """Writes paired-end reads sampled from the reference"""
+    contigs = list(reference)
+    names = ['reads_1.fastq', 'reads_2.fastq']
+    handles = [open(os.path.join(directory, x), 'w') for x in names]
+    quality = 'I' * read_length
+
+    try:
+        for i in range(read_pairs):
+            sequence = reference[contigs[rng.integers(0, len(contigs))]]
+            start = rng.integers(0, max(1, len(sequence) - 3 * read_length))
+
+            mates = [sequence[start:start + read_length],
+                     sequence[start + 2 * read_length:
+                              start + 3 * read_length][::-1]]
+
+            for (j, (fp, mate)) in enumerate(zip(handles, mates)):
+                fp.write("@read%d/%d\n%s\n+\n%s\n" % (i, j + 1, "".join(mate),
+                                                      quality))
+    finally:
+        for fp in handles:
+            fp.close()
+
+def parse_args(argv):
+    """Parses input arguments"""
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic EVE benchmark data')
+    parser.add_argument('directory', help='Directory to write the data to')
+    add_scale_arguments(parser)
+
+    return parser.parse_args(argv[1:])
+
+def add_scale_arguments(parser):
+    """Adds the data set scale options to an argument parser"""
+    parser.add_argument('--sites', type=int, default=100000,
+                        help='Number of candidate sites per sample')
+    parser.add_argument('--contigs', type=int, default=4,
+                        help='Number of contigs')
+    parser.add_argument('--detectors', type=int, default=3,
+                        help='Number of variant detectors')
+    parser.add_argument('--samples', type=int, default=1,
+                        help='Number of samples')
+    parser.add_argument('--read-pairs', type=int, default=1000,
+                        help='Number of read pairs per sample')
+    parser.add_argument('--variant-rate', type=float, default=0.2,
+                        help='Fraction of candidate sites which are variants')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+def scale_from_args(args):
+    """Creates a Scale from parsed arguments"""
+    return Scale(args.sites, args.contigs, args.detectors, args.samples,
+                 args.read_pairs, args.variant_rate, args.seed)
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv)
+    generate(args.directory, scale_from_args(args))
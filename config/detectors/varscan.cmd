@@ -1,3 +1,3 @@
-samtools mpileup -f {reference} {bam} > {mpileup_output}
-java -jar {jar} mpileup2snp {mpileup_output} --min-coverage 5 --output-vcf 1 > {varscan_snps}
-java -jar {jar} mpileup2indel {mpileup_output} --min-coverage 5 --output-vcf 1 > {varscan_indels}
+samtools mpileup -f {reference} {region_args} {bam} | java -jar {jar} mpileup2snp --min-coverage 5 --output-vcf 1 > {varscan_snps}
+# (indel calling skipped for now to speed things up...)
+#samtools mpileup -f {reference} {region_args} {bam} | java -jar {jar} mpileup2indel --min-coverage 5 --output-vcf 1 > {varscan_indels}
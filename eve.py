@@ -5,42 +5,51 @@ Ensemble Variant Detection (EVE)
 
 This file contains the main class and execution logic for the EVE variant
 detection pipeline.
+
+Only the modules needed to parse arguments, map reads and run the variant
+detectors are imported up front. The modules for the later stages (which
+depend on pandas, scikit-learn, PyVCF and matplotlib) are imported by the
+stages that use them, so that `--help`, and runs which stop after mapping or
+variant detection, start quickly.
 """
 import os
 import sys
-import vcf
-import glob
-import pandas
+import copy
 import logging
 import argparse
 import datetime
 import platform
-import subprocess
 import configparser
-import numpy as np
-from csv import DictReader
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import LabelEncoder,Imputer
-from sklearn.externals import joblib
-from eve import detectors,mappers
-
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as plt
+from eve import batch,execution,instrumentation,journal,mappers,pileup,regions,registry
+from eve.cache import StageCache
+from eve.scheduler import Scheduler,Task
 
 
 class EVE(object):
     """Ensemble Variant Detection"""
-    def __init__(self, argv):
+    def __init__(self, argv, args=None, prepare_reference=True):
+        """Create an EVE instance
+
+        Parameters
+        ----------
+        argv : list
+            Command-line arguments
+        args : argparse.Namespace
+            Already parsed arguments to use instead of `argv`.
+        prepare_reference : bool
+            Whether to check for (and if needed, create) the reference
+            indices. This can be skipped if it has already been done, e.g. by
+            an EVEBatch instance.
+        """
         # parse arguments
-        self.args = self.parse_args(argv)
+        self.args = args if args is not None else self.parse_args(argv)
+
+        # retries for failed external commands
+        execution.RETRIES = self.args.retries
+        execution.RETRY_DELAY = self.args.retry_delay
 
         # determine working/output directory to use
-        if self.args.output_dir == 'output/{timestamp}':
-            now = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
-            self.output_dir = self.args.output_dir.format(timestamp=now)
-        else:
-            self.output_dir = self.args.output_dir
+        self.output_dir = self.get_output_dir()
 
         # create working directories
         self.create_output_directories()
@@ -49,106 +58,253 @@ class EVE(object):
         self.initialize_logger()
         self.log_system_info()
 
+        # record of completed stages, used to resume interrupted runs
+        self.args.output_dir = self.output_dir
+        self.journal = journal.Journal(self.output_dir)
+        self.journal.save_args(self.args)
+
         # load configuration
         self.load_config()
 
-        # check for FASTA index and create if necessary
-        self.check_fasta_index()
+        # check for FASTA and BWA indices and create if necessary
+        if prepare_reference:
+            self.check_fasta_index()
 
-        # split fastq reads into two variables
-        (reads1, reads2) = self.args.input_reads
+            if 'bam' not in self.args:
+                self.check_bwa_index()
 
-        # output file
-        prefix = os.path.basename(
-                    os.path.commonprefix([reads1, reads2])).strip("_")
-        sam_filepath = "aln_%s.sam" % prefix
-
-        # filepath to final version
-        final_bam = sam_filepath.replace('.sam', '_sorted_RG.bam')
-
-        # filepath for mapped reads
-        mapped_reads = os.path.join(self.output_dir, 'mapped', sam_filepath)
-        mapped_reads_final = os.path.join(self.output_dir, 'mapped', final_bam)
+        # cache of mapping and variant detection output shared across runs
+        if self.args.cache_dir:
+            max_size = None
+            if self.args.cache_size:
+                max_size = int(self.args.cache_size * 1024**3)
+            self.stage_cache = StageCache(self.args.cache_dir, max_size)
+        else:
+            self.stage_cache = None
 
         # load mapper
         if 'bam' not in self.args:
-            if not os.path.exists(mapped_reads_final):
-                self.mapper = mappers.BWAMemMapper(self.args.fasta, reads1, reads2,
-                                                mapped_reads, self.args.num_threads)
-            else:
-                self.args.bam = mapped_reads.replace('.sam', '.bam')
+            # split fastq reads into two variables
+            (reads1, reads2) = self.args.input_reads
+
+            # output file
+            prefix = os.path.basename(
+                        os.path.commonprefix([reads1, reads2])).strip("_")
+            sam_filepath = "aln_%s.sam" % prefix
+
+            # filepath for mapped reads
+            mapped_reads = os.path.join(self.output_dir, 'mapped',
+                                        sam_filepath)
+
+            self.mapper = mappers.BWAMemMapper(self.args.fasta, reads1, reads2,
+                                               mapped_reads,
+                                               self.args.num_threads,
+                                               self.stage_cache,
+                                               self.args.stream_mapping)
 
     def run(self):
         """Main application process"""
+        try:
+            self.run_pipeline()
+        finally:
+            # write resource usage of each stage to the output directory
+            instrumentation.report.write(self.output_dir)
+
+    def run_pipeline(self):
+        """Runs each of the pipeline stages
+
+        Completed stages are recorded in the run journal, and skipped when
+        the run is resumed as long as their inputs and outputs are unchanged.
+        """
         # map reads
         if hasattr(self, 'mapper'):
-            logging.info("Mapping reads")
-            self.args.bam = self.mapper.run()
+            self.args.bam = self.run_mapping()
 
         # load detectors
         self.load_detectors()
 
         # run variant detectors
         logging.info("Running variant detection algorithms")
+        vcf_files = self.run_detectors()
 
-        # @TODO: parallelize
-        vcf_files = []
+        # normalize output from variant detectors and construct a pandas
+        # pandas DataFrame containing the results
+        self.run_combine(vcf_files)
 
-        for detector in self.detectors:
-            output = detector.run()
+        # train and/or run the classifier
+        self.run_classification()
 
-            if isinstance(output, list):
-                vcf_files += output
-            else:
-                vcf_files.append(output)
+    def run_classification(self, prefix=''):
+        """Trains a classifier on the combined matrix if a training set is
+        specified, and uses it (or a previously trained model) to score each
+        site
 
-        # normalize output from variant detectors and construct a pandas
-        # pandas DataFrame containing the results
-        df = self.combine_vcfs(vcf_files)
+        Parameters
+        ----------
+        prefix : str
+            Prefix of the matrices to use, e.g. 'cohort_' for the
+            `cohort_combined` matrix of a batch.
+        """
+        from eve import model, storage
 
-        df.to_csv(os.path.join(self.output_dir, "combined.csv"),
-                  index_label='position')
+        combined = storage.find_matrix(os.path.join(self.output_dir,
+                                                    '%scombined' % prefix))
 
         # run classifier
-        # (http://scikit-learn.org/stable/modules/generated/sklearn.ensemble.RandomForestClassifier.html)
         if self.args.training_set:
             clf_filepath = os.path.join(self.output_dir, 'random_forest.pkl')
-
-            # check to see if classifier already exists
-            # @TODO encode parameter information in filepath to ensure same
-            # settings were used
-            #if not os.path.exists(clf_filepath):
-            training_df = self.build_training_set(df)
-
-            # cast fields to string in case results come directly from PyVCF
-            # in which case the values would be VCF object instances (e.g.
-            # vcf.model._Substitution.
-            for x in ['gatk_filtered', 'mpileup', 'varscan_snps']:
-                training_df[x] = training_df[x].astype(str)
-
-            # training
-            (classifier, training_set, test_set, features, target_classes) = (
-                self.train_random_forest(training_df, clf_filepath)
+            inputs = [combined, self.args.training_set]
+            settings = "%s:%d:%d:%s:%d" % (
+                self.args.training_backend, self.args.cv_folds,
+                self.args.seed, self.args.negative_ratio,
+                self.args.hard_negative_window
             )
-            #else:
-            #    classifier = joblib.load(clf_filepath)
+            stage = '%straining' % prefix
+
+            if self.journal.is_complete(stage, inputs, settings):
+                logging.info("Training already completed. Skipping...")
+                model_bundle = model.load_model(clf_filepath)
+            else:
+                with instrumentation.stage('Training'):
+                    self.build_training_set(prefix)
+                    model_bundle = self.train_model(clf_filepath, prefix)
+
+                self.journal.mark_complete(stage, inputs, [clf_filepath],
+                                           settings)
+        elif self.args.model:
+            # use a previously trained classifier
+            logging.info("Loading model from %s" % self.args.model)
+            clf_filepath = self.args.model
+            model_bundle = model.load_model(self.args.model)
+        else:
+            logging.info("No training set or model specified; skipping "
+                         "prediction")
+            return
+
+        # perform prediction and output final VCF
+        inputs = [combined, clf_filepath]
+        stage = '%sprediction' % prefix
+
+        if self.journal.is_complete(stage, inputs):
+            logging.info("Prediction already completed. Skipping...")
+            return
+
+        with instrumentation.stage('Prediction'):
+            vcf_files = self.score_variants(model_bundle, prefix)
+
+        outputs = [storage.find_matrix(os.path.join(
+            self.output_dir, '%spredictions' % prefix))] + vcf_files
+        self.journal.mark_complete(stage, inputs, outputs)
+
+    def run_mapping(self):
+        """Maps the input reads, unless this was already done by an earlier
+        run, and returns the location of the BAM file"""
+        inputs = [self.args.fasta] + list(self.args.input_reads)
+        bam = self.mapper.bam_sorted_rg
+
+        if self.journal.is_complete('mapping', inputs):
+            logging.info("Mapping already completed. Skipping...")
+            return bam
+
+        logging.info("Mapping reads")
+        bam = self.mapper.run()
+
+        self.journal.mark_complete('mapping', inputs, [bam, "%s.bai" % bam])
+
+        return bam
+
+    def run_combine(self, vcf_files):
+        """Combines the variant detector output into a single matrix, unless
+        this was already done by an earlier run"""
+        from eve import storage
+
+        if self.journal.is_complete('combine', vcf_files):
+            logging.info("Combining already completed. Skipping...")
+            return
 
-        # perform prediction
-        self.predict_variants(classifier, test_set, features,
-                              target_classes)
+        with instrumentation.stage('Combine VCFs'):
+            df = self.combine_vcfs(vcf_files)
 
-        # output final VCF
+            self.write_matrix(df, "combined")
 
-    def predict_variants(self, classifier, test_set, features, target_classes):
-        """Uses a trained Random Forest classifier to predict variants"""
-        cls_predict = classifier.predict(test_set[features])
+        combined = storage.find_matrix(os.path.join(self.output_dir,
+                                                    'combined'))
+        self.journal.mark_complete('combine', vcf_files, [combined])
 
-        # map integer predictions back to the original classes
-        predictions = target_classes[cls_predict]
-        actual = target_classes[np.array(test_set['actual'])]
+    def score_variants(self, model_bundle, prefix=''):
+        """Uses a trained classifier to predict the allele at each site of
+        the combined matrix
 
-        pandas.crosstab(actual, predictions,
-                        rownames=['actual'], colnames=['preds'])
+        The stored combined matrix is streamed in chunks of
+        `--chunk-size` sites, and the predictions for each chunk are written
+        out (to the `predictions` matrix and, for predicted variants, to the
+        final `eve.vcf.gz` VCF) before the next one is read, so that memory
+        usage does not depend on the size of the genome. For a cohort matrix,
+        the variants of each sample are written to the `eve.vcf.gz` VCF in
+        the sample's own output directory.
+
+        Returns
+        -------
+        vcf_files : list
+            Filepaths of the VCF files written.
+        """
+        import pandas
+        from eve import storage, vcfio
+
+        combined = os.path.join(self.output_dir, '%scombined' % prefix)
+
+        logging.info("Scoring %d sites" % storage.matrix_length(combined))
+
+        chunks = storage.iter_matrix(combined,
+                                     chunk_size=self.args.chunk_size)
+        output = os.path.join(self.output_dir, '%spredictions' % prefix)
+
+        # the predicted variants are written to the final VCF in the same
+        # pass
+        reference = regions.FastaReference(self.args.fasta)
+        contigs = regions.read_fasta_index("%s.fai" % self.args.fasta)
+
+        if 'sample' in storage.matrix_index_names(combined):
+            vcf = vcfio.CohortVCFWriter(
+                lambda x: os.path.join(self.output_dir, x, 'eve.vcf.gz'),
+                reference, contigs)
+        else:
+            vcf = vcfio.EnsembleVCFWriter(
+                os.path.join(self.output_dir, 'eve.vcf.gz'), reference,
+                contigs)
+
+        with storage.MatrixWriter(output) as writer, vcf:
+            for (chunk, predictions, probabilities) in (
+                    model_bundle.predict_chunks(chunks)):
+                writer.write(pandas.DataFrame({
+                    'prediction': predictions,
+                    'probability': probabilities
+                }, index=chunk.index))
+
+                vcf.write(chunk, predictions, probabilities)
+
+        reference.close()
+
+        if self.args.csv:
+            storage.read_matrix(output).to_csv("%s.csv" % output)
+
+        if isinstance(vcf, vcfio.CohortVCFWriter):
+            return list(vcf.filepaths)
+        return [vcf.filepath]
+
+    def plot_feature_importance(self, model_bundle):
+        """Plots the relative importance of each feature used by a trained
+        classifier"""
+        import numpy as np
+        import matplotlib as mpl
+        mpl.use('Agg')
+        import matplotlib.pyplot as plt
+
+        classifier = model_bundle.classifier
+
+        # not available for all training backends
+        if not hasattr(classifier, 'feature_importances_'):
+            return
 
         # variable importantance
         # http://nbviewer.ipython.org/github/rauanmaemirov/kaggle-titanic101/blob/master/Titanic101.ipynb
@@ -159,241 +315,128 @@ class EVE(object):
         pos = np.arange(sorted_idx.shape[0]) + .5
 
         plt.barh(pos, feature_importance[sorted_idx], align='center')
-        plt.yticks(pos, test_set[features].columns[sorted_idx])
+        plt.yticks(pos, np.array(model_bundle.features)[sorted_idx])
         plt.xlabel('Relative feature importance')
         plt.ylabel('Feature name')
-        plt.title('EVE Random Forest Variable Importance');
+        plt.title('EVE Variable Importance');
         plt.savefig(os.path.join(self.output_dir,
                     'EVE_Variable_Importance.png'), bbox_inches='tight')
 
-    def train_random_forest(self, df, clf_filepath):
+    def train_model(self, clf_filepath, prefix=''):
         """
-        Trains a random forest classifier on the specified DataFrame.
+        Trains a classifier on the stored training set.
+
+        The training set is streamed from disk, and each of the training
+        backends (`--training-backend`) is evaluated using contig-grouped
+        cross-validation. The best backend is refit on the complete training
+        set and stored along with its metrics.
 
         Parameters
         ----------
-        df : pandas.DataFrame
-            A pandas DataFrame containing both the feature and target columns
-            to use for training.
         clf_filepath : str
             Filepath to store classifier at after training.
+        prefix : str
+            Prefix of the training set matrix, e.g. 'cohort_'.
 
         Returns
         -------
-        classifier : sklearn.ensemble.RandomForestClassifier
-            A trained scikit.learn RandomForestClassifier instance instance.
-        training_set : DataFrame
-            Training set DataFrame
-        test_set : DataFrame
-            Test set DataFrame
-        features : list
-            List of feature names used for classification
-        target_classes : list
-            List of target classes
-
-        TODO
-        ----
-        * Generalize code to handle arbitrary features.
-        * Cross-validation
-          (http://scikit-learn.org/stable/modules/cross_validation.html)
+        model_bundle : eve.model.ModelBundle
+            A trained classifier, along with the features, feature encoding,
+            target classes and cross-validation metrics.
 
         References
         ----------
         |http://scikit-learn.org/stable/modules/generated/sklearn.ensemble.RandomForestClassifier.html
+        |http://scikit-learn.org/stable/modules/cross_validation.html
         |http://scikit-learn.org/stable/tutorial/basic/tutorial.html#model-persistence
-        |http://blog.yhathq.com/posts/random-forests-in-python.html
 
         """
-        # Encode categorical features using one hot encoding
-        features = []
-
-        import pdb; pdb.set_trace()
-
-        for orig in ['gatk_filtered', 'mpileup', 'varscan_snps']:
-            # replace NaNs to be consistent with target
-            df[orig] = df[orig].replace(float('nan'), 'X')
-
-            one_hot = pandas.get_dummies(df[orig])
-            for val in one_hot.columns:
-                new = "%s=%s" % (orig, val)
-                df[new] = one_hot[val]
-                features.append(new)
-
-            # delete original column
-            df = df.drop(orig, 1)
-
-        # add quality scores and depth to the list of features to test
-        features = features + ['depth',  'gatk_filtered_qual',  'mpileup_qual',
-                               'varscan_snps_qual']
-
-        # replace nans and encode categorical variable as integers
-        df.actual = df.actual.replace(float('nan'), 'X')
-        df.actual = df.actual.astype(str)
-
-        encoder = LabelEncoder()
-        df.actual = encoder.fit_transform(df.actual)
-
-        #encoder.fit(df.actual)
-        #df.actual = encoder.transform(df.actual)
-
-        # impute missing data for quality scores
-        for x in ['gatk_filtered_qual',  'mpileup_qual', 'varscan_snps_qual']:
-            imputer = Imputer(axis=1)
-            df[x] = imputer.fit_transform(df[x])[0]
-
-        # split into training / test data
-        df['is_train'] = np.random.uniform(0, 1, len(df)) <= .80
-        training_set = df[df['is_train'] == True]
-        test_set = df[df['is_train'] == False]
-
-        # train the classifier
-        classifier = RandomForestClassifier(n_jobs=-1)
-        classifier.fit(training_set[features], training_set['actual'])
-
-        # store classifier
-        joblib.dump(classifier, clf_filepath)
-
-        # get the original target classes
-        num_classes = len(set(df.actual))
-
-        # array(['A', 'C', 'G', 'T', 'X'], dtype=object
-        target_classes = encoder.inverse_transform(range(num_classes))
-
-        return (classifier, training_set, test_set, features, target_classes)
+        from eve import trainer
+
+        model_bundle = trainer.train_model(
+            os.path.join(self.output_dir,
+                         '%scombined_training_set' % prefix),
+            os.path.join(self.output_dir, 'training_data'),
+            backends=self.args.training_backend.split(','),
+            folds=self.args.cv_folds,
+            threads=self.args.num_threads,
+            chunk_size=self.args.chunk_size,
+            seed=self.args.seed,
+            negative_ratio=self.args.negative_ratio,
+            hard_negative_window=self.args.hard_negative_window
+        )
+
+        # store classifier along with its feature encoding
+        model_bundle.save(clf_filepath)
+
+        trainer.write_metrics(model_bundle, os.path.join(self.output_dir,
+                                                         'training_metrics.json'))
+        self.plot_feature_importance(model_bundle)
+
+        return model_bundle
+
+    def build_training_set(self, prefix=''):
+        """Adds actual values to the end of the combined dataset
+
+        The combined matrix is processed a chunk at a time, and the result is
+        stored as the `combined_training_set` matrix (or, for a `prefix` such
+        as 'cohort_', as `cohort_combined_training_set`).
+        """
+        from eve import storage, training
 
-    def build_training_set(self, df):
-        """Adds actual values to the end of the combined dataset"""
-        import numpy as np
-        from sklearn.ensemble import RandomForestClassifier
-
-        # IUPAC codes (needed to parse wgsim output)
-        iupac = {
-            'R': ['A', 'G'],
-            'Y': ['C', 'T'],
-            'S': ['G', 'C'],
-            'W': ['A', 'T'],
-            'K': ['G', 'T'],
-            'M': ['A', 'C'],
-            'B': ['C', 'G', 'T'],
-            'D': ['A', 'G', 'T'],
-            'H': ['A', 'C', 'T'],
-            'V': ['A', 'C', 'G'],
-            'N': ['A', 'G', 'C', 'T']
-        }
-
-        # Add "truth" values
-        df['actual'] = np.repeat(float('nan'), df.shape[0])
-
-        # wgsim
+        # load "truth" values
         if (self.args.wgsim):
-            fp = open(self.args.training_set)
-            wgsim_fields = ['chr', 'pos', 'before', 'after', 'haplotype']
-            reader = DictReader(fp, delimiter='\t', fieldnames=wgsim_fields)
-
-            for row in reader:
-                # skip insertions, etc.
-                if row['before'] not in ['A', 'G', 'C', 'T']:
-                    continue
-                #if row['after'] not in iupac.keys():
-                if row['after'] not in ['A', 'G', 'C', 'T']:
-                    continue
-                pos = int(row['pos'])
-                if pos in df.index:
-                    df.loc[df[df.index == pos].index, 'actual'] = row['after']
-
+            truth = training.load_wgsim_truth(self.args.training_set)
         else:
             # If training set does not come from wgsim, for now, assume
             # it is a VCF from Genome in a Bottle...
-            # load VCF containing true answers
-            reader = vcf.Reader(open(self.args.training_set))
+            truth = training.load_vcf_truth(self.args.training_set)
 
-            for record in reader:
-                #if record.POS in df['position'].values:
-                if record.POS in df.index:
-                    # there is probably a cleaner way to do this, but I can't
-                    # think of it right now...
-                    df.loc[df[df.index == record.POS].index, 'actual'] = record.ALT[0]
+        combined = os.path.join(self.output_dir, '%scombined' % prefix)
+        output = os.path.join(self.output_dir,
+                              '%scombined_training_set' % prefix)
 
-        df.to_csv(os.path.join(self.output_dir, "combined_training_set.csv"),
-                  index_label='position')
+        with storage.MatrixWriter(output) as writer:
+            for chunk in storage.iter_matrix(combined,
+                                             chunk_size=self.args.chunk_size):
+                chunk['actual'] = training.label_sites(chunk, truth)
+                writer.write(chunk)
 
-        return df
+        if self.args.csv:
+            storage.read_matrix(output).to_csv("%s.csv" % output)
+
+    def write_matrix(self, df, name):
+        """Stores a matrix in the output directory, and optionally also
+        exports it as CSV"""
+        from eve import storage
+
+        storage.write_matrix(df, os.path.join(self.output_dir, name))
+
+        if self.args.csv:
+            df.to_csv(os.path.join(self.output_dir, "%s.csv" % name))
 
     def combine_vcfs(self, vcf_files):
         """Parses a collection of VCF files and creates a single matrix
         containing the calls for each position observed by any of the detection
         algorithms."""
+        from eve import combine
+
         logging.info("Combining output from variant detection tools")
 
-        # Load VCF files
-        unfiltered_vcf_readers = {}
+        # if indels, skip...
+        vcf_files = [x for x in vcf_files if
+                     os.path.splitext(os.path.basename(x))[0] != 'varscan_indels']
 
-        for filename in vcf_files:
-            name = os.path.splitext(os.path.basename(filename))[0]
+        # contig ids, in reference order
+        contigs = regions.ContigIndex.from_fasta_index(
+            "%s.fai" % self.args.fasta
+        )
 
-            # if indels, skip...
-            if name == 'varscan_indels':
-                continue
+        # the columns for each detector are stored separately, so that only
+        # the output of detectors which have been re-run needs to be parsed
+        parts_dir = os.path.join(self.output_dir, 'combined_parts')
 
-            unfiltered_vcf_readers[name] = vcf.Reader(open(filename))
-
-        # Remove filtered entries and (for now) non-SNPs
-        filtered_vcf_readers = {}
-
-        for name, reader in unfiltered_vcf_readers.items():
-            filtered = []
-
-            for record in reader:
-                if record.is_snp:
-                    if not record.FILTER or len(record.FILTER) == 0:
-                        filtered.append(record)
-
-            filtered_vcf_readers[name] = filtered
-
-        # Get calls for each algorithm at each position observed by any of the
-        # tools
-        combined_dict = {name:{} for name in filtered_vcf_readers.keys()}
-        combined_dict['depth'] = {}
-
-        for name,reader in filtered_vcf_readers.items():
-            # create a new column for the quality scores
-            qual_name = name + "_qual"
-            combined_dict[qual_name] = {}
-
-            for record in reader:
-                # @TODO: decide how to deal with multiple alleles
-                # i.e.: len(record.ALT) > 1
-
-                # Determine quality score to use
-                try:
-                    # GATK
-                    qual_score = record.INFO['QD']
-                except KeyError:
-                    try:
-                        # VarScan
-                        # http://varscan.sourceforge.net/support-faq.html#output-confidence
-                        qual_score = record.samples[0]['GQ']
-                    except:
-                        # mpileup
-                        # Also contains the Genotype Quality score used for
-                        # VarScan above...
-                        qual_score = record.QUAL / record.INFO['DP']
-
-                # Determine read depth (only need once...)
-                try:
-                    # GATK / mpileup
-                    depth = record.INFO['DP']
-                except KeyError:
-                    # VarScan
-                    depth = record.INFO['ADP']
-
-                # Add entries to the dictionary
-                combined_dict['depth'][record.POS] = depth
-                combined_dict[name][record.POS] = record.ALT[0]
-                combined_dict[qual_name][record.POS] = qual_score
-
-        # Convert to a DataFrame
-        return pandas.DataFrame.from_dict(combined_dict)
+        return combine.combine_vcfs_incremental(vcf_files, parts_dir, contigs)
 
     def check_fasta_index(self):
         """Checks for a valid FASTA index and creates one if needed"""
@@ -403,8 +446,7 @@ class EVE(object):
             cmd = "samtools faidx %s" % self.args.fasta
 
             logging.info("Creating a FASTA index")
-            logging.debug(cmd)
-            subprocess.call(cmd, shell=True)
+            execution.run_command(cmd, stage='Indexing')
 
         # Sequence dictionary
         base_filename = os.path.splitext(self.args.fasta)[0]
@@ -415,36 +457,240 @@ class EVE(object):
                 self.args.fasta, seqdict
             )
             logging.info("Creating a FASTA sequence dictionary")
-            logging.debug(cmd)
-            subprocess.call(cmd, shell=True)
+            execution.run_command(cmd, stage='Indexing')
+
+    def check_bwa_index(self):
+        """Checks for a BWA index of the reference and creates one if
+        needed"""
+        if not os.path.exists("%s.bwt" % self.args.fasta):
+            cmd = "bwa index %s" % self.args.fasta
+
+            logging.info("Creating a BWA index")
+            execution.run_command(cmd, stage='Indexing')
 
     def load_detectors(self):
         """Loads the variant detector instances"""
         # available detectors
-        mapping = {
-            'mpileup': (detectors.MpileupDetector, None),
-            'gatk'   : (detectors.GATKDetector,
-                        self.config['tools']['GATK_jar']),
-            'varscan': (detectors.VarScanDetector,
-                        self.config['tools']['VarScan_jar'])
-        }
+        available = registry.load_registry(
+            [registry.DEFAULT_REGISTRY] + self.args.detector_registry,
+            self.config['tools']
+        )
 
         # load detectors
         self.detectors = []
+        self.shards = {}
+
+        names = self.args.variant_detectors.split(',')
+
+        for name in names:
+            if name not in available:
+                raise ValueError("Unknown variant detector: %s (available: "
+                                 "%s)" % (name, ", ".join(sorted(available))))
+
+        specs = [available[x] for x in names]
+
+        # split the thread budget between the detectors, which are run
+        # concurrently, according to how many threads each can make use of
+        threads = registry.allocate_threads(specs, self.args.num_threads)
 
-        for detector in self.args.variant_detectors.split(','):
-            conf = os.path.join('config', 'detectors', '%s.cmd' % detector)
-            (cls, location) = mapping[detector]
+        # when scattering, parallelism comes from the shards instead
+        if self.args.scatter:
+            shards = self.load_regions()
+            threads = {x.name: 1 for x in specs}
 
-            self.detectors.append(cls(
-                self.args.bam, self.args.fasta, conf, self.output_dir,
-                self.args.num_threads, location
+        for spec in specs:
+            self.detectors.append(spec.create(
+                self.args.bam, self.args.fasta, self.output_dir,
+                threads[spec.name], stage_cache=self.stage_cache
             ))
 
+            if not self.args.scatter:
+                continue
+
+            # per-region detector instances
+            self.shards[spec.name] = []
+
+            for region in shards:
+                shard_dir = os.path.join(self.output_dir, 'shards',
+                                         region.name)
+
+                self.shards[spec.name].append(spec.create(
+                    self.args.bam, self.args.fasta, shard_dir,
+                    threads[spec.name], region, self.stage_cache
+                ))
+
+    def load_regions(self):
+        """Splits the reference genome into regions to process separately"""
+        contigs = regions.read_fasta_index("%s.fai" % self.args.fasta)
+        shards = regions.split_genome(contigs, self.args.shard_size)
+
+        logging.info("Splitting genome into %d regions" % len(shards))
+
+        for region in shards:
+            path = os.path.join(self.output_dir, 'shards', region.name, 'vcf')
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+        return shards
+
+    def run_detectors(self):
+        """Runs the variant detectors concurrently and returns a list of the
+        VCF files generated. Failure of a single detector is logged and the
+        remaining detectors are allowed to finish."""
+        scheduler = Scheduler(self.args.num_threads, self.args.max_memory)
+
+        # output of detectors completed by an earlier run
+        completed = {}
+
+        for detector in self.detectors:
+            if self._detection_complete(detector):
+                logging.info("%s already completed. Skipping..." %
+                             detector.title)
+                completed[detector.name] = detector.output()
+
+        pending = [x for x in self.detectors if x.name not in completed]
+
+        # detectors running SAMtools mpileup share a single pass over the BAM
+        # file (not possible when scattering, since regions are read using
+        # the BAM index)
+        shared = [x for x in pending if x.shared_pileup]
+
+        if len(shared) > 1 and not self.shards:
+            stage = pileup.SharedPileup(shared, self.args.bam, self.output_dir)
+            scheduler.add(Task('SharedPileup', stage.run,
+                               threads=stage.threads, memory=stage.memory))
+        else:
+            shared = []
+
+        for detector in pending:
+            name = detector.name
+
+            if detector in shared:
+                continue
+
+            if name not in self.shards:
+                scheduler.add(Task(name, detector.run,
+                                   threads=detector.threads,
+                                   memory=detector.memory))
+                continue
+
+            # scatter: run each region separately and gather the results
+            shard_outputs = {}
+            shard_tasks = []
+
+            for shard in self.shards[name]:
+                # shards completed by an earlier run
+                if self._detection_complete(shard):
+                    shard_outputs[shard.region.name] = shard.output()
+                    continue
+
+                task_name = "%s:%s" % (name, shard.region.name)
+                scheduler.add(Task(task_name,
+                                   self._run_shard(shard, shard_outputs),
+                                   threads=shard.threads,
+                                   memory=shard.memory))
+                shard_tasks.append(task_name)
+
+            scheduler.add(Task(name, self._gather_shards(name, shard_outputs),
+                               requires=shard_tasks))
+
+        (results, failed) = scheduler.run()
+
+        if 'SharedPileup' in results:
+            results.update(results.pop('SharedPileup'))
+
+        for detector in shared:
+            if detector.name not in results:
+                failed.append(detector.name)
+
+        if failed:
+            logging.warning("Variant detection failed for: %s" %
+                            ", ".join(failed))
+
+        for detector in pending:
+            if detector.name in results:
+                self._mark_detection_complete(detector)
+
+        results.update(completed)
+
+        # collect output in the order the detectors were specified
+        vcf_files = []
+
+        for detector in self.detectors:
+            name = detector.name
+
+            if name not in results:
+                continue
+
+            output = results[name]
+
+            if isinstance(output, list):
+                vcf_files += output
+            else:
+                vcf_files.append(output)
+
+        return vcf_files
+
+    def _detection_stage(self, detector):
+        """Returns the journal stage name for a detector or shard"""
+        if detector.region is None:
+            return "detection:%s" % detector.name
+        return "detection:%s:%s" % (detector.name, detector.region.name)
+
+    def _detection_complete(self, detector):
+        """Checks the journal for up-to-date output of a detector or shard"""
+        return self.journal.is_complete(self._detection_stage(detector),
+                                        [detector.bam, detector.fasta],
+                                        detector.stage_key())
+
+    def _mark_detection_complete(self, detector):
+        """Records the output of a detector or shard in the journal"""
+        self.journal.mark_complete(self._detection_stage(detector),
+                                   [detector.bam, detector.fasta],
+                                   detector.outputs(), detector.stage_key())
+
+    def _run_shard(self, shard, shard_outputs):
+        """Returns a function running a single shard of a variant detector"""
+        def run():
+            output = shard.run()
+            shard_outputs[shard.region.name] = output
+            self._mark_detection_complete(shard)
+            return output
+        return run
+
+    def _gather_shards(self, name, shard_outputs):
+        """Returns a function which concatenates the per-region output of a
+        variant detector in reference order"""
+        def gather():
+            outputs = [shard_outputs[shard.region.name]
+                       for shard in self.shards[name]]
+
+            # detectors may return either a single VCF or a list of VCFs
+            if isinstance(outputs[0], list):
+                return [self._gather_vcfs(list(x)) for x in zip(*outputs)]
+            return self._gather_vcfs(outputs)
+        return gather
+
+    def _gather_vcfs(self, shard_vcfs):
+        """Concatenates per-region VCFs into the main VCF output directory"""
+        output = os.path.join(self.output_dir, 'vcf',
+                              os.path.basename(shard_vcfs[0]))
+
+        # gathering is only skipped (by run_detectors) when the journal shows
+        # that none of the shards have changed since
+        return regions.gather_vcfs(shard_vcfs, output)
+
+    def get_output_dir(self):
+        """Determines the working/output directory to use"""
+        if self.args.output_dir == 'output/{timestamp}':
+            now = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
+            return self.args.output_dir.format(timestamp=now)
+        return self.args.output_dir
+
     def create_output_directories(self):
         """Creates directories to output intermediate files into"""
 
-        for subdir in ['mapped', 'vcf', 'mpileup']:
+        for subdir in ['mapped', 'vcf']:
             path = os.path.join(self.output_dir, subdir)
             if not os.path.isdir(path):
                 os.makedirs(path)
@@ -453,7 +699,8 @@ class EVE(object):
         """Initializes a logger instance"""
         logging.basicConfig(level=logging.DEBUG,
                 format='(%(asctime)s)[%(levelname)s] %(message)s',
-                filename=os.path.join(self.output_dir, 'eve.log'))
+                filename=os.path.join(self.output_dir, 'eve.log'),
+                force=True)
 
         # log to console as well
         console = logging.StreamHandler()
@@ -484,7 +731,12 @@ class EVE(object):
         processor = platform.processor()
 
         if system == "Linux":
-            distro = " ".join(platform.linux_distribution())
+            # platform.linux_distribution was removed in Python 3.8
+            try:
+                release = platform.freedesktop_os_release()
+                distro = release.get('PRETTY_NAME', release['NAME'])
+            except (AttributeError, OSError):
+                distro = "Unknown distribution"
             logging.debug("OS: %s (Linux %s %s)" %  (
                 distro, platform.release(), processor))
         elif system == "Darwin":
@@ -503,59 +755,143 @@ class EVE(object):
         # Python version
         logging.debug("Python %s" % platform.python_version())
 
-        # Check python dependencies
-        try:
-            from numpy import __version__ as numpy_version
-        except ImportError:
-            numpy_version = "NOT INSTALLED"
-
-        try:
-            from scipy import __version__ as scipy_version
-        except ImportError:
-            scipy_version = "NOT INSTALLED"
+        # Check python dependencies (using the package metadata, so that the
+        # packages themselves do not need to be imported)
+        from importlib import metadata
 
-        try:
-            from sklearn import __version__ as sklearn_version
-        except ImportError:
-            sklearn_version = "NOT INSTALLED"
+        for (title, package) in [('NumPy', 'numpy'), ('SciPy', 'scipy'),
+                                 ('Scikit-Learn', 'scikit-learn')]:
+            try:
+                version = metadata.version(package)
+            except metadata.PackageNotFoundError:
+                version = "NOT INSTALLED"
 
-        logging.debug("NumPy: %s" % numpy_version)
-        logging.debug("SciPy: %s" % scipy_version)
-        logging.debug("Scikit-Learn: %s" % sklearn_version)
+            logging.debug("%s: %s" % (title, version))
 
         # @TODO: command-line tool versions (SAMtools, etc)
 
-    def parse_args(self, argv):
+    @staticmethod
+    def parse_args(argv):
         """Parses input arguments"""
         parser = argparse.ArgumentParser(
                 description='Ensemble Variant Detection')
-        parser.add_argument('input_reads', nargs='+',
+        parser.add_argument('input_reads', nargs='*',
                             help=('Input paired-end Illumina reads or '
                                   'alignment. Supported file formats include '
                                   '.fastq, .fastq.gz, and .bam'))
-        parser.add_argument('-f', '--fasta', required=True,
+        parser.add_argument('-s', '--sample-sheet',
+                            help=('Tab-delimited file listing multiple '
+                                  'samples to process (columns: sample, '
+                                  'reads1, reads2 or sample, bam)'))
+        parser.add_argument('--max-workers', type=int,
+                            help=('Maximum number of samples to process at '
+                                  'once when using a sample sheet'))
+        parser.add_argument('--sample-memory', type=float, default=8,
+                            help=('Expected peak memory usage per sample in '
+                                  'GB, used to limit the number of samples '
+                                  'processed at once'))
+        parser.add_argument('-f', '--fasta',
                             help='Location of genome sequence file to use.')
         #parser.add_argument('-g', '--gff', required=True,
         #                    help='Location of GFF annotation file to use.')
         parser.add_argument('-m', '--mapper', default='bwa',
                             help='Mapper to use for read alignment')
-        parser.add_argument('-n', '--num-threads', default='4',
+        parser.add_argument('--stream-mapping', action='store_true',
+                            help=('Pipe BWA output directly into SAMtools '
+                                  'sort instead of writing intermediate '
+                                  'SAM/BAM files (requires SAMtools >= 1.0)'))
+        parser.add_argument('--csv', action='store_true',
+                            help=('Also write the combined and training '
+                                  'matrices as CSV files'))
+        parser.add_argument('--chunk-size', default=100000, type=int,
+                            help=('Number of sites to score at a time during '
+                                  'prediction'))
+        parser.add_argument('-n', '--num-threads', default=4, type=int,
                             help='Maximum number of threads to use')
-        parser.add_argument('-t', '--training-set',
+        parser.add_argument('-t', '--training-set', '--train',
                             help='Run EVE in training mode')
+        parser.add_argument('--model',
+                            help=('Previously trained model to use for '
+                                  'prediction when no training set is '
+                                  'specified'))
+        parser.add_argument('--training-backend', default='forest',
+                            help=('Comma-separated list of the training '
+                                  'backends to compare using cross-'
+                                  'validation (available: forest, '
+                                  'boosting)'))
+        parser.add_argument('--cv-folds', type=int, default=5,
+                            help=('Number of cross-validation folds to use '
+                                  'when training (0 to skip '
+                                  'cross-validation)'))
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed used for training')
+        parser.add_argument('--negative-ratio', type=float, default=10,
+                            help=('Number of reference (majority class) sites '
+                                  'to sample for training for each variant '
+                                  'site (0 to train on all sites)'))
+        parser.add_argument('--hard-negative-window', type=int, default=0,
+                            help=('Always train on reference sites within '
+                                  'this many bases of a true variant'))
         parser.add_argument('--wgsim', action='store_true',
                             help='Use wgsim output for training')
         parser.add_argument('-d', '--variant-detectors',
                             default='gatk,mpileup,varscan',
                             help=('Comma-separated list of the variant '
                                   'detectors to be used.'))
+        parser.add_argument('--detector-registry', action='append',
+                            default=[],
+                            help=('Additional detector registry file '
+                                  'declaring variant detectors (may be '
+                                  'specified more than once)'))
+        parser.add_argument('--retries', type=int, default=2,
+                            help=('Number of times to retry failed mapping '
+                                  'and variant detection commands'))
+        parser.add_argument('--retry-delay', type=float, default=5,
+                            help=('Delay in seconds before retrying a failed '
+                                  'command (doubled for each further retry)'))
+        parser.add_argument('--max-memory', type=float,
+                            help=('Memory budget in GB used when deciding '
+                                  'which variant detectors to run at the '
+                                  'same time (default: no limit)'))
+        parser.add_argument('--scatter', action='store_true',
+                            help=('Run the variant detectors separately for '
+                                  'each region of the genome'))
+        parser.add_argument('--shard-size', type=int,
+                            help=('Size of the regions to use when '
+                                  'scattering (default: one region per '
+                                  'contig)'))
+        parser.add_argument('--cache-dir',
+                            help=('Directory in which to cache mapping and '
+                                  'variant detection output for reuse across '
+                                  'runs'))
+        parser.add_argument('--cache-size', type=float,
+                            help='Maximum size of the cache in GB')
         parser.add_argument('-o', '--output-dir',
                             default='output/{timestamp}',
                             help=('Location to store intermediate and output '
                                   'files'))
-        args = parser.parse_args()
+        parser.add_argument('--resume', metavar='OUTPUT_DIR',
+                            help=('Resume an interrupted run from its output '
+                                  'directory, using the arguments it was '
+                                  'started with and skipping the stages it '
+                                  'completed'))
+        args = parser.parse_args(argv[1:])
+
+        # continue an earlier run with its original arguments
+        if args.resume:
+            return journal.load_args(args.resume)
 
         # validate input arguments
+        if not args.fasta:
+            parser.error("the following arguments are required: -f/--fasta")
+        if args.sample_sheet:
+            if args.input_reads:
+                raise IOError("Input reads can not be specified together "
+                              "with a sample sheet")
+            if not os.path.exists(args.sample_sheet):
+                raise IOError("Invalid sample sheet filepath specified")
+        elif not args.input_reads:
+            raise IOError("No input reads specified")
         if len(args.input_reads) > 2:
             raise IOError("Too many input arguments specified")
         for x in args.input_reads:
@@ -565,6 +901,12 @@ class EVE(object):
         #if not os.path.isfile(args.gff):
         #    raise IOError("Invalid GFF filepath specified")
 
+        if args.model and not os.path.isfile(args.model):
+            raise IOError("Invalid model filepath specified")
+
+        if args.shard_size:
+            args.scatter = True
+
         # determine input type (FASTQ or BAM)
         if len(args.input_reads) == 1 and args.input_reads[0].endswith('.bam'):
             args.bam = args.input_reads[0]
@@ -576,6 +918,147 @@ class EVE(object):
         self.config = configparser.ConfigParser()
         self.config.read('config/eve.cfg')
 
+class EVEBatch(EVE):
+    """Runs EVE for each of the samples listed in a sample sheet
+
+    The reference is prepared once for the whole batch, after which the
+    per-sample pipelines (up to and including the combined matrix) are run on
+    a pool of worker processes. The combined matrices of all samples are then
+    merged into a cohort matrix, which is used for training and prediction.
+    """
+    def __init__(self, argv):
+        # parse arguments
+        self.args = self.parse_args(argv)
+
+        # retries for failed external commands
+        execution.RETRIES = self.args.retries
+        execution.RETRY_DELAY = self.args.retry_delay
+
+        # determine working/output directory to use
+        self.output_dir = self.get_output_dir()
+
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        # initialize logger
+        self.initialize_logger()
+        self.log_system_info()
+
+        # the arguments are recorded so that the batch can be resumed; the
+        # stages of each sample are recorded in the sample's own journal
+        self.args.output_dir = self.output_dir
+        self.journal = journal.Journal(self.output_dir)
+        self.journal.save_args(self.args)
+
+        # load configuration
+        self.load_config()
+
+        self.samples = batch.read_sample_sheet(self.args.sample_sheet)
+
+    def run(self):
+        """Runs each of the samples in the batch"""
+        # shared reference preparation
+        self.check_fasta_index()
+
+        if not all(x.is_bam for x in self.samples):
+            self.check_bwa_index()
+
+        # the per-sample stages import these modules when they are first
+        # used; import them here, before the pool forks, so that the workers
+        # share them instead of each importing them again (the names are not
+        # used in this method)
+        from eve import combine, storage
+
+        jobs = [(x.name, self.sample_args(x)) for x in self.samples]
+
+        size = batch.pool_size(len(jobs), self.args.num_threads,
+                               int(self.args.sample_memory * 1024**3),
+                               self.args.max_workers)
+
+        results = batch.run_pool(run_sample, jobs, size)
+
+        failed = [x.name for (x, success) in zip(self.samples, results)
+                  if not success]
+
+        # combine the output for all samples into a single matrix
+        with instrumentation.stage('Cohort combine'):
+            df = self.combine_samples([x for (x, success) in
+                                       zip(self.samples, results) if success])
+
+        # train and/or run the classifier on the whole cohort at once
+        if df is not None:
+            self.run_classification('cohort_')
+
+        instrumentation.report.write(self.output_dir)
+
+        if failed:
+            logging.error("Processing failed for samples: %s" %
+                          ", ".join(failed))
+            return 1
+
+        logging.info("Finished processing %d samples" % len(self.samples))
+        return 0
+
+    def combine_samples(self, samples):
+        """Merges the combined matrices for each of the samples into a single
+        matrix indexed by (sample, contig, position)"""
+        from eve import cohort, storage
+
+        if not samples:
+            return None
+
+        logging.info("Combining output for %d samples" % len(samples))
+
+        matrices = [(x.name, storage.read_matrix(
+                        os.path.join(self.output_dir, x.name, 'combined')))
+                    for x in samples]
+
+        contigs = regions.ContigIndex.from_fasta_index(
+            "%s.fai" % self.args.fasta
+        )
+
+        df = cohort.combine_samples(matrices, contigs)
+
+        self.write_matrix(df, "cohort_combined")
+
+        return df
+
+    def sample_args(self, sample):
+        """Returns the arguments to use for a single sample"""
+        args = copy.copy(self.args)
+
+        args.sample_sheet = None
+        args.input_reads = sample.input_reads
+        args.output_dir = os.path.join(self.output_dir, sample.name)
+
+        # training and prediction are run on the cohort matrix once all
+        # samples have been combined
+        args.training_set = None
+        args.model = None
+
+        if sample.is_bam:
+            args.bam = sample.input_reads[0]
+
+        return args
+
+def run_sample(job):
+    """Runs the EVE pipeline for a single sample of a batch"""
+    (name, args) = job
+
+    # start with a fresh report for the sample
+    instrumentation.reset()
+
+    try:
+        EVE(None, args=args, prepare_reference=False).run()
+    except Exception:
+        logging.exception("Processing of sample %s failed" % name)
+        return False
+
+    return True
+
 if __name__ == '__main__':
-    app = EVE(sys.argv)
+    if EVE.parse_args(sys.argv).sample_sheet:
+        app = EVEBatch(sys.argv)
+    else:
+        app = EVE(sys.argv)
     sys.exit(app.run())
@@ -0,0 +1,124 @@
+"""
+Batch processing
+
+Helper functions for running EVE on many samples at once: reading sample
+sheets, and running the per-sample pipelines on a pool of worker processes
+sized to the resources available on the machine.
+"""
+import os
+import csv
+import logging
+import multiprocessing
+
+class Sample(object):
+    """A single sample listed in a sample sheet"""
+    def __init__(self, name, input_reads):
+        self.name = name
+        self.input_reads = input_reads
+
+    @property
+    def is_bam(self):
+        """Whether the sample input is an existing alignment"""
+        return (len(self.input_reads) == 1 and
+                self.input_reads[0].endswith('.bam'))
+
+def read_sample_sheet(filepath):
+    """Reads a tab-delimited sample sheet
+
+    The sample sheet must include a header with a 'sample' column, and either
+    'reads1' and 'reads2' columns (paired-end FASTQ files) or a 'bam' column
+    (alignment). Relative filepaths are interpreted relative to the location
+    of the sample sheet.
+
+    Returns
+    -------
+    samples : list
+        List of Sample instances.
+    """
+    base_dir = os.path.dirname(os.path.abspath(filepath))
+    samples = []
+    names = set()
+
+    with open(filepath) as fp:
+        reader = csv.DictReader(
+            (x for x in fp if x.strip() and not x.startswith('#')),
+            delimiter='\t'
+        )
+
+        for row in reader:
+            name = row['sample'].strip()
+
+            if row.get('bam'):
+                input_reads = [row['bam']]
+            else:
+                input_reads = [row['reads1'], row['reads2']]
+
+            input_reads = [os.path.join(base_dir, x.strip())
+                           for x in input_reads]
+
+            for x in input_reads:
+                if not os.path.exists(x):
+                    raise IOError("Invalid input filepath specified for "
+                                  "sample %s: %s" % (name, x))
+            if name in names:
+                raise IOError("Duplicate sample name: %s" % name)
+
+            names.add(name)
+            samples.append(Sample(name, input_reads))
+
+    return samples
+
+def total_memory():
+    """Returns the total amount of physical memory in bytes"""
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+def pool_size(num_samples, threads_per_sample, memory_per_sample=None,
+              max_workers=None):
+    """Determines the number of samples to process at a time
+
+    Parameters
+    ----------
+    num_samples : int
+        Number of samples in the batch.
+    threads_per_sample : int
+        Number of threads used by each sample.
+    memory_per_sample : int
+        Expected peak memory usage of each sample in bytes.
+    max_workers : int
+        Upper limit on the number of workers.
+
+    Returns
+    -------
+    size : int
+        Number of worker processes to use.
+    """
+    size = max(1, multiprocessing.cpu_count() // max(1, threads_per_sample))
+
+    if memory_per_sample:
+        size = min(size, max(1, total_memory() // memory_per_sample))
+    if max_workers:
+        size = min(size, max_workers)
+
+    return max(1, min(size, num_samples))
+
+def run_pool(func, jobs, processes):
+    """Runs a function for each of a list of jobs on a pool of worker
+    processes
+
+    Worker processes are forked from the current process, so that any
+    modules and shared state (configuration, etc.) are only loaded once.
+    Each worker handles a single job, so that memory is returned to the
+    system between samples.
+
+    Returns
+    -------
+    results : list
+        Return value of the function for each job, in order.
+    """
+    logging.info("Processing %d samples using %d workers" % (len(jobs),
+                                                            processes))
+
+    context = multiprocessing.get_context('fork')
+
+    with context.Pool(processes, maxtasksperchild=1) as pool:
+        return pool.map(func, jobs, chunksize=1)
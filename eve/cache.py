@@ -0,0 +1,286 @@
+"""
+Stage cache
+
+A content-addressed cache for the output of pipeline stages (read mapping,
+variant detection). Each stage is identified by a key derived from its input
+files, the fully rendered commands it runs and the tools used to run them,
+so that stages are only re-run when something they depend on has changed.
+Cached outputs are shared across runs under a common cache root, and the
+least recently used entries are evicted once the cache grows beyond its
+maximum size.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+
+def file_fingerprint(filepath, digest=False):
+    """Returns a string identifying the contents of a file
+
+    By default, the fingerprint is based on the file size and modification
+    time. If `digest` is True, a SHA-1 digest of the file contents is used
+    instead, which is slower but robust to files being touched or copied.
+    """
+    if not os.path.exists(filepath):
+        return 'missing'
+
+    if not digest:
+        stat = os.stat(filepath)
+        return "%d:%d" % (stat.st_size, stat.st_mtime_ns)
+
+    sha1 = hashlib.sha1()
+
+    with open(filepath, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+def tool_fingerprints(commands):
+    """Returns fingerprints for the executables (and Java jars) used by a
+    list of shell commands
+
+    The fingerprint of the executable file is used as a stand-in for the
+    tool version, so that upgrading a tool invalidates any cached output.
+    """
+    fingerprints = {}
+
+    for cmd in commands:
+        for part in cmd.split('|'):
+            words = part.split()
+
+            if not words:
+                continue
+
+            tools = [words[0]]
+
+            # java -jar <jar>
+            if '-jar' in words[:-1]:
+                tools.append(words[words.index('-jar') + 1])
+
+            for tool in tools:
+                path = tool if os.path.exists(tool) else shutil.which(tool)
+                fingerprints[tool] = file_fingerprint(path) if path else 'missing'
+
+    return fingerprints
+
+def stage_key(inputs, commands, output_dir=None, digest=False):
+    """Computes the cache key for a pipeline stage
+
+    Inputs which were created by another cached stage (e.g. the BAM file
+    used by the variant detectors) are identified by the key of that stage,
+    so that the key does not depend on the output directory they were
+    created in. Other inputs are identified by their location and
+    fingerprint.
+
+    Parameters
+    ----------
+    inputs : list
+        Input files used by the stage.
+    commands : list
+        Fully rendered commands run by the stage.
+    output_dir : str
+        Output directory of the run. Occurrences in the commands are
+        replaced with a placeholder so that keys can be shared across runs.
+    digest : bool
+        Whether to fingerprint the input files using a content digest rather
+        than their size and modification time.
+
+    Returns
+    -------
+    key : str
+        Hexadecimal SHA-1 key.
+    """
+    tools = tool_fingerprints(commands)
+    identities = []
+
+    for (i, filepath) in enumerate(inputs):
+        placeholder = "{input%d}" % i
+        stage = producer_key(filepath)
+
+        if stage is not None:
+            identities.append((placeholder, "stage:%s" % stage))
+        else:
+            identities.append((placeholder, os.path.abspath(filepath),
+                               file_fingerprint(filepath, digest)))
+
+        # the inputs are identified above, wherever they are located
+        commands = [x.replace(filepath, placeholder) for x in commands]
+
+    if output_dir:
+        commands = [x.replace(output_dir, '{output_dir}') for x in commands]
+
+    description = {
+        'inputs': identities,
+        'commands': commands,
+        'tools': tools
+    }
+
+    encoded = json.dumps(description, sort_keys=True).encode('utf-8')
+
+    return hashlib.sha1(encoded).hexdigest()
+
+def producer_key(filepath):
+    """Returns the key of the stage which created a file, or None if the file
+    was not created by a cached stage or has been modified since"""
+    stamp = "%s.key" % filepath
+
+    if not os.path.exists(filepath) or not os.path.exists(stamp):
+        return None
+
+    # the stamp is written once the file is complete
+    if os.stat(stamp).st_mtime_ns < os.stat(filepath).st_mtime_ns:
+        return None
+
+    with open(stamp) as fp:
+        return fp.read().strip() or None
+
+def is_current(outputs, key):
+    """Checks whether a set of outputs exists and was created by the stage
+    with the specified key"""
+    for filepath in outputs:
+        if not os.path.exists(filepath):
+            return False
+
+        stamp = "%s.key" % filepath
+
+        if not os.path.exists(stamp):
+            return False
+
+        with open(stamp) as fp:
+            if fp.read().strip() != key:
+                return False
+
+    return True
+
+def mark_current(outputs, key):
+    """Records the key of the stage which created a set of outputs"""
+    for filepath in outputs:
+        with open("%s.key" % filepath, 'w') as fp:
+            fp.write(key)
+
+class StageCache(object):
+    """Cache of pipeline stage outputs shared across runs"""
+    def __init__(self, root, max_size=None):
+        """Create a stage cache
+
+        Parameters
+        ----------
+        root : str
+            Directory to store cached outputs in.
+        max_size : int
+            Maximum total size of the cache in bytes.
+        """
+        self.root = root
+        self.max_size = max_size
+
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def _entry(self, key):
+        """Returns the directory for a cache entry"""
+        return os.path.join(self.root, key)
+
+    def fetch(self, key, outputs):
+        """Copies the cached outputs for a stage to the specified filepaths
+
+        Returns True if the stage was found in the cache, and False otherwise.
+        """
+        entry = self._entry(key)
+        manifest = os.path.join(entry, 'manifest.json')
+
+        if not os.path.exists(manifest):
+            return False
+
+        with open(manifest) as fp:
+            names = json.load(fp)['outputs']
+
+        if len(names) != len(outputs):
+            return False
+
+        for (name, filepath) in zip(names, outputs):
+            _link_or_copy(os.path.join(entry, name), filepath)
+
+        # mark entry as recently used
+        os.utime(manifest, None)
+
+        mark_current(outputs, key)
+
+        return True
+
+    def store(self, key, outputs):
+        """Adds the outputs of a stage to the cache"""
+        entry = self._entry(key)
+
+        if os.path.exists(entry):
+            return
+
+        tmp = "%s.tmp%d" % (entry, os.getpid())
+        os.makedirs(tmp)
+
+        names = []
+
+        for (i, filepath) in enumerate(outputs):
+            name = "%d_%s" % (i, os.path.basename(filepath))
+            _link_or_copy(filepath, os.path.join(tmp, name))
+            names.append(name)
+
+        with open(os.path.join(tmp, 'manifest.json'), 'w') as fp:
+            json.dump({'outputs': names, 'created': time.time()}, fp)
+
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # stored concurrently by another run
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict()
+
+    def size(self):
+        """Returns the total size of the cache in bytes"""
+        return sum(size for (_, _, size) in self._entries())
+
+    def _entries(self):
+        """Returns (last used, key, size) tuples for all cache entries"""
+        entries = []
+
+        for key in os.listdir(self.root):
+            manifest = os.path.join(self.root, key, 'manifest.json')
+
+            if not os.path.exists(manifest):
+                continue
+
+            size = sum(os.path.getsize(os.path.join(self.root, key, x))
+                       for x in os.listdir(os.path.join(self.root, key)))
+            entries.append((os.path.getmtime(manifest), key, size))
+
+        return entries
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is within
+        its maximum size"""
+        if self.max_size is None:
+            return
+
+        entries = sorted(self._entries())
+        total = sum(size for (_, _, size) in entries)
+
+        for (_, key, size) in entries:
+            if total <= self.max_size:
+                break
+
+            logging.debug("Evicting %s from stage cache" % key)
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+
+def _link_or_copy(src, dst):
+    """Hard-links a file, falling back to copying it if linking fails"""
+    if os.path.exists(dst):
+        os.unlink(dst)
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
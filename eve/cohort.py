@@ -0,0 +1,126 @@
+"""
+Cohort matrix
+
+Merges the combined matrices of the samples in a batch into a single matrix
+indexed by (sample, contig, position), so that training and prediction can be
+run over the whole cohort at once.
+
+All samples share the same dictionaries for samples, contigs and alleles, and
+compact column dtypes are used: alleles are categorical (with one set of
+categories for all detectors), and quality scores and read depths are stored
+as float32, with NaN for values which were not reported.
+"""
+import numpy as np
+import pandas
+from eve.regions import ContigIndex
+
+def combine_samples(matrices, contigs=None):
+    """Combines the matrices for several samples into a cohort matrix
+
+    Parameters
+    ----------
+    matrices : list
+        (sample name, combined matrix) tuples, as returned by
+        `combine.combine_vcfs`.
+    contigs : ContigIndex
+        Contig ids to use. Contigs which are not part of the index are added
+        in the order in which they are encountered.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        DataFrame indexed by (sample, contig, position), with an allele column
+        and a quality column for each detector used by any of the samples,
+        as well as a read depth column. Depths which were not reported are
+        stored as NaN.
+    """
+    if not isinstance(contigs, ContigIndex):
+        contigs = ContigIndex(contigs)
+
+    samples = [name for (name, df) in matrices]
+    callers = detector_names(x for (_, x) in matrices)
+    alleles = allele_categories((x for (_, x) in matrices), callers)
+
+    # shared dictionaries
+    for (_, df) in matrices:
+        for name in df.index.get_level_values('contig').unique():
+            contigs[name]
+
+    sample_ids = []
+    contig_ids = []
+    positions = []
+    allele_codes = {x: [] for x in callers}
+    quals = {x: [] for x in callers}
+    depths = []
+
+    for (i, (_, df)) in enumerate(matrices):
+        n = len(df)
+
+        sample_ids.append(np.full(n, i, dtype=np.int32))
+        contig_ids.append(
+            contigs.encode(df.index.get_level_values('contig'))
+        )
+        positions.append(
+            df.index.get_level_values('position').values.astype(np.int32)
+        )
+
+        for name in callers:
+            if name in df:
+                allele_codes[name].append(pandas.Categorical(
+                    df[name].values, categories=alleles).codes)
+                quals[name].append(
+                    df[name + "_qual"].values.astype(np.float32))
+            else:
+                allele_codes[name].append(np.full(n, -1, dtype=np.int32))
+                quals[name].append(np.full(n, np.nan, dtype=np.float32))
+
+        depths.append(df['depth'].to_numpy(np.float32, na_value=np.nan))
+
+    index = pandas.MultiIndex.from_arrays([
+        pandas.Categorical.from_codes(_concat(sample_ids, np.int32), samples),
+        contigs.categorical(_concat(contig_ids, np.int32)),
+        _concat(positions, np.int32)
+    ], names=['sample', 'contig', 'position'])
+
+    columns = {}
+
+    for name in callers:
+        columns[name] = pandas.Categorical.from_codes(
+            _concat(allele_codes[name], np.int32), alleles)
+    columns['depth'] = _concat(depths, np.float32)
+    for name in callers:
+        columns[name + "_qual"] = _concat(quals[name], np.float32)
+
+    return pandas.DataFrame(columns, index=index)
+
+def detector_names(matrices):
+    """Returns the names of the detectors used in any of a collection of
+    combined matrices, in the order in which they are first encountered"""
+    names = []
+
+    for df in matrices:
+        for column in df.columns:
+            if (column != 'depth' and not column.endswith('_qual') and
+                    column not in names):
+                names.append(column)
+
+    return names
+
+def allele_categories(matrices, callers):
+    """Returns the sorted list of alleles called by any of the detectors"""
+    alleles = set()
+
+    for df in matrices:
+        for name in callers:
+            if name in df:
+                values = pandas.unique(df[name].values)
+                alleles.update(x for x in values if pandas.notnull(x))
+
+    return sorted(alleles)
+
+def _concat(arrays, dtype):
+    """Concatenates a list of arrays, returning an empty array of the
+    specified dtype if the list is empty"""
+    if not arrays:
+        return np.empty(0, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype, copy=False)
@@ -0,0 +1,298 @@
+"""
+Combining of variant detector output
+
+Functions for merging the VCF files generated by the individual variant
+detectors into a single matrix with one row per observed position. The VCF
+files are expected to be coordinate-sorted, which allows them to be merged
+as streams rather than first loading all of the calls into memory.
+
+The columns for each detector can also be stored separately, along with a
+fingerprint of the VCF file they were built from, so that when only some of
+the detectors are re-run, only their VCF files need to be parsed again.
+"""
+import os
+import heapq
+import logging
+import itertools
+import numpy as np
+import pandas
+from eve import cache, storage, vcfio
+from eve.regions import ContigIndex, site_keys
+
+def vcf_sites(filename, fast=True):
+    """Iterates over the unfiltered SNPs in a VCF file
+
+    Parameters
+    ----------
+    filename : str
+        VCF file to read
+    fast : bool
+        If True, the VCF is parsed in chunks using `vcfio.read_sites`.
+        Otherwise each record is parsed using PyVCF.
+
+    Yields
+    ------
+    site : tuple
+        (chrom, pos, alt, qual_score, depth) tuple for each SNP which passed
+        all filters.
+    """
+    if not fast:
+        for site in vcfio.pyvcf_sites(filename):
+            yield site
+        return
+
+    for chunk in vcfio.read_sites(filename):
+        for site in zip(*[x.tolist() for x in chunk]):
+            yield site
+
+class CombinedMatrixBuilder(object):
+    """Collects merged calls into preallocated, fixed-size column chunks"""
+    def __init__(self, names, contigs, chunk_size=100000):
+        self.names = names
+        self.contigs = contigs
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self._allocate()
+
+    def _allocate(self):
+        """Allocates a new, empty chunk"""
+        n = self.chunk_size
+
+        self.n = 0
+        self.contig_ids = np.empty(n, dtype=np.int32)
+        self.positions = np.empty(n, dtype=np.int64)
+        self.depth = np.full(n, np.nan)
+        self.alleles = [np.full(n, np.nan, dtype=object) for x in self.names]
+        self.quals = [np.full(n, np.nan) for x in self.names]
+
+    def _flush(self):
+        """Stores the current chunk and starts a new one"""
+        n = self.n
+        self.chunks.append((self.contig_ids[:n], self.positions[:n],
+                            self.depth[:n], [x[:n] for x in self.alleles],
+                            [x[:n] for x in self.quals]))
+        self._allocate()
+
+    def add(self, contig_id, pos, calls):
+        """Adds a row for a single position
+
+        Parameters
+        ----------
+        contig_id : int
+            Contig id
+        pos : int
+            Position
+        calls : iterable
+            (caller index, alt, qual_score, depth) tuples for the calls made at
+            the position, in caller order.
+        """
+        i = self.n
+
+        self.contig_ids[i] = contig_id
+        self.positions[i] = pos
+
+        for (caller, alt, qual_score, depth) in calls:
+            self.alleles[caller][i] = alt
+            self.quals[caller][i] = qual_score
+            self.depth[i] = depth
+
+        self.n += 1
+
+        if self.n == self.chunk_size:
+            self._flush()
+
+    def to_frame(self):
+        """Returns the combined matrix as a DataFrame indexed by contig and
+        position"""
+        if self.n > 0 or not self.chunks:
+            self._flush()
+
+        contig_ids = np.concatenate([x[0] for x in self.chunks])
+        positions = np.concatenate([x[1] for x in self.chunks])
+
+        index = pandas.MultiIndex.from_arrays(
+            [self.contigs.categorical(contig_ids), positions],
+            names=['contig', 'position']
+        )
+
+        columns = {}
+
+        for i, name in enumerate(self.names):
+            columns[name] = np.concatenate([x[3][i] for x in self.chunks])
+        columns['depth'] = np.concatenate([x[2] for x in self.chunks])
+        for i, name in enumerate(self.names):
+            columns[name + "_qual"] = np.concatenate([x[4][i]
+                                                      for x in self.chunks])
+
+        return pandas.DataFrame(columns, index=index)
+
+def combine_vcfs(vcf_files, contigs=None, chunk_size=100000, fast=True):
+    """Parses a collection of VCF files and creates a single matrix
+    containing the calls for each position observed by any of the detection
+    algorithms.
+
+    Parameters
+    ----------
+    vcf_files : list
+        Coordinate-sorted VCF files to combine. The name of each file
+        (without extension) is used as the name of the detector.
+    contigs : ContigIndex
+        Contig ids to use. Contigs which are not part of the index are added
+        in the order in which they are encountered.
+    chunk_size : int
+        Number of rows to allocate at a time.
+    fast : bool
+        Whether to use the chunked VCF parser rather than PyVCF.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        DataFrame indexed by (contig, position), with an allele column and a
+        quality column for each detector, as well as a read depth column. The
+        contig level of the index is categorical, with the categories in
+        reference order.
+    """
+    names = [os.path.splitext(os.path.basename(x))[0] for x in vcf_files]
+    if not isinstance(contigs, ContigIndex):
+        contigs = ContigIndex(contigs)
+
+    # walk the files in lockstep
+    streams = [_tag_sites(vcf_sites(x, fast), contigs, i)
+               for i, x in enumerate(vcf_files)]
+    merged = heapq.merge(*streams, key=lambda x: x[:3])
+
+    builder = CombinedMatrixBuilder(names, contigs, chunk_size)
+
+    for (contig_id, pos), calls in itertools.groupby(merged,
+                                                     key=lambda x: x[:2]):
+        builder.add(contig_id, pos, (x[2:] for x in calls))
+
+    return builder.to_frame()
+
+def combine_vcfs_incremental(vcf_files, parts_dir, contigs=None,
+                             chunk_size=100000, fast=True):
+    """Combines a collection of VCF files, re-using the stored columns for
+    any detectors whose output has not changed since the last run
+
+    The columns for each detector (allele, quality score and read depth) are
+    stored as a separate matrix in `parts_dir`, along with a digest of the
+    VCF file they were built from. The result is the same as for
+    `combine_vcfs`.
+
+    Parameters
+    ----------
+    vcf_files : list
+        Coordinate-sorted VCF files to combine.
+    parts_dir : str
+        Directory to store the per-detector columns in.
+    contigs : ContigIndex
+        Contig ids to use.
+    chunk_size : int
+        Number of rows to allocate at a time.
+    fast : bool
+        Whether to use the chunked VCF parser rather than PyVCF.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        Combined matrix, as returned by `combine_vcfs`.
+    """
+    if not isinstance(contigs, ContigIndex):
+        contigs = ContigIndex(contigs)
+
+    if not os.path.isdir(parts_dir):
+        os.makedirs(parts_dir)
+
+    groups = []
+
+    for vcf_file in vcf_files:
+        name = os.path.splitext(os.path.basename(vcf_file))[0]
+        key = cache.file_fingerprint(vcf_file, digest=True)
+        part = storage.find_matrix(os.path.join(parts_dir, name))
+
+        if part is not None and cache.is_current([part], key):
+            logging.info("%s output unchanged. Re-using combined columns..." %
+                         name)
+            df = storage.read_matrix(part)
+        else:
+            df = combine_vcfs([vcf_file], contigs, chunk_size, fast)
+            part = storage.write_matrix(df, os.path.join(parts_dir, name))
+            cache.mark_current([part], key)
+
+        groups.append((name, df))
+
+    return merge_columns(groups, contigs)
+
+def merge_columns(groups, contigs):
+    """Merges the columns for a number of detectors into a single combined
+    matrix
+
+    Parameters
+    ----------
+    groups : list
+        (detector name, matrix) tuples, where each matrix is the output of
+        `combine_vcfs` for that detector alone.
+    contigs : ContigIndex
+        Contig ids to use.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        Combined matrix, as returned by `combine_vcfs`. As in
+        `combine_vcfs`, the read depth for a site is taken from the last
+        detector which called it.
+    """
+    keys = []
+
+    for (_, df) in groups:
+        contig = df.index.get_level_values('contig')
+
+        # map the contigs of the group onto the shared contig ids
+        if isinstance(contig.dtype, pandas.CategoricalDtype):
+            mapping = np.array([contigs[x] for x in contig.categories],
+                               dtype=np.int32)
+            ids = mapping[contig.codes]
+        else:
+            ids = np.array([contigs[x] for x in contig], dtype=np.int32)
+
+        keys.append(site_keys(ids, df.index.get_level_values('position')))
+
+    # all sites, in (contig, position) order
+    if keys:
+        sites = np.unique(np.concatenate(keys))
+    else:
+        sites = np.empty(0, dtype=np.int64)
+
+    n = len(sites)
+    columns = {}
+    depth = np.full(n, np.nan)
+    quals = {}
+
+    for ((name, df), group_keys) in zip(groups, keys):
+        rows = np.searchsorted(sites, group_keys)
+
+        alleles = np.full(n, np.nan, dtype=object)
+        alleles[rows] = df[name].astype(object).values
+        columns[name] = alleles
+
+        quals[name] = np.full(n, np.nan)
+        quals[name][rows] = df[name + "_qual"].values
+
+        depth[rows] = df['depth'].values
+
+    columns['depth'] = depth
+    for name in quals:
+        columns[name + "_qual"] = quals[name]
+
+    index = pandas.MultiIndex.from_arrays([
+        contigs.categorical((sites >> 32).astype(np.int32)),
+        sites & 0xffffffff
+    ], names=['contig', 'position'])
+
+    return pandas.DataFrame(columns, index=index)
+
+def _tag_sites(sites, contigs, caller):
+    """Replaces the contig name of each site with its id and adds the index
+    of the detector it came from"""
+    for (chrom, pos, alt, qual_score, depth) in sites:
+        yield (contigs[chrom], pos, caller, alt, qual_score, depth)
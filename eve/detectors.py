@@ -1,169 +1,193 @@
 """
 Variant Detector Classes
 
-TODO: parallelize execution of different variant callers.
+Detectors are declared in the detector registry (see `eve.registry`), which
+specifies the commands each detector runs and the files it creates. The
+VariantDetector class runs a detector based on its declaration.
 """
 import os
 import logging
-import subprocess
+from eve import cache, execution
 
 class VariantDetector(object):
     """Base Detector class"""
-    def __init__(self, bam, fasta, conf, output_dir, threads, location):
-        """Create a detector instance"""
-        self.commands = self.parse_command_template(conf)
+    def __init__(self, spec, bam, fasta, output_dir, threads, region=None,
+                 stage_cache=None):
+        """Create a detector instance
+
+        Parameters
+        ----------
+        spec : eve.registry.DetectorSpec
+            Declaration of the detector.
+        bam : str
+            BAM file to call variants from.
+        fasta : str
+            Reference sequence.
+        output_dir : str
+            Output directory; files are created in its 'vcf' sub-directory.
+        threads : int
+            Number of threads to use.
+        region : eve.regions.Region
+            Region to restrict detection to.
+        stage_cache : eve.cache.StageCache
+            Cache of detector output shared across runs.
+        """
+        self.spec = spec
+        self.commands = self.parse_command_template(spec.commands)
         self.bam = bam
         self.fasta = fasta
         self.output_dir = output_dir
         self.threads = threads
-        self.location = location
+        self.location = spec.tool
+        self.region = region
+        self.stage_cache = stage_cache
 
-    def parse_command_template(self, filepath):
-        """Parses a configuration file containing options for the variant
-           detector"""
-        with open(filepath) as fp:
-            return [x.strip() for x in fp.readlines()]
+        # output filepaths
+        self.files = {key: os.path.join(self.output_dir, 'vcf', filename)
+                      for (key, filename) in spec.files.items()}
 
-    def run(self):
-        """Runs the given detectors"""
-        pass
+        # files are created in a staging directory and only moved into place
+        # once all of the commands have succeeded
+        self.staging = execution.StagingArea(
+            os.path.join(self.output_dir, 'vcf'), self.name
+        )
 
-class GATKDetector(VariantDetector):
-    """
-    GATKDetector variant detector
-    """
-    def __init__(self, bam, fasta, conf, output_dir, threads, location):
-        super().__init__(bam, fasta, conf, output_dir, threads, location)
+    @property
+    def name(self):
+        """Name of the detector in the registry"""
+        return self.spec.name
+
+    @property
+    def title(self):
+        """Name of the detector to use in log messages"""
+        return self.spec.title
+
+    @property
+    def shared_pileup(self):
+        """Whether the first command only reads the BAM file sequentially, so
+        that it can be fed from a stream shared with other detectors"""
+        return self.spec.shared_pileup
+
+    @property
+    def memory(self):
+        """Expected peak memory usage in GB"""
+        return self.spec.memory
+
+    @property
+    def region_args(self):
+        """Command-line arguments restricting the detector to its region"""
+        if self.region is None:
+            return ''
+        return self.spec.region_option.format(region=self.region)
 
-    def run(self):
-        """Run GATK"""
-        logging.info("Running GATK")
-
-        # GATK output filepaths
-        unfiltered_vcf = os.path.join(self.output_dir, 'vcf', 'gatk_unfiltered.vcf')
-        filtered_vcf = os.path.join(self.output_dir, 'vcf', 'gatk_filtered.vcf')
+    def parse_command_template(self, filepath):
+        """Parses a configuration file containing options for the variant
+           detector (lines starting with '#' are ignored)"""
+        with open(filepath) as fp:
+            return [x.strip() for x in fp.readlines()
+                    if x.strip() and not x.startswith('#')]
+
+    def output(self):
+        """Returns the VCF filepath(s) generated by the detector"""
+        outputs = [self.files[x] for x in self.spec.outputs]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    def build_commands(self, bam=None, staged=False):
+        """Returns the list of fully rendered commands to run
+
+        Parameters
+        ----------
+        bam : str
+            Filepath to read the alignments from in place of the BAM file
+            (e.g. a named pipe).
+        staged : bool
+            Whether to create files in the staging directory rather than at
+            their final locations.
+        """
+        if staged:
+            values = {key: self.staging.stage(filepath)
+                      for (key, filepath) in self.files.items()}
+        else:
+            values = dict(self.files)
+        values.update(jar=self.location, reference=self.fasta,
+                      fasta=self.fasta, bam=bam or self.bam,
+                      threads=self.threads, region_args=self.region_args)
+
+        return [x.format(**values) for x in self.commands]
+
+    def cleanup(self):
+        """Removes any intermediate files"""
+        for filename in self.spec.temporary:
+            filepath = os.path.join(self.output_dir, 'vcf', filename)
+
+            if os.path.exists(filepath):
+                os.unlink(filepath)
+
+    def stage_key(self):
+        """Returns the cache key for the detector output"""
+        return cache.stage_key([self.bam, self.fasta], self.build_commands(),
+                               self.output_dir)
+
+    def outputs(self):
+        """Returns a list of the filepaths generated by the detector"""
+        output = self.output()
+        return output if isinstance(output, list) else [output]
+
+    def is_complete(self):
+        """Checks whether up-to-date output for the detector already exists,
+        either from an earlier run or in the stage cache"""
+        key = self.stage_key()
 
         # If output files already exist, stop here
-        if os.path.exists(filtered_vcf):
-            logging.info("GATK output already exists. Skipping...")
-            return filtered_vcf
-
-        # Find all SNPs and indels, regardless of coverage
-        cmd = self.commands[0].format(
-            jar=self.location, reference=self.fasta, bam=self.bam,
-            vcf_unfiltered=unfiltered_vcf, threads=self.threads
-        )
-
-        logging.debug(cmd)
-        subprocess.call(cmd, shell=True)
-
-        # Filter out low-coverage hits
-        cmd = self.commands[1].format(
-            jar=self.location, reference=self.fasta,
-            vcf_unfiltered=unfiltered_vcf, vcf_filtered=filtered_vcf
-        )
+        if cache.is_current(self.outputs(), key):
+            logging.info("%s output already exists. Skipping..." % self.title)
+            return True
 
-        logging.debug(cmd)
-        subprocess.call(cmd, shell=True)
+        # Check for output from a previous run with the same inputs
+        if self.stage_cache and self.stage_cache.fetch(key, self.outputs()):
+            logging.info("%s output found in cache. Skipping..." % self.title)
+            return True
 
-        # Clean up
-        os.unlink(unfiltered_vcf)
-        os.unlink(unfiltered_vcf + ".idx")
+        return False
 
-        return filtered_vcf
+    def prepare(self):
+        """Prepares the staging directory for a run"""
+        self.staging.prepare()
 
-class MpileupDetector(VariantDetector):
-    """
-    Mpileup variant detector
+    def run_commands(self, commands):
+        """Runs a list of shell commands, raising a CommandError if any of
+        them fails"""
+        for cmd in commands:
+            execution.run_command(cmd, stage=self.title)
 
-    This class interfaces with the SAMtools Mpileup utility for detecting
-    ___ variants.
-    """
-    def __init__(self, bam, fasta, conf, output_dir, threads, location):
-        super().__init__(bam, fasta, conf, output_dir, threads, location)
+    def abort(self):
+        """Discards the files created by a failed run"""
+        self.staging.abort()
 
-    def run(self):
-        """Run the Mpile detection pipeline"""
-        # Part 1: mpileup
-        logging.info("Running Mpileup")
+    def finish(self):
+        """Moves the output of a successful run into place, cleans up and
+        records the output"""
+        self.staging.commit(self.outputs())
+        self.cleanup()
 
-        # output filepaths
-        bcf_output = os.path.join(self.output_dir, 'vcf', 'var.raw.bcf')
-        vcf_output = os.path.join(self.output_dir, 'vcf', 'mpileup.vcf')
+        key = self.stage_key()
+        cache.mark_current(self.outputs(), key)
 
-        # If output files already exist, stop here
-        if os.path.exists(vcf_output):
-            logging.info("Mpileup output already exists. Skipping...")
-            return vcf_output
-
-        # Otherwise run Mpileup
-        cmd1 = self.commands[0].format(fasta=self.fasta, bam=self.bam,
-                                       bcf_output=bcf_output)
-        logging.debug(cmd1)
-        subprocess.call(cmd1, shell=True)
-
-        # Part 2: vcfutils
-        cmd2 = self.commands[1].format(bcf_output=bcf_output,
-                                       output=vcf_output)
-        logging.debug(cmd2)
-        subprocess.call(cmd2, shell=True)
-
-        # Cleanup
-        os.unlink(bcf_output)
-
-        return vcf_output
-
-class VarScanDetector(VariantDetector):
-    """
-    VarScanDetector variant detector
-    """
-    def __init__(self, bam, fasta, conf, output_dir, threads, location):
-        super().__init__(bam, fasta, conf, output_dir, threads, location)
+        if self.stage_cache:
+            self.stage_cache.store(key, self.outputs())
 
     def run(self):
-        """Run VarScan"""
-        logging.info("Running VarScan")
-
-        # VarScan intermediate and output filepaths
-        mpileup_outfile = os.path.join(self.output_dir, 'mpileup',
-                                       'varscan.mpileup')
-        varscan_snps_vcf = os.path.join(self.output_dir, 'vcf',
-                                       'varscan_snps.vcf')
-        varscan_indels_vcf = os.path.join(self.output_dir, 'vcf',
-                                          'varscan_indels.vcf')
-
-        # If output files already exist, stop here
-        if os.path.exists(varscan_snps_vcf):
-            logging.info("VarScan output already exists. Skipping...")
-            return varscan_snps_vcf
-
-        # Step 1: mpileup
-        cmd1 = self.commands[0].format(
-            reference=self.fasta, bam=self.bam, mpileup_output=mpileup_outfile
-        )
-
-        logging.debug(cmd1)
-        subprocess.call(cmd1, shell=True)
-
-        # Step 2: pileup2snp
-        cmd2 = self.commands[1].format(
-            jar=self.location, mpileup_output=mpileup_outfile,
-            varscan_snps=varscan_snps_vcf
-        )
-
-        logging.debug(cmd2)
-        subprocess.call(cmd2, shell=True)
-
-        # Step 3: pileup2indel
-        # (skipping this for now to speed things up...)
-        #cmd3 = self.commands[2].format(
-        #    jar=self.location, mpileup_output=mpileup_outfile,
-        #    varscan_indels=varscan_indels_vcf
-        #)
+        """Runs the given detectors"""
+        logging.info("Running %s" % self.title)
 
-        #logging.debug(cmd3)
-        #subprocess.call(cmd3, shell=True)
+        if not self.is_complete():
+            self.prepare()
 
-        #return [varscan_snps_vcf, varscan_indels_vcf]
-        return varscan_snps_vcf
+            try:
+                self.run_commands(self.build_commands(staged=True))
+                self.finish()
+            except Exception:
+                self.abort()
+                raise
 
+        return self.output()
@@ -0,0 +1,136 @@
+"""
+Command execution
+
+Runs the external commands used by the mapping and variant detection stages.
+Exit statuses are checked, and a failing command raises a CommandError rather
+than letting the pipeline continue with missing or truncated output. Failed
+commands are retried (with an increasing delay) to get past transient
+failures, and the standard error of each command is captured into the log.
+
+Each stage writes its files to a staging directory, and its output is only
+moved to its final location once every command of the stage has completed
+successfully. An interrupted or failed stage therefore never leaves partial
+output behind which could later be mistaken for a complete result.
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+from eve import instrumentation
+
+# default number of times a failed command is retried
+RETRIES = 2
+
+# delay before the first retry, in seconds (doubled for each further retry)
+RETRY_DELAY = 5.0
+
+# exit statuses which are not worth retrying (command not executable / not
+# found)
+PERMANENT_FAILURES = [126, 127]
+
+# number of lines of standard error to include in error messages
+STDERR_TAIL = 10
+
+class CommandError(Exception):
+    """Raised when an external command fails"""
+    def __init__(self, cmd, returncode, stderr=''):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+
+        tail = "\n".join(stderr.strip().splitlines()[-STDERR_TAIL:])
+        message = "Command exited with status %d: %s" % (returncode, cmd)
+
+        if tail:
+            message += "\n%s" % tail
+
+        super().__init__(message)
+
+def run_command(cmd, stage=None, retries=None, retry_delay=None):
+    """Runs a shell command, checking its exit status
+
+    Parameters
+    ----------
+    cmd : str
+        Command to run.
+    stage : str
+        Name of the pipeline stage the command belongs to.
+    retries : int
+        Number of times to retry the command if it fails (default: RETRIES).
+    retry_delay : float
+        Delay before the first retry in seconds (default: RETRY_DELAY).
+
+    Raises
+    ------
+    CommandError
+        If the command still fails after the last retry.
+    """
+    retries = RETRIES if retries is None else retries
+    retry_delay = RETRY_DELAY if retry_delay is None else retry_delay
+
+    for attempt in range(retries + 1):
+        with tempfile.TemporaryFile() as fp:
+            returncode = instrumentation.run_command(cmd, stage, stderr=fp)
+
+            fp.seek(0)
+            stderr = fp.read().decode('utf-8', 'replace')
+
+        for line in stderr.splitlines():
+            logging.debug("[%s] %s" % (stage or 'stderr', line))
+
+        if returncode == 0:
+            return
+
+        if returncode in PERMANENT_FAILURES or attempt == retries:
+            raise CommandError(cmd, returncode, stderr)
+
+        delay = retry_delay * 2**attempt
+        logging.warning("Retrying in %.0f seconds (attempt %d of %d)" % (
+            delay, attempt + 2, retries + 1))
+        time.sleep(delay)
+
+class StagingArea(object):
+    """Directory in which a stage creates its files, before its output is
+    moved into place"""
+    def __init__(self, directory, name):
+        """Create a staging area
+
+        Parameters
+        ----------
+        directory : str
+            Directory the output of the stage is written to. The staging
+            directory is created inside it, so that output can be moved into
+            place using an atomic rename.
+        name : str
+            Name of the stage.
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, '.%s.tmp' % name)
+
+    def stage(self, filepath):
+        """Returns the staging location for a file"""
+        return os.path.join(self.path, os.path.basename(filepath))
+
+    def prepare(self):
+        """Creates an empty staging directory, removing any left over from an
+        earlier, interrupted run"""
+        self.abort()
+        os.makedirs(self.path)
+
+    def commit(self, outputs):
+        """Moves the output of the stage into place and removes the staging
+        directory (and any intermediate files left in it)"""
+        for filepath in outputs:
+            if not os.path.exists(self.stage(filepath)):
+                raise IOError("Expected output was not created: %s" %
+                              os.path.basename(filepath))
+
+        for filepath in outputs:
+            os.replace(self.stage(filepath), filepath)
+
+        self.abort()
+
+    def abort(self):
+        """Removes the staging directory"""
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,198 @@
+"""
+Feature encoding
+
+Converts combined matrices (one allele and quality score column for each
+variant detector, and a read depth column) into the dense float32 feature
+blocks used by the classifiers. The encoder is fitted once on the training set
+and then frozen, so that training and prediction (on any number of new
+samples) produce exactly the same features.
+
+Each allele seen for a detector during fitting gets a fixed integer code, from
+which the one-hot encoded allele features are written directly into the
+feature block. Missing read depths and quality scores are filled in using the
+mean values seen during fitting.
+"""
+import numpy as np
+import pandas
+
+# value used in place of missing alleles
+MISSING_ALLELE = 'X'
+
+class FeatureEncoder(object):
+    """Fitted encoding of combined matrices as feature blocks"""
+    def __init__(self, detectors=None):
+        """Create a feature encoder
+
+        Parameters
+        ----------
+        detectors : list
+            Names of the detectors (allele columns) to encode. By default, the
+            detectors are taken from the first chunk passed to
+            `partial_fit`: every column with a matching "<name>_qual" column.
+        """
+        self.detectors = detectors
+        self.vocabulary = None
+        self.impute = None
+        self.features = None
+        self.offsets = None
+        self.n_alleles = 0
+
+        # statistics collected while fitting
+        self._alleles = {}
+        self._sums = {}
+        self._counts = {}
+
+    @property
+    def frozen(self):
+        """Whether the encoder has been fitted"""
+        return self.features is not None
+
+    def fit(self, chunks):
+        """Fits the encoder to a stream of combined matrix chunks"""
+        for chunk in chunks:
+            self.partial_fit(chunk)
+        return self.freeze()
+
+    def partial_fit(self, df):
+        """Updates the allele values and the read depth and quality score
+        statistics using a single combined matrix chunk"""
+        if self.frozen:
+            raise ValueError("Feature encoder has already been fitted")
+
+        if self.detectors is None:
+            # detectors are recognized by their quality score column
+            self.detectors = [x for x in df.columns if "%s_qual" % x in df]
+
+        for name in self.detectors:
+            alleles = self._alleles.setdefault(name, set())
+
+            if name in df:
+                alleles.update(df[name].dropna().unique())
+
+                if df[name].isnull().any():
+                    alleles.add(MISSING_ALLELE)
+            else:
+                alleles.add(MISSING_ALLELE)
+
+        for name in ['depth'] + ["%s_qual" % x for x in self.detectors]:
+            if name in df:
+                values = df[name].to_numpy(np.float64, na_value=np.nan)
+
+                self._sums[name] = (self._sums.get(name, 0.0) +
+                                    np.nansum(values))
+                self._counts[name] = (self._counts.get(name, 0) +
+                                      np.count_nonzero(~np.isnan(values)))
+
+        return self
+
+    def freeze(self):
+        """Fixes the allele codes and imputation values"""
+        if self.detectors is None:
+            raise ValueError("Feature encoder was not fitted to any data")
+
+        self.vocabulary = {x: sorted(self._alleles.get(x, [MISSING_ALLELE]))
+                           for x in self.detectors}
+
+        # mean read depth and quality scores, used for missing values
+        self.impute = {}
+
+        for name in ['depth'] + ["%s_qual" % x for x in self.detectors]:
+            count = self._counts.get(name, 0)
+            self.impute[name] = (float(self._sums[name] / count) if count
+                                 else 0.0)
+
+        self._alleles = {}
+        self._sums = {}
+        self._counts = {}
+
+        self._build()
+
+        return self
+
+    def _build(self):
+        """Determines the feature layout"""
+        # feature order: one-hot encoded alleles, then depth and quality
+        # scores
+        self.features = []
+        self.offsets = {}
+
+        for name in self.detectors:
+            self.offsets[name] = len(self.features)
+            self.features += ["%s=%s" % (name, x)
+                              for x in self.vocabulary[name]]
+
+        self.n_alleles = len(self.features)
+        self.features += ['depth'] + ["%s_qual" % x for x in self.detectors]
+
+    def codes(self, df, name):
+        """Returns the integer code of the allele of detector `name` for each
+        row of a combined matrix
+
+        Missing alleles get the code of MISSING_ALLELE, and alleles which were
+        not seen while fitting get the code -1.
+        """
+        vocabulary = self.vocabulary[name]
+
+        if MISSING_ALLELE in vocabulary:
+            missing = vocabulary.index(MISSING_ALLELE)
+        else:
+            missing = -1
+
+        if name not in df:
+            return np.full(len(df), missing, dtype=np.int32)
+
+        values = df[name]
+        codes = pandas.Categorical(values, categories=vocabulary).codes
+        codes = codes.astype(np.int32)
+        codes[values.isnull().values] = missing
+
+        return codes
+
+    def transform(self, df, out=None):
+        """Encodes a combined matrix as a feature block
+
+        Detectors which are missing from the matrix are treated as not having
+        made any calls, and alleles which were not seen while fitting are
+        ignored.
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            Combined matrix (or chunk).
+        out : numpy.ndarray
+            Float32 array of shape (len(df), len(features)) to write the
+            features to (e.g. a slice of a memory-mapped file).
+
+        Returns
+        -------
+        features : numpy.ndarray
+            Float32 array with one column for each feature.
+        """
+        if not self.frozen:
+            raise ValueError("Feature encoder has not been fitted")
+
+        if out is None:
+            out = np.zeros((len(df), len(self.features)), dtype=np.float32)
+        else:
+            out[:, :self.n_alleles] = 0
+
+        rows = np.arange(len(df))
+
+        for name in self.detectors:
+            codes = self.codes(df, name)
+            known = codes >= 0
+
+            out[rows[known], self.offsets[name] + codes[known]] = 1
+
+        for (i, name) in enumerate(self.features[self.n_alleles:],
+                                   self.n_alleles):
+            if name in df:
+                out[:, i] = df[name].to_numpy(np.float32, na_value=np.nan)
+            else:
+                out[:, i] = np.nan
+
+            if name in self.impute:
+                column = out[:, i]
+                column[np.isnan(column)] = self.impute[name]
+
+        return out
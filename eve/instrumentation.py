@@ -0,0 +1,263 @@
+"""
+Instrumentation
+
+Measures the resources used by each stage of the pipeline (external
+commands as well as stages run within EVE itself) and collects them into a
+run report, which is written to the output directory as JSON and TSV.
+
+For external commands, CPU time and I/O are taken from what is reported for
+the child process when it exits, and cover the whole process tree (e.g. all
+commands in a shell pipeline). For stages run within EVE, they include any
+worker processes started by the stage. Bytes read and written are based on
+the number of filesystem blocks transferred, and therefore do not include
+reads served from the page cache.
+
+Two memory figures are recorded. `max_process_rss_kb` is the peak RSS of the
+largest single process, as reported by the kernel. `peak_tree_rss_kb` is the
+peak of the combined RSS of the whole process tree (the command and all of
+its descendants, or the EVE process and its workers), which is sampled from
+/proc every POLL_INTERVAL seconds and can therefore miss very short peaks.
+Where /proc is not available, it falls back to `max_process_rss_kb`.
+"""
+import os
+import csv
+import json
+import time
+import logging
+import resource
+import threading
+import subprocess
+import contextlib
+
+# size of the blocks counted by ru_inblock / ru_oublock
+BLOCK_SIZE = 512
+
+# shell used to run commands; with pipefail, a pipeline fails if any of its
+# commands fails rather than only the last one
+SHELL = ['/bin/bash', '-o', 'pipefail', '-c']
+
+# interval at which the memory usage of a process tree is sampled, in
+# seconds
+POLL_INTERVAL = 0.2
+
+# fields included in the run report
+REPORT_FIELDS = ['stage', 'command', 'start', 'wall_time', 'user_time',
+                 'sys_time', 'max_process_rss_kb', 'peak_tree_rss_kb',
+                 'read_bytes', 'write_bytes', 'exit_status']
+
+class RunReport(object):
+    """Collection of resource usage records for a single run"""
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def add(self, **record):
+        """Adds a record to the report"""
+        with self.lock:
+            self.records.append(record)
+
+    def write(self, output_dir, prefix='run_report'):
+        """Writes the report to the specified directory as JSON and TSV"""
+        with self.lock:
+            records = list(self.records)
+
+        with open(os.path.join(output_dir, "%s.json" % prefix), 'w') as fp:
+            json.dump(records, fp, indent=2)
+
+        with open(os.path.join(output_dir, "%s.tsv" % prefix), 'w') as fp:
+            writer = csv.DictWriter(fp, fieldnames=REPORT_FIELDS,
+                                    delimiter='\t', extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(records)
+
+# report for the current run
+report = RunReport()
+
+def reset():
+    """Starts a new run report (e.g. in a worker process)"""
+    global report
+    report = RunReport()
+
+def tree_rss_kb(pid):
+    """Returns the combined resident set size of a process and all of its
+    descendants in KB, or None if it can not be determined"""
+    children = {}
+    rss = {}
+
+    try:
+        entries = os.listdir('/proc')
+        page_kb = os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return None
+
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+
+        # fields following the command name: state, ppid, ..., rss (pages)
+        try:
+            with open('/proc/%s/stat' % entry) as fp:
+                fields = fp.read().rsplit(')', 1)[1].split()
+        except (IOError, IndexError):
+            # process exited in the meantime
+            continue
+
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * page_kb
+
+    if pid not in rss:
+        return None
+
+    total = 0
+    pending = [pid]
+
+    while pending:
+        current = pending.pop()
+        total += rss.get(current, 0)
+        pending.extend(children.get(current, []))
+
+    return total
+
+class TreeMemoryMonitor(object):
+    """Samples the combined memory usage of a process tree in a background
+    thread, and keeps track of its peak
+
+    Example
+    -------
+    monitor = TreeMemoryMonitor(pid)
+    ...
+    peak_kb = monitor.stop()
+    """
+    def __init__(self, pid, interval=POLL_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = None
+        self.done = threading.Event()
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _sample(self):
+        value = tree_rss_kb(self.pid)
+
+        if value is not None:
+            self.peak_kb = max(self.peak_kb or 0, value)
+
+    def _run(self):
+        self._sample()
+
+        while not self.done.wait(self.interval):
+            self._sample()
+
+    def stop(self):
+        """Stops sampling, and returns the peak combined RSS in KB (or None
+        if it could not be determined)"""
+        self.done.set()
+        self.thread.join()
+
+        return self.peak_kb
+
+def run_command(cmd, stage=None, stderr=None):
+    """Runs a shell command and records the resources it used
+
+    The command is run using bash with the `pipefail` option set, so that the
+    exit status of a pipeline reflects failures of any of its commands.
+
+    Parameters
+    ----------
+    cmd : str
+        Command to run
+    stage : str
+        Name of the pipeline stage the command belongs to.
+    stderr : file
+        File to write the standard error of the command to.
+
+    Returns
+    -------
+    returncode : int
+        Exit status of the command.
+    """
+    logging.debug(cmd)
+
+    start = time.time()
+    process = subprocess.Popen(SHELL + [cmd], stderr=stderr)
+    monitor = TreeMemoryMonitor(process.pid)
+
+    # wait for the process, collecting its resource usage
+    (_, status, usage) = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    peak_kb = monitor.stop()
+
+    report.add(
+        stage=stage,
+        command=cmd,
+        start=start,
+        wall_time=time.time() - start,
+        user_time=usage.ru_utime,
+        sys_time=usage.ru_stime,
+        max_process_rss_kb=usage.ru_maxrss,
+        peak_tree_rss_kb=max(peak_kb or 0, usage.ru_maxrss),
+        read_bytes=usage.ru_inblock * BLOCK_SIZE,
+        write_bytes=usage.ru_oublock * BLOCK_SIZE,
+        exit_status=process.returncode
+    )
+
+    if process.returncode != 0:
+        logging.warning("Command exited with status %d: %s" % (
+            process.returncode, cmd))
+
+    return process.returncode
+
+@contextlib.contextmanager
+def stage(name):
+    """Context manager recording the resources used by a stage run within
+    the EVE process itself
+
+    CPU time and I/O include the child processes (e.g. cross-validation
+    workers) which finished during the stage. The peak process RSS is that of
+    the largest process (EVE or any of its children) up to the end of the
+    stage, rather than of the stage alone, while the peak tree RSS is sampled
+    during the stage only.
+    """
+    start = time.time()
+    before = _usage()
+    monitor = TreeMemoryMonitor(os.getpid())
+    exit_status = 1
+
+    try:
+        yield
+        exit_status = 0
+    finally:
+        peak_kb = monitor.stop()
+        after = _usage()
+
+        report.add(
+            stage=name,
+            command=None,
+            start=start,
+            wall_time=time.time() - start,
+            user_time=after['user_time'] - before['user_time'],
+            sys_time=after['sys_time'] - before['sys_time'],
+            max_process_rss_kb=after['max_rss_kb'],
+            peak_tree_rss_kb=max(peak_kb or 0, after['max_rss_kb']),
+            read_bytes=(after['read_blocks'] -
+                        before['read_blocks']) * BLOCK_SIZE,
+            write_bytes=(after['write_blocks'] -
+                         before['write_blocks']) * BLOCK_SIZE,
+            exit_status=exit_status
+        )
+
+def _usage():
+    """Returns the resources used by the EVE process and its terminated
+    child processes so far"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return {
+        'user_time': own.ru_utime + children.ru_utime,
+        'sys_time': own.ru_stime + children.ru_stime,
+        'max_rss_kb': max(own.ru_maxrss, children.ru_maxrss),
+        'read_blocks': own.ru_inblock + children.ru_inblock,
+        'write_blocks': own.ru_oublock + children.ru_oublock
+    }
@@ -0,0 +1,126 @@
+"""
+Stage journal
+
+Keeps a record of the pipeline stages (and detector shards) completed by a
+run, along with fingerprints of their inputs and outputs, in a small JSON file
+in the output directory. When a run is resumed, stages whose inputs and
+outputs are unchanged since they were recorded are skipped, so that an
+interrupted run continues from the first incomplete stage.
+
+The arguments used for the run are stored in the journal as well, so that a
+run can be resumed using only its output directory.
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from eve.cache import file_fingerprint
+
+# name of the journal file within the output directory
+JOURNAL_FILENAME = 'journal.json'
+
+class Journal(object):
+    """Record of the stages completed by a single run"""
+    def __init__(self, output_dir):
+        self.filepath = os.path.join(output_dir, JOURNAL_FILENAME)
+        self.lock = threading.Lock()
+
+        if os.path.exists(self.filepath):
+            with open(self.filepath) as fp:
+                self.entries = json.load(fp)
+        else:
+            self.entries = {'args': None, 'stages': {}}
+
+    def _write(self):
+        """Writes the journal to disk, replacing the previous version"""
+        tmp = "%s.tmp" % self.filepath
+
+        with open(tmp, 'w') as fp:
+            json.dump(self.entries, fp, indent=2, sort_keys=True)
+
+        os.replace(tmp, self.filepath)
+
+    def save_args(self, args):
+        """Records the arguments used for the run
+
+        A copy of the arguments is stored, so that values set on `args` while
+        the pipeline runs (e.g. the BAM file created by the mapping stage) are
+        not recorded, and are determined again when the run is resumed.
+        """
+        with self.lock:
+            self.entries['args'] = dict(vars(args))
+            self._write()
+
+    def is_complete(self, stage, inputs, key=None):
+        """Checks whether a stage was completed using the same inputs, and
+        its outputs have not changed since
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage.
+        inputs : list
+            Input files used by the stage.
+        key : str
+            Any additional value identifying the stage settings (e.g. a
+            stage cache key).
+        """
+        with self.lock:
+            entry = self.entries['stages'].get(stage)
+
+        if entry is None or entry['key'] != key:
+            return False
+
+        if entry['inputs'] != _fingerprints(inputs):
+            return False
+
+        return entry['outputs'] == _fingerprints(entry['outputs'].keys())
+
+    def outputs(self, stage):
+        """Returns the outputs recorded for a completed stage"""
+        with self.lock:
+            return list(self.entries['stages'][stage]['outputs'].keys())
+
+    def mark_complete(self, stage, inputs, outputs, key=None):
+        """Records the completion of a stage"""
+        entry = {
+            'inputs': _fingerprints(inputs),
+            'outputs': _fingerprints(outputs),
+            'key': key,
+            'finished': time.time()
+        }
+
+        with self.lock:
+            self.entries['stages'][stage] = entry
+            self._write()
+
+def load_args(output_dir):
+    """Loads the arguments recorded in the journal of an earlier run
+
+    Returns
+    -------
+    args : argparse.Namespace
+        Arguments used for the run, with the output directory set to
+        `output_dir`.
+    """
+    filepath = os.path.join(output_dir, JOURNAL_FILENAME)
+
+    if not os.path.exists(filepath):
+        raise IOError("No journal found in %s; unable to resume" % output_dir)
+
+    with open(filepath) as fp:
+        saved = json.load(fp)['args']
+
+    if saved is None:
+        raise IOError("No arguments recorded in %s" % filepath)
+
+    args = argparse.Namespace(**saved)
+    args.output_dir = output_dir
+    args.resume = output_dir
+
+    return args
+
+def _fingerprints(filepaths):
+    """Returns a mapping from absolute filepath to fingerprint"""
+    return {os.path.abspath(x): file_fingerprint(x) for x in filepaths}
@@ -3,96 +3,170 @@ Read-mapping classes
 """
 import os
 import logging
-import subprocess
+from eve import cache, execution
 
 class Mapper(object):
     """Base read mapper class"""
-    def __init__(self, reference, fastq1, fastq2, outfile, max_threads):
+    def __init__(self, reference, fastq1, fastq2, outfile, max_threads,
+                 stage_cache=None):
         """Create a detector instance"""
         self.reference = reference
         self.fastq1 = fastq1
         self.fastq2 = fastq2
         self.outfile = outfile
         self.max_threads = max_threads
+        self.stage_cache = stage_cache
+
+        # files are created in a staging directory and only moved into place
+        # once all of the commands have succeeded
+        self.staging = execution.StagingArea(os.path.dirname(self.outfile),
+                                             'mapping')
 
     def run(self, args):
         """Runs the given mappers"""
-        #process = subprocess.Popen(args,
-        #                           stdout=subprocess.PIPE,
-        #                           stderr=subprocess.PIPE,
-        #                           shell=True)
-        #stdout, stderr = process.communicate()
-
-        # Going to cheat for a bit...
-        subprocess.call(" ".join(args), shell=True)
-
-        #if stdout:
-        #    logging.info(stdout)
-        #if stderr:
-        #    logging.error(stderr)
-
-        #return process.returncode
+        execution.run_command(" ".join(args), stage='Mapping')
         return self.outfile
 
 class BWAMemMapper(Mapper):
     """Burrows-Wheeler Aligner Mapper class"""
-    def __init__(self, reference, fastq1, fastq2, outfile, max_threads):
-        super().__init__(reference, fastq1, fastq2, outfile, max_threads)
+    # read group added to the mapped reads
+    read_group = {
+        'ID': '1',
+        'LB': 'lib',
+        'PL': 'illumina',
+        'PU': '4410',
+        'SM': 'Project'
+    }
+
+    def __init__(self, reference, fastq1, fastq2, outfile, max_threads,
+                 stage_cache=None, streaming=False):
+        """Create a BWA mapper instance
+
+        If `streaming` is True, the output of BWA is piped directly into
+        SAMtools sort, with the read group added by BWA itself, rather than
+        writing the intermediate SAM and BAM files to disk.
+        """
+        super().__init__(reference, fastq1, fastq2, outfile, max_threads,
+                         stage_cache)
+        self.streaming = streaming
+
+        # intermediate and final filepaths
+        self.bam = self.outfile.replace(".sam", ".bam")
+        self.bam_sorted = self.bam.replace('.bam', '_sorted')
+        self.bam_sorted_rg = "%s_RG.bam" % self.bam_sorted
+
+    def paths(self, staged=False):
+        """Returns the intermediate and final filepaths, either at their final
+        locations or in the staging directory"""
+        paths = {
+            'sam': self.outfile,
+            'bam': self.bam,
+            'bam_sorted': self.bam_sorted,
+            'bam_sorted_rg': self.bam_sorted_rg
+        }
+
+        if staged:
+            paths = {x: self.staging.stage(y) for (x, y) in paths.items()}
+
+        return paths
+
+    def build_commands(self, staged=False):
+        """Builds the BWA mapping commands"""
+        if self.streaming:
+            return self.build_streaming_commands(staged)
+
+        paths = self.paths(staged)
 
-    def run(self):
-        """Run BWA mapping command"""
         cmd1 = "bwa mem -t {threads} {reference} {fastq1} {fastq2} > {output}".format(
                     reference=self.reference,
                     fastq1=self.fastq1, fastq2=self.fastq2,
-                    threads=self.max_threads, output=self.outfile
+                    threads=self.max_threads, output=paths['sam']
         )
-        logging.debug(cmd1)
-
-        # Call base Detector.run method
-        #args_list = cmd.split(' ')
-        #super().run(args_list)
-        subprocess.call(cmd1, shell=True)
 
         # Convert to BAM
-        bam = self.outfile.replace(".sam", ".bam")
-
         cmd2 = "samtools view -bS {sam} > {bam}".format(
-            sam=self.outfile, bam=bam
+            sam=paths['sam'], bam=paths['bam']
         )
 
-        logging.debug(cmd2)
-        subprocess.call(cmd2, shell=True)
-
         # Sort and index
-        bam_sorted = bam.replace('.bam', '_sorted')
         cmd3 = "samtools sort {bam} {bam_sorted}".format(
-            bam=bam, bam_sorted=bam_sorted
+            bam=paths['bam'], bam_sorted=paths['bam_sorted']
         )
-        logging.debug(cmd3)
-        subprocess.call(cmd3, shell=True)
 
         # Add read groups
-        bam_sorted_rg = "%s_RG.bam" % bam_sorted
         cmd4 = ("java -jar AddOrReplaceReadGroups.jar I={bam_sorted}.bam "
-                "O={bam_sorted_rg} RGLB=lib RGPL=illumina "
-                "RGPU=4410 RGSM=Project").format(
-            bam_sorted=bam_sorted, bam_sorted_rg=bam_sorted_rg
+                "O={bam_sorted_rg} RGID={ID} RGLB={LB} RGPL={PL} "
+                "RGPU={PU} RGSM={SM}").format(
+            bam_sorted=paths['bam_sorted'],
+            bam_sorted_rg=paths['bam_sorted_rg'], **self.read_group
         )
-        logging.debug(cmd4)
-        subprocess.call(cmd4, shell=True)
 
         # Index BAM file
         cmd5 = "samtools index {bam_sorted_rg}".format(
-            bam_sorted_rg=bam_sorted_rg
+            bam_sorted_rg=paths['bam_sorted_rg']
+        )
+
+        return [cmd1, cmd2, cmd3, cmd4, cmd5]
+
+    def build_streaming_commands(self, staged=False):
+        """Builds the BWA mapping commands for streaming mode"""
+        paths = self.paths(staged)
+
+        read_group = "\\t".join(["@RG"] + ["%s:%s" % (x, self.read_group[x])
+                                           for x in ['ID', 'LB', 'PL', 'PU',
+                                                     'SM']])
+
+        # Map, add read groups and sort
+        cmd1 = ("bwa mem -t {threads} -R '{read_group}' {reference} {fastq1} "
+                "{fastq2} | samtools sort -@ {threads} -T {tmp_prefix} "
+                "-o {bam_sorted_rg} -").format(
+            threads=self.max_threads, read_group=read_group,
+            reference=self.reference, fastq1=self.fastq1, fastq2=self.fastq2,
+            tmp_prefix=paths['bam_sorted'],
+            bam_sorted_rg=paths['bam_sorted_rg']
+        )
+
+        # Index BAM file
+        cmd2 = "samtools index {bam_sorted_rg}".format(
+            bam_sorted_rg=paths['bam_sorted_rg']
         )
 
-        logging.debug(cmd5)
-        subprocess.call(cmd5, shell=True)
+        return [cmd1, cmd2]
+
+    def run(self):
+        """Run BWA mapping command"""
+        commands = self.build_commands()
+
+        outputs = [self.bam_sorted_rg, "%s.bai" % self.bam_sorted_rg]
+        key = cache.stage_key([self.reference, self.fastq1, self.fastq2],
+                              commands, os.path.dirname(self.outfile))
+
+        # If output files already exist, stop here
+        if cache.is_current(outputs, key):
+            logging.info("Mapped reads already exist. Skipping...")
+            return self.bam_sorted_rg
+
+        # Check for output from a previous run with the same inputs
+        if self.stage_cache and self.stage_cache.fetch(key, outputs):
+            logging.info("Mapped reads found in cache. Skipping...")
+            return self.bam_sorted_rg
+
+        self.staging.prepare()
+
+        try:
+            for cmd in self.build_commands(staged=True):
+                execution.run_command(cmd, stage='Mapping')
+
+            # move the final BAM file into place; unneeded versions are
+            # removed along with the staging directory
+            self.staging.commit(outputs)
+        except Exception:
+            self.staging.abort()
+            raise
 
-        # Remove uneeded versions
-        os.unlink(self.outfile)
-        os.unlink(bam)
-        os.unlink(bam_sorted)
+        cache.mark_current(outputs, key)
 
-        return bam_sorted_rg
+        if self.stage_cache:
+            self.stage_cache.store(key, outputs)
 
+        return self.bam_sorted_rg
@@ -0,0 +1,140 @@
+"""
+Persisted models
+
+A trained classifier is stored together with everything needed to encode new
+samples in exactly the same way as the training set: the fitted feature
+encoder (see `eve.features`) and the target classes. This allows new samples
+to be scored without retraining. The cross-validation metrics recorded during
+training are stored along with the model.
+"""
+import os
+import numpy as np
+
+try:
+    from sklearn.externals import joblib
+except ImportError:
+    import joblib
+
+class ModelBundle(object):
+    """A trained classifier along with its feature encoding"""
+    # training metrics
+    metrics = None
+
+    def __init__(self, classifier, encoder, classes, metrics=None):
+        """Create a model bundle
+
+        Parameters
+        ----------
+        classifier : object
+            Trained scikit-learn classifier.
+        encoder : eve.features.FeatureEncoder
+            Frozen feature encoder used to create the training set.
+        classes : numpy.ndarray
+            Original target classes, indexed by the labels used for training.
+        metrics : dict
+            Cross-validation metrics recorded during training.
+        """
+        self.classifier = classifier
+        self.encoder = encoder
+        self.classes = np.asarray(classes)
+        self.metrics = metrics
+
+    @property
+    def features(self):
+        """Feature names, in the order expected by the classifier. One-hot
+        encoded alleles are named "<detector>=<allele>"."""
+        return self.encoder.features
+
+    def save(self, filepath):
+        """Stores the model bundle"""
+        joblib.dump(self, filepath)
+
+    @classmethod
+    def load(cls, filepath):
+        """Loads a stored model bundle"""
+        bundle = joblib.load(filepath)
+
+        if not isinstance(bundle, cls):
+            raise IOError("%s does not contain an EVE model" % filepath)
+
+        return bundle
+
+    def transform(self, df):
+        """Encodes a combined matrix as a feature matrix
+
+        Returns
+        -------
+        features : numpy.ndarray
+            Float32 array with one column for each feature.
+        """
+        return self.encoder.transform(df)
+
+    def predict_chunk(self, df):
+        """Predicts the allele at each site of a combined matrix
+
+        Returns
+        -------
+        predictions : numpy.ndarray
+            Predicted allele for each site.
+        probabilities : numpy.ndarray
+            Probability of the predicted allele for each site.
+        """
+        if len(df) == 0:
+            return (np.empty(0, dtype=object), np.empty(0, dtype=np.float32))
+
+        proba = self.classifier.predict_proba(self.transform(df))
+        best = proba.argmax(axis=1)
+
+        return (self.classes[self.classifier.classes_[best]],
+                proba.max(axis=1).astype(np.float32))
+
+    def predict_chunks(self, chunks):
+        """Predicts the allele at each site for a stream of combined matrix
+        chunks
+
+        Only a single chunk is encoded and scored at a time, so that memory
+        usage does not depend on the total number of sites.
+
+        Yields
+        ------
+        result : tuple
+            (chunk, predictions, probabilities) tuple for each chunk.
+        """
+        for chunk in chunks:
+            (predictions, probabilities) = self.predict_chunk(chunk)
+            yield (chunk, predictions, probabilities)
+
+    def predict(self, df, batch_size=100000):
+        """Predicts the allele at each site of a combined matrix, scoring
+        `batch_size` sites at a time
+
+        Returns
+        -------
+        predictions : numpy.ndarray
+            Predicted allele for each site.
+        probabilities : numpy.ndarray
+            Probability of the predicted allele for each site.
+        """
+        chunks = (df.iloc[i:i + batch_size]
+                  for i in range(0, len(df), batch_size))
+        results = list(self.predict_chunks(chunks))
+
+        if not results:
+            return self.predict_chunk(df)
+
+        return (np.concatenate([x[1] for x in results]),
+                np.concatenate([x[2] for x in results]))
+
+# models loaded by the current process
+_loaded = {}
+
+def load_model(filepath):
+    """Loads a stored model bundle, reusing it if it has already been loaded
+    by the current process (or by the parent of a forked worker)"""
+    stat = os.stat(filepath)
+    key = (os.path.abspath(filepath), stat.st_mtime_ns)
+
+    if key not in _loaded:
+        _loaded[key] = ModelBundle.load(filepath)
+
+    return _loaded[key]
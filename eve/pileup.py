@@ -0,0 +1,272 @@
+"""
+Shared pileup stage
+
+SAMtools mpileup is run by more than one variant detector (Mpileup,
+VarScan), and each of these passes over the whole BAM file. When several
+such detectors are used, the BAM file is instead read once and streamed to
+all of them at the same time through named pipes.
+"""
+import os
+import time
+import errno
+import fcntl
+import shutil
+import logging
+import tempfile
+import threading
+from eve import execution
+
+# size of the blocks read from the BAM file
+BLOCK_SIZE = 4 * 1024**2
+
+class SharedPileup(object):
+    """Runs a group of detectors from a single pass over a BAM file"""
+    def __init__(self, detectors, bam, tmp_dir=None):
+        """Create a shared pileup stage
+
+        Parameters
+        ----------
+        detectors : list
+            Detector instances with `shared_pileup` set.
+        bam : str
+            BAM file read by the detectors.
+        tmp_dir : str
+            Directory in which to create the named pipes.
+        """
+        self.detectors = detectors
+        self.bam = bam
+        self.tmp_dir = tmp_dir
+
+    @property
+    def threads(self):
+        """Number of threads used by the detectors in the group"""
+        return sum(x.threads for x in self.detectors)
+
+    @property
+    def memory(self):
+        """Expected peak memory usage of the detectors in the group (GB)"""
+        return sum(x.memory for x in self.detectors)
+
+    def run(self):
+        """Runs the detectors
+
+        Returns
+        -------
+        results : dict
+            Mapping from detector name to detector output, for each
+            detector which completed successfully.
+        """
+        results = {}
+        pending = []
+
+        for detector in self.detectors:
+            logging.info("Running %s" % detector.title)
+
+            if detector.is_complete():
+                results[detector.name] = detector.output()
+            else:
+                pending.append(detector)
+
+        # nothing to share
+        if len(pending) == 1:
+            try:
+                pending[0].run()
+                results[pending[0].name] = pending[0].output()
+            except Exception:
+                logging.exception("%s failed" % pending[0].title)
+            return results
+        elif not pending:
+            return results
+
+        logging.info("Streaming %s to %s" % (
+            self.bam, ", ".join(x.title for x in pending)))
+
+        fifo_dir = tempfile.mkdtemp(prefix='eve-pileup-', dir=self.tmp_dir)
+
+        try:
+            fifos = []
+
+            for i, detector in enumerate(pending):
+                fifo = os.path.join(fifo_dir, "%d_%s.bam" % (i, detector.title))
+                os.mkfifo(fifo)
+                fifos.append(fifo)
+
+            # start the pileup step of each detector, reading from its pipe
+            processes = []
+
+            for (detector, fifo) in zip(pending, fifos):
+                detector.prepare()
+                cmd = detector.build_commands(bam=fifo, staged=True)[0]
+                process = CommandThread(cmd, detector.title)
+                process.start()
+                processes.append(process)
+
+            # read the BAM file once, writing it to each of the pipes
+            tee = TeeThread(self.bam, fifos, processes)
+            tee.start()
+
+            returncodes = [x.wait() for x in processes]
+            tee.join()
+        finally:
+            shutil.rmtree(fifo_dir, ignore_errors=True)
+
+        # run the remaining steps of each detector
+        for (detector, fifo, returncode) in zip(pending, fifos, returncodes):
+            if returncode != 0:
+                logging.error("%s pileup step failed (exit status %d)" % (
+                    detector.title, returncode))
+                detector.abort()
+                continue
+
+            # a pileup step which stops reading early has not seen all reads
+            if tee.error is not None and fifo in tee.error.outputs:
+                logging.error("%s pileup step did not read all of %s" % (
+                    detector.title, self.bam))
+                detector.abort()
+                continue
+
+            try:
+                detector.run_commands(detector.build_commands(staged=True)[1:])
+                detector.finish()
+            except Exception:
+                logging.exception("%s failed" % detector.title)
+                detector.abort()
+                continue
+
+            results[detector.name] = detector.output()
+
+        return results
+
+class CommandThread(threading.Thread):
+    """Runs a shell command in the background
+
+    The command is not retried if it fails, since its input can only be
+    streamed once.
+    """
+    def __init__(self, cmd, stage=None):
+        super().__init__()
+        self.cmd = cmd
+        self.stage = stage
+        self.returncode = None
+
+    def run(self):
+        try:
+            execution.run_command(self.cmd, self.stage, retries=0)
+            self.returncode = 0
+        except execution.CommandError as e:
+            self.returncode = e.returncode
+
+    def poll(self):
+        """Returns the exit status of the command, or None if it is still
+        running"""
+        if self.is_alive():
+            return None
+        return self.returncode
+
+    def wait(self):
+        """Waits for the command to finish and returns its exit status"""
+        self.join()
+        return self.returncode
+
+class TeeError(IOError):
+    """Raised when some of the pipes written by `tee_file` did not receive
+    the whole file"""
+    def __init__(self, filepath, outputs):
+        self.outputs = outputs
+
+        super().__init__("%s was not copied to %s" % (
+            filepath, ", ".join(outputs)))
+
+class TeeThread(threading.Thread):
+    """Runs `tee_file` in the background, keeping any TeeError it raises"""
+    def __init__(self, filepath, outputs, readers=None):
+        super().__init__()
+        self.tee_args = (filepath, outputs, readers)
+        self.error = None
+
+    def run(self):
+        try:
+            tee_file(*self.tee_args)
+        except TeeError as e:
+            self.error = e
+
+def tee_file(filepath, outputs, readers=None):
+    """Copies a file to several named pipes at once
+
+    Parameters
+    ----------
+    filepath : str
+        File to copy.
+    outputs : list
+        Named pipes to write to.
+    readers : list
+        Processes (or CommandThread instances) reading from each of the
+        pipes. A pipe is skipped if its reader exits before opening it.
+
+    Pipes whose reader goes away part-way are dropped, and copying continues
+    for the remaining pipes.
+
+    Raises
+    ------
+    TeeError
+        If any of the pipes was skipped or dropped, once the file has been
+        copied to the others.
+    """
+    handles = []
+    dropped = []
+
+    for (i, output) in enumerate(outputs):
+        reader = readers[i] if readers else None
+        handle = _open_pipe(output, reader)
+
+        if handle is None:
+            logging.error("Nothing is reading from %s" % output)
+            dropped.append(output)
+        else:
+            handles.append((output, handle))
+
+    try:
+        with open(filepath, 'rb') as fp:
+            for block in iter(lambda: fp.read(BLOCK_SIZE), b''):
+                for (output, handle) in list(handles):
+                    try:
+                        handle.write(block)
+                    except BrokenPipeError:
+                        logging.warning("%s closed early" % output)
+                        handles.remove((output, handle))
+                        dropped.append(output)
+
+                if not handles:
+                    break
+    finally:
+        for (output, handle) in handles:
+            try:
+                handle.close()
+            except BrokenPipeError:
+                dropped.append(output)
+
+    if dropped:
+        raise TeeError(filepath, dropped)
+
+def _open_pipe(fifo, reader=None):
+    """Opens a named pipe for writing, waiting for the reader to open it
+
+    Returns None if the reader process exits without opening the pipe.
+    """
+    while True:
+        try:
+            fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            # no reader yet
+            if e.errno != errno.ENXIO:
+                raise
+            if reader is not None and reader.poll() is not None:
+                return None
+            time.sleep(0.1)
+
+    # switch back to blocking writes
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+
+    return os.fdopen(fd, 'wb')
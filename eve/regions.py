@@ -0,0 +1,207 @@
+"""
+Genomic regions
+
+Helper functions for splitting a reference genome into regions (shards)
+which can be processed independently, for gathering the per-region results
+back together, and for referring to individual sites using compact integer
+(contig id, position) keys.
+"""
+import os
+import logging
+import numpy as np
+
+class Region(object):
+    """A contiguous region of a single reference sequence"""
+    def __init__(self, contig, start, end):
+        """Create a region (1-based, inclusive coordinates)"""
+        self.contig = contig
+        self.start = start
+        self.end = end
+
+    @property
+    def name(self):
+        """Name of the region which can safely be used in filepaths"""
+        contig = "".join(x if x.isalnum() or x in '-_.' else '_'
+                         for x in self.contig)
+        return "%s_%d-%d" % (contig, self.start, self.end)
+
+    def __str__(self):
+        return "%s:%d-%d" % (self.contig, self.start, self.end)
+
+    def __repr__(self):
+        return "Region(%s)" % self
+
+def read_fasta_index(filepath):
+    """Reads a samtools FASTA index (.fai) and returns a list of
+    (contig, length) tuples in the order in which they are listed."""
+    contigs = []
+
+    with open(filepath) as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            fields = line.rstrip('\n').split('\t')
+            contigs.append((fields[0], int(fields[1])))
+
+    return contigs
+
+class FastaReference(object):
+    """Random access to the bases of a FASTA file indexed with samtools
+    faidx"""
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.offsets = {}
+
+        with open("%s.fai" % filepath) as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                fields = line.rstrip('\n').split('\t')
+                self.offsets[fields[0]] = tuple(int(x) for x in fields[1:5])
+
+        self.fp = open(filepath, 'rb')
+
+    def base(self, contig, pos):
+        """Returns the (upper case) base at a 1-based position, or 'N' if
+        the position is not part of the reference"""
+        if contig not in self.offsets:
+            return 'N'
+
+        (length, offset, line_bases, line_width) = self.offsets[contig]
+
+        if pos < 1 or pos > length:
+            return 'N'
+
+        i = pos - 1
+        self.fp.seek(offset + (i // line_bases) * line_width + i % line_bases)
+
+        return self.fp.read(1).decode('ascii').upper()
+
+    def close(self):
+        self.fp.close()
+
+class ContigIndex(object):
+    """Maps contig names to small integer ids
+
+    Ids are assigned in reference order. Contigs which are not part of the
+    reference are assigned the next free id when first encountered.
+    """
+    def __init__(self, contigs=None):
+        self.names = []
+        self.ids = {}
+
+        if contigs is not None:
+            for name in contigs:
+                self[name]
+
+    @classmethod
+    def from_fasta_index(cls, filepath):
+        """Creates a contig index from a samtools FASTA index (.fai)"""
+        return cls([x[0] for x in read_fasta_index(filepath)])
+
+    def __getitem__(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def __len__(self):
+        return len(self.names)
+
+    def encode(self, names):
+        """Converts an array of contig names to ids, without adding new
+        contigs; unknown contigs are assigned an id of -1"""
+        import pandas
+
+        codes = pandas.Categorical(names, categories=self.names).codes
+        return codes.astype(np.int32)
+
+    def categorical(self, ids):
+        """Converts an array of contig ids to a pandas Categorical"""
+        import pandas
+
+        return pandas.Categorical.from_codes(ids, categories=self.names)
+
+def site_keys(contig_ids, positions):
+    """Packs contig ids and positions into a single int64 key per site,
+    such that the keys sort in (contig, position) order"""
+    return ((np.asarray(contig_ids, dtype=np.int64) << 32) |
+            np.asarray(positions, dtype=np.int64))
+
+def lookup_sites(keys, query):
+    """Finds the location of each query site in a sorted array of site keys
+
+    Parameters
+    ----------
+    keys : numpy.ndarray
+        Sorted array of unique site keys, as returned by `site_keys`.
+    query : numpy.ndarray
+        Site keys to look up.
+
+    Returns
+    -------
+    indices : numpy.ndarray
+        Index of each query site in `keys`, or -1 if it is not present.
+    """
+    query = np.asarray(query, dtype=np.int64)
+
+    if len(keys) == 0:
+        return np.full(len(query), -1, dtype=np.int64)
+
+    indices = np.searchsorted(keys, query)
+    indices[indices == len(keys)] = 0
+
+    return np.where(keys[indices] == query, indices, -1)
+
+def split_genome(contigs, window_size=None):
+    """Splits a genome into regions
+
+    Parameters
+    ----------
+    contigs : list
+        List of (contig, length) tuples, as returned by `read_fasta_index`.
+    window_size : int
+        Maximum size of each region. If not specified, a single region is
+        created for each contig.
+
+    Returns
+    -------
+    regions : list
+        List of Region instances, in reference order.
+    """
+    regions = []
+
+    for (contig, length) in contigs:
+        if not window_size:
+            regions.append(Region(contig, 1, length))
+            continue
+
+        for start in range(1, length + 1, window_size):
+            regions.append(Region(contig, start,
+                                  min(start + window_size - 1, length)))
+
+    return regions
+
+def gather_vcfs(shard_vcfs, output):
+    """Concatenates a list of per-region VCF files into a single VCF
+
+    The shards are expected to be listed in reference order and to contain
+    non-overlapping calls, so that simple concatenation results in a
+    coordinate-sorted VCF. The header of the first shard is used for the
+    combined file.
+    """
+    logging.info("Gathering %d shards into %s" % (len(shard_vcfs), output))
+
+    tmp = output + '.tmp'
+
+    with open(tmp, 'w') as out:
+        for i, filename in enumerate(shard_vcfs):
+            with open(filename) as fp:
+                for line in fp:
+                    if line.startswith('#') and i > 0:
+                        continue
+                    out.write(line)
+
+    os.rename(tmp, output)
+
+    return output
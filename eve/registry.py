@@ -0,0 +1,186 @@
+"""
+Detector registry
+
+The variant detectors available to EVE are declared in configuration files
+(config/detectors.cfg by default) rather than in code. Each section of a
+registry file declares a single detector: the file containing its command
+templates, the files it creates, which of those are its output, and the
+resources it needs (how many threads it can make use of, and how much memory
+it uses). Additional registry files can be used to add new detectors, or to
+override the built-in ones, without changing EVE itself.
+
+Example
+-------
+[freebayes]
+title       = FreeBayes
+commands    = freebayes.cmd
+files       = vcf=freebayes.vcf
+output      = vcf
+max_threads = 1
+memory      = 2
+
+Detectors needing custom behaviour can specify a `class` (the dotted path of
+a `eve.detectors.VariantDetector` subclass).
+"""
+import os
+import importlib
+import configparser
+from eve import detectors
+
+# default registry file
+DEFAULT_REGISTRY = os.path.join('config', 'detectors.cfg')
+
+class DetectorSpec(object):
+    """Declaration of a single variant detector"""
+    def __init__(self, name, commands, files, outputs, title=None,
+                 temporary=None, tool=None, region_option='-r {region}',
+                 shared_pileup=False, max_threads=1, memory=1.0, cls=None):
+        """Create a detector declaration
+
+        Parameters
+        ----------
+        name : str
+            Name used to select the detector on the command-line.
+        commands : str
+            File containing the command templates, one per line.
+        files : dict
+            Mapping from command template placeholder to the name of the file
+            it refers to (created in the 'vcf' output directory).
+        outputs : list
+            Placeholders of the files which make up the detector output.
+        title : str
+            Name of the detector to use in log messages.
+        temporary : list
+            Names of intermediate files to remove after a successful run.
+        tool : str
+            Location of the tool used by the detector (e.g. a Java jar),
+            available to the command templates as `{jar}`.
+        region_option : str
+            Command-line option used to restrict detection to a region.
+        shared_pileup : bool
+            Whether the first command only reads the BAM file sequentially,
+            so that it can be fed from a stream shared with other detectors.
+        max_threads : int
+            Maximum number of threads the detector can make use of.
+        memory : float
+            Expected peak memory usage in GB.
+        cls : type
+            Detector class to use.
+        """
+        self.name = name
+        self.commands = commands
+        self.files = files
+        self.outputs = outputs
+        self.title = title or name
+        self.temporary = temporary or []
+        self.tool = tool
+        self.region_option = region_option
+        self.shared_pileup = shared_pileup
+        self.max_threads = max(1, int(max_threads))
+        self.memory = float(memory)
+        self.cls = cls or detectors.VariantDetector
+
+    def create(self, bam, fasta, output_dir, threads, region=None,
+               stage_cache=None):
+        """Creates a detector instance"""
+        return self.cls(self, bam, fasta, output_dir, threads, region,
+                        stage_cache)
+
+def load_registry(filepaths=None, tools=None):
+    """Loads the detector declarations from one or more registry files
+
+    Parameters
+    ----------
+    filepaths : list
+        Registry files to load. Detectors declared in later files replace
+        those with the same name in earlier files.
+    tools : configparser.SectionProxy
+        Tool locations (the [tools] section of the EVE configuration). A
+        detector's `tool` setting is looked up here, and used as-is if it is
+        not found.
+
+    Returns
+    -------
+    registry : dict
+        Mapping from detector name to DetectorSpec instance.
+    """
+    registry = {}
+
+    for filepath in filepaths or [DEFAULT_REGISTRY]:
+        if not os.path.isfile(filepath):
+            raise IOError("Invalid detector registry specified: %s" % filepath)
+
+        config = configparser.ConfigParser()
+        config.read(filepath)
+
+        base_dir = os.path.dirname(filepath)
+
+        for name in config.sections():
+            registry[name] = _parse_spec(name, config[name], base_dir, tools)
+
+    return registry
+
+def _parse_spec(name, section, base_dir, tools):
+    """Creates a DetectorSpec from a registry file section"""
+    commands = section['commands']
+
+    # command templates are looked up relative to the 'detectors' directory
+    # next to the registry
+    if not os.path.isabs(commands):
+        commands = os.path.join(base_dir, 'detectors', commands)
+
+    files = {}
+
+    for entry in section.get('files', '').split():
+        (key, filename) = entry.split('=', 1)
+        files[key] = filename
+
+    tool = section.get('tool')
+
+    if tool and tools is not None and tool in tools:
+        tool = tools[tool]
+
+    cls = None
+
+    if 'class' in section:
+        (module, _, attr) = section['class'].rpartition('.')
+        cls = getattr(importlib.import_module(module), attr)
+
+    return DetectorSpec(
+        name, commands, files, section['output'].split(),
+        title=section.get('title'),
+        temporary=section.get('temporary', '').split(),
+        tool=tool,
+        region_option=section.get('region_option', '-r {region}'),
+        shared_pileup=section.getboolean('shared_pileup', False),
+        max_threads=section.getint('max_threads', 1),
+        memory=section.getfloat('memory', 1.0),
+        cls=cls
+    )
+
+def allocate_threads(specs, budget):
+    """Splits a thread budget between detectors which are run concurrently
+
+    Each detector gets at least one thread, and the rest of the budget is
+    handed out one thread at a time to the detectors which can make use of
+    more threads.
+
+    Returns
+    -------
+    threads : dict
+        Mapping from detector name to number of threads.
+    """
+    threads = {x.name: 1 for x in specs}
+    remaining = budget - len(specs)
+
+    while remaining > 0:
+        growable = [x for x in specs if threads[x.name] < x.max_threads]
+
+        if not growable:
+            break
+
+        for spec in growable[:remaining]:
+            threads[spec.name] += 1
+            remaining -= 1
+
+    return threads
@@ -0,0 +1,111 @@
+"""
+Training set sampling
+
+In a real genome, most sites of the training set are reference sites (class
+'X'), and true variants are a small minority. Training on every site spends
+most of the time on easy negatives, so the majority class is down-sampled
+before training: every site of the other classes is kept, along with a random
+sample of the majority class sites of (by default) ten times that size.
+
+The sampled majority sites are given a weight of one over the sampling rate,
+so that the class balance seen by the classifier (and therefore its
+probabilities) matches that of the complete training set.
+
+Optionally, majority class sites close to a true variant ("hard negatives")
+are always kept, since these are the sites the detectors are most likely to
+get wrong.
+"""
+import logging
+import numpy as np
+
+class Sampler(object):
+    """Selects the sites of a training set to train on"""
+    def __init__(self, counts, ratio, window=0, positive_keys=None, seed=0):
+        """Create a sampler
+
+        Parameters
+        ----------
+        counts : numpy.ndarray
+            Number of sites of each class in the training set.
+        ratio : float
+            Number of randomly sampled majority class sites to keep for each
+            site of the other classes (0 or None to keep all sites).
+        window : int
+            Majority class sites within this many bases of a site of another
+            class are always kept (0 to disable).
+        positive_keys : numpy.ndarray
+            Sorted site keys (see `eve.regions.site_keys`) of the sites which
+            are not of the majority class. Only needed if `window` is set.
+        seed : int
+            Random seed. For a given seed, the same sites are selected as long
+            as the chunks are passed in the same order.
+        """
+        counts = np.asarray(counts)
+
+        self.majority = int(counts.argmax())
+        self.window = window
+        self.positive_keys = positive_keys
+        self.rng = np.random.default_rng(seed)
+
+        minority = counts.sum() - counts[self.majority]
+
+        if ratio and minority > 0:
+            self.rate = min(1.0, ratio * minority / counts[self.majority])
+        else:
+            self.rate = 1.0
+
+        if self.rate < 1:
+            logging.info("Keeping %.2f%% of the majority class sites" % (
+                100 * self.rate))
+
+    def select(self, labels, keys=None):
+        """Selects the sites of a training set chunk to train on
+
+        Parameters
+        ----------
+        labels : numpy.ndarray
+            Integer class label of each site.
+        keys : numpy.ndarray
+            Site keys of each site (only needed for hard negative mining).
+
+        Returns
+        -------
+        mask : numpy.ndarray
+            Boolean mask of the sites to keep.
+        weights : numpy.ndarray
+            Sample weight of each of the sites kept.
+        """
+        # draw for every site, so that the selection does not depend on the
+        # class labels of earlier chunks
+        sampled = self.rng.random(len(labels)) < self.rate
+        majority = labels == self.majority
+
+        keep = ~majority
+
+        if self.window and keys is not None:
+            keep |= majority & near_sites(self.positive_keys, keys,
+                                          self.window)
+
+        mask = keep | sampled
+        weights = np.where(keep, 1.0, 1.0 / self.rate)[mask]
+
+        return (mask, weights.astype(np.float32))
+
+def near_sites(keys, query, window):
+    """Checks whether each query site lies within `window` bases of one of
+    a sorted array of site keys on the same contig"""
+    query = np.asarray(query, dtype=np.int64)
+
+    if keys is None or len(keys) == 0:
+        return np.zeros(len(query), dtype=bool)
+
+    indices = np.searchsorted(keys, query)
+    near = np.zeros(len(query), dtype=bool)
+
+    # nearest key on either side of each query site
+    for neighbour in [keys[np.maximum(indices - 1, 0)],
+                      keys[np.minimum(indices, len(keys) - 1)]]:
+        near |= (((neighbour >> 32) == (query >> 32)) &
+                 (np.abs(neighbour - query) <= window))
+
+    return near
@@ -0,0 +1,140 @@
+"""
+Task scheduler
+
+Runs pipeline tasks (e.g. variant detectors) concurrently, subject to a
+shared thread (and optionally memory) budget and to dependencies between
+tasks. Each task is expected to spend most of its time waiting on external
+processes, so tasks are driven from a pool of Python threads.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+class Task(object):
+    """A single unit of work to be scheduled"""
+    def __init__(self, name, func, threads=1, requires=None, memory=0):
+        """Create a task instance
+
+        Parameters
+        ----------
+        name : str
+            Unique name of the task.
+        func : callable
+            Function to call (with no arguments) to run the task.
+        threads : int
+            Number of threads the task is expected to keep busy.
+        requires : list
+            Names of tasks which must complete successfully before this task
+            can be started.
+        memory : float
+            Expected peak memory usage of the task in GB.
+        """
+        self.name = name
+        self.func = func
+        self.threads = max(1, int(threads))
+        self.requires = list(requires or [])
+        self.memory = float(memory)
+
+class Scheduler(object):
+    """Dependency-aware task scheduler"""
+    def __init__(self, max_threads, max_memory=None):
+        """Create a scheduler with the specified thread budget and (if
+        specified) memory budget in GB"""
+        self.max_threads = max(1, int(max_threads))
+        self.max_memory = max_memory
+        self.tasks = []
+
+    def add(self, task):
+        """Adds a task to the schedule"""
+        if task.name in [x.name for x in self.tasks]:
+            raise ValueError("Duplicate task name: %s" % task.name)
+        self.tasks.append(task)
+
+    def run(self):
+        """Runs all scheduled tasks
+
+        Tasks are started in the order in which they were added, as soon as
+        their dependencies have completed and enough of the thread budget is
+        free. A task requesting more threads (or memory) than the total
+        budget is run once nothing else is running. Failure of a task does
+        not stop the remaining tasks, except for those which depend on it.
+
+        Returns
+        -------
+        results : dict
+            Mapping from task name to the value returned by the task, for all
+            tasks which completed successfully.
+        failed : list
+            Names of tasks which failed or were skipped.
+        """
+        pending = list(self.tasks)
+        names = set(x.name for x in pending)
+
+        for task in pending:
+            for dep in task.requires:
+                if dep not in names:
+                    raise ValueError("Task %s depends on unknown task %s" %
+                                     (task.name, dep))
+
+        results = {}
+        failed = []
+        running = {}
+        threads_in_use = 0
+        memory_in_use = 0
+
+        with ThreadPoolExecutor(max_workers=len(pending) or 1) as executor:
+            while pending or running:
+                # skip tasks whose dependencies failed
+                skipped = True
+
+                while skipped:
+                    skipped = False
+
+                    for task in list(pending):
+                        if any(dep in failed for dep in task.requires):
+                            logging.error("Skipping %s (dependency failed)",
+                                          task.name)
+                            failed.append(task.name)
+                            pending.remove(task)
+                            skipped = True
+
+                # start any tasks which are ready and fit into the budget
+                for task in list(pending):
+                    if not all(dep in results for dep in task.requires):
+                        continue
+
+                    free = self.max_threads - threads_in_use
+                    if task.threads > free and running:
+                        continue
+
+                    if (self.max_memory is not None and running and
+                            task.memory > self.max_memory - memory_in_use):
+                        continue
+
+                    logging.debug("Starting %s (%d threads)", task.name,
+                                  task.threads)
+                    threads_in_use += task.threads
+                    memory_in_use += task.memory
+                    running[executor.submit(task.func)] = task
+                    pending.remove(task)
+
+                if not running:
+                    if pending:
+                        raise ValueError("Circular task dependencies: %s" %
+                                         ", ".join(x.name for x in pending))
+                    continue
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    task = running.pop(future)
+                    threads_in_use -= task.threads
+                    memory_in_use -= task.memory
+
+                    try:
+                        results[task.name] = future.result()
+                        logging.debug("Finished %s", task.name)
+                    except Exception:
+                        logging.exception("%s failed", task.name)
+                        failed.append(task.name)
+
+        return results, failed
@@ -0,0 +1,432 @@
+"""
+Matrix storage
+
+Persists the combined and training matrices in a typed, columnar binary
+format, so that they can be loaded again without re-parsing and with their
+dtypes intact (categorical alleles and contigs, float quality scores, etc.).
+
+If pyarrow is installed, matrices are written as uncompressed Feather (Arrow
+IPC) files. Otherwise each column is written to a separate raw binary file in
+a directory, along with a small JSON file describing the columns. In both
+cases the files are memory-mapped when read, so that only the columns and rows
+which are actually used are paged in, and matrices larger than the available
+memory can be processed in chunks.
+
+Matrices can also be written incrementally, one chunk of rows at a time,
+using `MatrixWriter`.
+"""
+import os
+import json
+import shutil
+import importlib
+import numpy as np
+import pandas
+
+# file extension used for each storage format
+FEATHER_EXT = '.feather'
+NUMPY_EXT = '.columns'
+
+def have_pyarrow():
+    """Checks whether pyarrow is available"""
+    try:
+        importlib.import_module('pyarrow.feather')
+    except ImportError:
+        return False
+    return True
+
+class MatrixWriter(object):
+    """Writes a matrix to disk one chunk of rows at a time
+
+    The matrix is written to a temporary location and moved into place when
+    the writer is closed, so that incomplete matrices are never left behind.
+    All chunks must have the same index levels and columns.
+
+    Example
+    -------
+    with MatrixWriter(filepath) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    """
+    def __init__(self, filepath):
+        """Create a matrix writer
+
+        Parameters
+        ----------
+        filepath : str
+            Location to write the matrix to, without an extension; the
+            extension depends on the storage format used.
+        """
+        if have_pyarrow():
+            self.path = filepath + FEATHER_EXT
+            self.backend = _FeatherWriter(self.path)
+        else:
+            self.path = filepath + NUMPY_EXT
+            self.backend = _NumpyWriter(self.path)
+
+    def write(self, df):
+        """Appends a chunk of rows to the matrix"""
+        index_names = [x for x in df.index.names if x is not None]
+
+        # index levels are stored along with the columns
+        series = [(x, df.index.get_level_values(x)) for x in index_names]
+        series += [(x, df[x]) for x in df.columns]
+
+        self.backend.write(index_names, series, len(df))
+
+    def close(self):
+        """Finishes writing the matrix and moves it into place"""
+        self.backend.close()
+
+    def abort(self):
+        """Discards the partially written matrix"""
+        self.backend.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_matrix(df, filepath):
+    """Writes a matrix to disk
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Matrix to write. Any index levels are stored along with the columns
+        and restored when the matrix is read.
+    filepath : str
+        Location to write the matrix to, without an extension; the extension
+        depends on the storage format used.
+
+    Returns
+    -------
+    filepath : str
+        Location the matrix was written to.
+    """
+    with MatrixWriter(filepath) as writer:
+        writer.write(df)
+
+    return writer.path
+
+def find_matrix(filepath):
+    """Returns the location of a stored matrix (given its location without
+    an extension), or None if it does not exist"""
+    for ext in [FEATHER_EXT, NUMPY_EXT]:
+        if os.path.exists(filepath + ext):
+            return filepath + ext
+    return None
+
+def read_matrix(filepath, columns=None):
+    """Reads a matrix written using `write_matrix`
+
+    Parameters
+    ----------
+    filepath : str
+        Location of the matrix, with or without the extension.
+    columns : list
+        Columns to load (index levels are always loaded).
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        The stored matrix.
+    """
+    chunks = iter_matrix(filepath, columns, chunk_size=None)
+    return next(chunks)
+
+def iter_matrix(filepath, columns=None, chunk_size=100000):
+    """Iterates over a stored matrix in chunks of rows
+
+    Parameters
+    ----------
+    filepath : str
+        Location of the matrix, with or without the extension.
+    columns : list
+        Columns to load (index levels are always loaded).
+    chunk_size : int
+        Number of rows per chunk. If None, the whole matrix is returned as a
+        single chunk.
+
+    Yields
+    ------
+    df : pandas.DataFrame
+        Consecutive chunks of the matrix.
+    """
+    path = _resolve(filepath)
+
+    if path.endswith(FEATHER_EXT):
+        return _iter_feather(path, columns, chunk_size)
+    return _iter_numpy(path, columns, chunk_size)
+
+def matrix_length(filepath):
+    """Returns the number of rows in a stored matrix"""
+    path = _resolve(filepath)
+
+    if path.endswith(FEATHER_EXT):
+        import pyarrow.feather
+        return pyarrow.feather.read_table(path, columns=[],
+                                          memory_map=True).num_rows
+
+    with open(os.path.join(path, 'columns.json')) as fp:
+        return json.load(fp)['length']
+
+def matrix_index_names(filepath):
+    """Returns the names of the index levels of a stored matrix"""
+    path = _resolve(filepath)
+
+    if path.endswith(FEATHER_EXT):
+        import pyarrow.ipc
+        schema = pyarrow.ipc.open_file(path).schema
+        return json.loads(schema.metadata[b'eve_index'])
+
+    with open(os.path.join(path, 'columns.json')) as fp:
+        return json.load(fp)['index']
+
+def _resolve(filepath):
+    """Returns the location of a stored matrix, with its extension"""
+    if filepath.endswith(FEATHER_EXT) or filepath.endswith(NUMPY_EXT):
+        path = filepath
+    else:
+        path = find_matrix(filepath)
+
+    if path is None or not os.path.exists(path):
+        raise IOError("No stored matrix found at %s" % filepath)
+
+    return path
+
+def _chunk_bounds(length, chunk_size):
+    """Returns the (start, end) row bounds of each chunk"""
+    if chunk_size is None or length == 0:
+        return [(0, length)]
+    return [(i, min(i + chunk_size, length))
+            for i in range(0, length, chunk_size)]
+
+def _is_categorical(values):
+    """Checks whether a column should be stored as strings / categories"""
+    return (isinstance(values.dtype, pandas.CategoricalDtype) or
+            pandas.api.types.is_string_dtype(values.dtype))
+
+def _make_index(values, index_names, start, end):
+    """Removes the index levels from a dict of columns and returns them as
+    an index"""
+    if len(index_names) > 1:
+        return pandas.MultiIndex.from_arrays(
+            [values.pop(x) for x in index_names], names=index_names
+        )
+    elif index_names:
+        return pandas.Index(values.pop(index_names[0]), name=index_names[0])
+    return pandas.RangeIndex(start, end)
+
+class _FeatherWriter(object):
+    """Writes a matrix as a Feather (Arrow IPC) file"""
+    def __init__(self, path):
+        self.path = path
+        self.tmp = "%s.tmp%d" % (path, os.getpid())
+        self.writer = None
+        self.categorical = None
+
+    def _open(self, index_names, series):
+        import pyarrow
+        import pyarrow.ipc
+
+        # string columns are stored as plain strings, since the categories
+        # can differ between chunks
+        self.categorical = [name for (name, values) in series
+                            if _is_categorical(values)]
+
+        fields = []
+
+        for (name, values) in series:
+            if name in self.categorical:
+                fields.append(pyarrow.field(name, pyarrow.string()))
+            else:
+                fields.append(pyarrow.field(
+                    name, pyarrow.from_numpy_dtype(values.dtype)))
+
+        self.schema = pyarrow.schema(fields, metadata={
+            'eve_index': json.dumps(index_names),
+            'eve_categorical': json.dumps(self.categorical)
+        })
+
+        self.writer = pyarrow.ipc.new_file(self.tmp, self.schema)
+
+    def write(self, index_names, series, length):
+        import pyarrow
+
+        if self.writer is None:
+            self._open(index_names, series)
+
+        arrays = []
+
+        for (name, values) in series:
+            if name in self.categorical:
+                values = np.asarray(values, dtype=object)
+                mask = pandas.isnull(values)
+                arrays.append(pyarrow.array(np.where(mask, None, values),
+                                            type=pyarrow.string()))
+            else:
+                arrays.append(pyarrow.array(np.asarray(values)))
+
+        self.writer.write_batch(
+            pyarrow.record_batch(arrays, schema=self.schema)
+        )
+
+    def close(self):
+        if self.writer is None:
+            raise ValueError("No rows written to %s" % self.path)
+
+        self.writer.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+        if os.path.exists(self.tmp):
+            os.unlink(self.tmp)
+
+def _iter_feather(path, columns, chunk_size):
+    """Iterates over a Feather file in chunks"""
+    import pyarrow.feather
+
+    table = pyarrow.feather.read_table(path, memory_map=True)
+    metadata = table.schema.metadata
+
+    index_names = json.loads(metadata[b'eve_index'])
+    categorical = json.loads(metadata.get(b'eve_categorical', b'[]'))
+
+    if columns is not None:
+        table = table.select(index_names + list(columns))
+
+    for (start, end) in _chunk_bounds(table.num_rows, chunk_size):
+        df = table.slice(start, end - start).to_pandas()
+
+        for name in categorical:
+            if name in df:
+                df[name] = df[name].astype('category')
+
+        if index_names:
+            df = df.set_index(index_names)
+
+        yield df
+
+class _NumpyWriter(object):
+    """Writes a matrix as a directory of raw column files"""
+    def __init__(self, path):
+        self.path = path
+        self.tmp = "%s.tmp%d" % (path, os.getpid())
+        self.metadata = None
+        self.handles = []
+        self.categories = []
+
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+        os.makedirs(self.tmp)
+
+    def _open(self, index_names, series):
+        self.metadata = {'length': 0, 'index': index_names, 'columns': []}
+
+        for (i, (name, values)) in enumerate(series):
+            column = {'name': name, 'file': "%d.bin" % i}
+
+            # strings are stored as integer codes
+            if _is_categorical(values):
+                column['dtype'] = 'int32'
+                column['categories'] = []
+            else:
+                column['dtype'] = np.asarray(values).dtype.str
+
+            self.metadata['columns'].append(column)
+            self.categories.append({})
+            self.handles.append(open(os.path.join(self.tmp, column['file']),
+                                     'wb'))
+
+    def write(self, index_names, series, length):
+        if self.metadata is None:
+            self._open(index_names, series)
+
+        for (column, categories, handle, (name, values)) in zip(
+                self.metadata['columns'], self.categories, self.handles,
+                series):
+            if 'categories' in column:
+                values = pandas.Categorical(values)
+
+                # map the categories of the chunk to those of the matrix
+                for x in values.categories:
+                    if x not in categories:
+                        categories[x] = len(categories)
+                        column['categories'].append(x)
+
+                mapping = np.array([categories[x] for x in values.categories] +
+                                   [-1], dtype=np.int32)
+                values = mapping[values.codes]
+            else:
+                values = np.asarray(values, dtype=column['dtype'])
+
+            handle.write(np.ascontiguousarray(values).tobytes())
+
+        self.metadata['length'] += length
+
+    def close(self):
+        if self.metadata is None:
+            raise ValueError("No rows written to %s" % self.path)
+
+        for handle in self.handles:
+            handle.close()
+
+        with open(os.path.join(self.tmp, 'columns.json'), 'w') as fp:
+            json.dump(self.metadata, fp)
+
+        # replace any existing matrix
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self.tmp, self.path)
+
+    def abort(self):
+        for handle in self.handles:
+            handle.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+def _iter_numpy(path, columns, chunk_size):
+    """Iterates over a directory of raw column files in chunks"""
+    with open(os.path.join(path, 'columns.json')) as fp:
+        metadata = json.load(fp)
+
+    length = metadata['length']
+    index_names = metadata['index']
+    selected = [x for x in metadata['columns'] if x['name'] in index_names or
+                columns is None or x['name'] in columns]
+
+    if columns is not None:
+        order = index_names + list(columns)
+        selected.sort(key=lambda x: order.index(x['name']))
+
+    arrays = {}
+
+    for column in selected:
+        if length == 0:
+            arrays[column['name']] = np.empty(0, dtype=column['dtype'])
+        else:
+            arrays[column['name']] = np.memmap(
+                os.path.join(path, column['file']), dtype=column['dtype'],
+                mode='r', shape=(length,)
+            )
+
+    for (start, end) in _chunk_bounds(length, chunk_size):
+        values = {}
+
+        for column in selected:
+            data = arrays[column['name']][start:end]
+
+            if 'categories' in column:
+                data = pandas.Categorical.from_codes(data,
+                                                     column['categories'])
+
+            values[column['name']] = data
+
+        index = _make_index(values, index_names, start, end)
+
+        yield pandas.DataFrame(values, index=index)
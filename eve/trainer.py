@@ -0,0 +1,580 @@
+"""
+Model training
+
+Trains the ensemble classifier on the labeled training set (the
+`combined_training_set` matrix) without holding it in memory as a pandas
+DataFrame. The matrix is streamed from disk twice: once to fit the feature
+encoder (see `eve.features`) and collect the target classes, and once to
+encode each chunk straight into a float32 feature block in a memory-mapped
+file on disk. Optionally, the majority class is down-sampled (with matching
+sample weights) before encoding; see `eve.sampling`.
+
+Two backends are available:
+
+  forest    A random forest grown a chunk at a time; only a single chunk of
+            the feature block is in memory at once.
+  boosting  Histogram-based gradient boosting. The feature block is loaded
+            for fitting, but is binned to a single byte per value.
+
+The backends are compared using K-fold cross-validation, with folds grouped
+by contig so that neighbouring (and therefore correlated) sites never end up
+on both sides of a split. The folds are run in parallel worker processes,
+after which the best backend is refit on the complete training set and
+stored together with its cross-validation metrics.
+"""
+import os
+import math
+import json
+import shutil
+import logging
+import warnings
+import multiprocessing
+import numpy as np
+import pandas
+from sklearn import metrics
+from sklearn.ensemble import (HistGradientBoostingClassifier,
+                              RandomForestClassifier)
+from sklearn.model_selection import GroupKFold
+from eve import model, storage
+from eve.features import FeatureEncoder, MISSING_ALLELE
+from eve.regions import site_keys
+from eve.sampling import Sampler
+
+# available training backends
+BACKENDS = ['forest', 'boosting']
+
+# name of the column containing the true allele
+TARGET = 'actual'
+
+# metric used to select the best backend (sites with a true variant are a
+# small minority, so plain accuracy is dominated by the reference sites)
+SELECTION_METRIC = 'balanced_accuracy'
+
+class IncrementalForest(object):
+    """Random forest which is grown a chunk of the training set at a time
+
+    A small forest is trained on each chunk, and the class probabilities of
+    the forests are averaged. Unlike scikit-learn's `warm_start`, this does
+    not require every class to be present in each chunk.
+    """
+    def __init__(self, n_classes, n_estimators=100, min_chunk_estimators=10,
+                 n_jobs=1, random_state=0):
+        """Create an incremental forest
+
+        Parameters
+        ----------
+        n_classes : int
+            Number of target classes (labels are 0 .. n_classes - 1).
+        n_estimators : int
+            Total number of trees to aim for, spread across the chunks.
+        min_chunk_estimators : int
+            Minimum number of trees trained on each chunk.
+        n_jobs : int
+            Number of threads used to train each forest.
+        random_state : int
+            Seed used for the forest trained on the first chunk (and
+            incremented for each further chunk).
+        """
+        self.n_classes = n_classes
+        self.n_estimators = n_estimators
+        self.min_chunk_estimators = min_chunk_estimators
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.classes_ = np.arange(n_classes)
+        self.forests = []
+
+    def fit(self, X, y, rows=None, chunk_size=100000, sample_weight=None):
+        """Trains the forest on a (possibly memory-mapped) feature block
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            Feature block.
+        y : numpy.ndarray
+            Integer class labels.
+        rows : numpy.ndarray
+            Rows of `X` to train on (default: all rows).
+        chunk_size : int
+            Number of rows to train each forest on.
+        sample_weight : numpy.ndarray
+            Weight of each row of `X`.
+        """
+        if rows is None:
+            rows = np.arange(len(X))
+
+        bounds = [(i, min(i + chunk_size, len(rows)))
+                  for i in range(0, len(rows), chunk_size)]
+        trees = max(self.min_chunk_estimators,
+                    int(math.ceil(self.n_estimators / max(1, len(bounds)))))
+
+        self.forests = []
+
+        for (start, end) in bounds:
+            chunk = rows[start:end]
+            weights = None if sample_weight is None else sample_weight[chunk]
+
+            self.partial_fit(X[chunk], y[chunk], trees, weights)
+
+        return self
+
+    def partial_fit(self, X, y, n_estimators=None, sample_weight=None):
+        """Adds a forest trained on a single chunk"""
+        forest = RandomForestClassifier(
+            n_estimators=n_estimators or self.min_chunk_estimators,
+            n_jobs=self.n_jobs,
+            random_state=self.random_state + len(self.forests)
+        )
+        forest.fit(X, y, sample_weight=sample_weight)
+
+        self.forests.append(forest)
+
+        return self
+
+    def predict_proba(self, X):
+        """Returns the class probabilities, averaged over the trees of all
+        forests"""
+        proba = np.zeros((len(X), self.n_classes))
+        trees = 0
+
+        for forest in self.forests:
+            n = len(forest.estimators_)
+            proba[:, forest.classes_] += n * forest.predict_proba(X)
+            trees += n
+
+        return proba / max(1, trees)
+
+    def predict(self, X):
+        """Returns the most likely class for each row"""
+        return self.predict_proba(X).argmax(axis=1)
+
+    @property
+    def feature_importances_(self):
+        """Feature importances, averaged over the trees of all forests"""
+        weights = [len(x.estimators_) for x in self.forests]
+        return np.average([x.feature_importances_ for x in self.forests],
+                          axis=0, weights=weights)
+
+class TrainingData(object):
+    """Encoded training set, stored as memory-mapped arrays"""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, name):
+        """Returns the location of one of the arrays"""
+        return os.path.join(self.directory, "%s.npy" % name)
+
+    @property
+    def X(self):
+        """Feature block (rows x features, float32)"""
+        return np.load(self.path('X'), mmap_mode='r')
+
+    @property
+    def y(self):
+        """Integer class labels"""
+        return np.load(self.path('y'))
+
+    @property
+    def weights(self):
+        """Sample weight of each row"""
+        return np.load(self.path('weights'))
+
+    @property
+    def groups(self):
+        """Cross-validation group of each row"""
+        return np.load(self.path('groups'))
+
+    def remove(self):
+        """Removes the encoded training set"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def scan_training_set(filepath, chunk_size=100000):
+    """Fits the feature encoder to a stored training set, and collects the
+    statistics needed for sampling and cross-validation
+
+    Returns
+    -------
+    encoder : eve.features.FeatureEncoder
+        Frozen feature encoder.
+    class_counts : pandas.Series
+        Number of sites of each target class, indexed by class in sorted
+        order.
+    contigs : list
+        Contigs in the order they appear in the training set.
+    variant_keys : numpy.ndarray
+        Sorted site keys (with contig ids indexing `contigs`) of the sites
+        with a true variant.
+    """
+    encoder = FeatureEncoder()
+    class_counts = {}
+    contigs = []
+    variant_keys = []
+
+    for chunk in storage.iter_matrix(filepath, chunk_size=chunk_size):
+        encoder.partial_fit(chunk)
+
+        for (value, count) in _target(chunk).value_counts().items():
+            class_counts[value] = class_counts.get(value, 0) + count
+
+        for contig in chunk.index.get_level_values('contig').unique():
+            if contig not in contigs:
+                contigs.append(contig)
+
+        variants = chunk[TARGET].notnull().values
+        variant_keys.append(_site_keys(chunk[variants], contigs))
+
+    if not class_counts:
+        raise ValueError("Training set %s is empty" % filepath)
+
+    class_counts = pandas.Series(class_counts).sort_index()
+
+    return (encoder.freeze(), class_counts, contigs,
+            np.sort(np.concatenate(variant_keys)))
+
+def encode_training_set(filepath, encoder, classes, contigs, directory,
+                        folds, sampler=None, chunk_size=100000):
+    """Encodes a stored training set as memory-mapped arrays
+
+    If a sampler is given, only the sites it selects are encoded, along with
+    their sample weights. Rows are assigned to cross-validation groups by
+    contig. If there are fewer contigs than folds, contiguous blocks of sites
+    are used as groups instead.
+
+    Returns
+    -------
+    data : TrainingData
+        The encoded training set.
+    """
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+
+    data = TrainingData(directory)
+
+    # select the sites to train on (only the target column is needed)
+    masks = []
+    weights = []
+
+    for chunk in storage.iter_matrix(filepath, columns=[TARGET],
+                                     chunk_size=chunk_size):
+        labels = np.searchsorted(classes, _target(chunk).values)
+
+        if sampler is None:
+            masks.append(np.ones(len(chunk), dtype=bool))
+            weights.append(np.ones(len(chunk), dtype=np.float32))
+        else:
+            (mask, weight) = sampler.select(labels,
+                                            _site_keys(chunk, contigs))
+            masks.append(mask)
+            weights.append(weight)
+
+    length = int(sum(x.sum() for x in masks))
+
+    X = np.lib.format.open_memmap(data.path('X'), mode='w+', dtype=np.float32,
+                                  shape=(length, len(encoder.features)))
+    y = np.empty(length, dtype=np.int32)
+    groups = np.empty(length, dtype=np.int32)
+
+    start = 0
+
+    for (chunk, mask) in zip(storage.iter_matrix(filepath,
+                                                 chunk_size=chunk_size),
+                             masks):
+        chunk = chunk[mask]
+        end = start + len(chunk)
+
+        # features are written straight into the memory-mapped block
+        encoder.transform(chunk, out=X[start:end])
+        y[start:end] = np.searchsorted(classes, _target(chunk).values)
+        groups[start:end] = pandas.Categorical(
+            chunk.index.get_level_values('contig'), categories=contigs
+        ).codes
+
+        start = end
+
+    X.flush()
+    del X
+
+    if len(contigs) < folds:
+        groups = (np.arange(length) * folds) // max(1, length)
+
+    np.save(data.path('y'), y)
+    np.save(data.path('groups'), groups)
+    np.save(data.path('weights'), np.concatenate(weights))
+
+    return data
+
+def create_classifier(backend, n_classes, n_jobs=1, seed=0):
+    """Creates an untrained classifier for one of the training backends"""
+    if backend == 'forest':
+        return IncrementalForest(n_classes, n_jobs=n_jobs, random_state=seed)
+    elif backend == 'boosting':
+        return HistGradientBoostingClassifier(random_state=seed)
+
+    raise ValueError("Unknown training backend: %s (available: %s)" % (
+        backend, ", ".join(BACKENDS)))
+
+def fit_classifier(classifier, data, rows=None, chunk_size=100000):
+    """Fits a classifier to (a subset of the rows of) the training set"""
+    X = data.X
+    y = data.y
+    weights = data.weights
+
+    if isinstance(classifier, IncrementalForest):
+        return classifier.fit(X, y, rows, chunk_size, weights)
+
+    if rows is None:
+        return classifier.fit(np.asarray(X), y, sample_weight=weights)
+
+    return classifier.fit(X[rows], y[rows], sample_weight=weights[rows])
+
+def predict_proba(classifier, X, n_classes, chunk_size=100000):
+    """Predicts the probability of each of the `n_classes` classes for each
+    row of a feature block, a chunk at a time"""
+    proba = np.zeros((len(X), n_classes))
+
+    for start in range(0, len(X), chunk_size):
+        end = min(start + chunk_size, len(X))
+        proba[start:end][:, classifier.classes_] = (
+            classifier.predict_proba(X[start:end])
+        )
+
+    return proba
+
+def evaluate(y, proba, weights=None):
+    """Computes the evaluation metrics for a set of predictions
+
+    Sample weights are used so that the metrics reflect the class balance
+    of the complete training set when the majority class was down-sampled.
+
+    Returns
+    -------
+    scores : dict
+        Mapping from metric name to score.
+    confusion : numpy.ndarray
+        Confusion matrix (rows: actual, columns: predicted).
+    """
+    labels = np.arange(proba.shape[1])
+    predicted = proba.argmax(axis=1)
+
+    with warnings.catch_warnings():
+        # folds need not contain every class
+        warnings.simplefilter('ignore')
+
+        scores = {
+            'accuracy': metrics.accuracy_score(y, predicted,
+                                               sample_weight=weights),
+            'balanced_accuracy': metrics.balanced_accuracy_score(
+                y, predicted, sample_weight=weights),
+            'f1_macro': metrics.f1_score(y, predicted, labels=labels,
+                                         average='macro', zero_division=0,
+                                         sample_weight=weights),
+            'log_loss': metrics.log_loss(y, np.clip(proba, 1e-15, 1),
+                                         labels=labels,
+                                         sample_weight=weights)
+        }
+
+    confusion = metrics.confusion_matrix(y, predicted, labels=labels,
+                                         sample_weight=weights)
+
+    return ({x: float(v) for (x, v) in scores.items()}, confusion)
+
+def cross_validation_splits(data, folds):
+    """Returns the (train, test) row indices of each cross-validation fold"""
+    groups = data.groups
+    folds = min(folds, len(np.unique(groups)))
+
+    if folds < 2:
+        raise ValueError("Cross-validation requires at least two groups of "
+                         "sites")
+
+    return list(GroupKFold(n_splits=folds).split(np.empty(len(groups)),
+                                                 groups=groups))
+
+def _run_fold(job):
+    """Trains and evaluates a single cross-validation fold (run in a worker
+    process)"""
+    (data, backend, fold, folds, n_classes, chunk_size, seed) = job
+
+    (train, test) = cross_validation_splits(data, folds)[fold]
+
+    classifier = create_classifier(backend, n_classes, seed=seed)
+    fit_classifier(classifier, data, train, chunk_size)
+
+    proba = predict_proba(classifier, data.X[test], n_classes, chunk_size)
+
+    return evaluate(data.y[test], proba, data.weights[test])
+
+def cross_validate(data, backends, folds, n_classes, processes=1,
+                   chunk_size=100000, seed=0):
+    """Runs contig-grouped K-fold cross-validation for each backend
+
+    The folds of all backends are run concurrently on a pool of
+    `processes` worker processes, which read the training set from the
+    memory-mapped arrays. Daemonic processes (such as the workers of a batch
+    run, see `eve.batch.run_pool`) cannot start a pool of their own, so
+    there the folds are run one after another instead.
+
+    Returns
+    -------
+    results : dict
+        Mapping from backend to its cross-validation results: the mean,
+        standard deviation and per-fold values of each metric, and the
+        confusion matrix summed over the folds.
+    """
+    folds = len(cross_validation_splits(data, folds))
+
+    jobs = [(data, backend, fold, folds, n_classes, chunk_size, seed)
+            for backend in backends for fold in range(folds)]
+
+    processes = max(1, min(processes, len(jobs)))
+
+    if multiprocessing.current_process().daemon:
+        processes = 1
+
+    logging.info("Cross-validating %s using %d folds and %d workers" % (
+        ", ".join(backends), folds, processes))
+
+    if processes > 1:
+        context = multiprocessing.get_context('fork')
+
+        with context.Pool(processes) as pool:
+            outcomes = pool.map(_run_fold, jobs, chunksize=1)
+    else:
+        outcomes = [_run_fold(x) for x in jobs]
+
+    results = {}
+
+    for (i, backend) in enumerate(backends):
+        fold_outcomes = outcomes[i * folds:(i + 1) * folds]
+        scores = [x[0] for x in fold_outcomes]
+
+        results[backend] = {
+            'folds': folds,
+            'confusion': np.sum([x[1] for x in fold_outcomes],
+                                axis=0).tolist()
+        }
+
+        for name in scores[0]:
+            values = [x[name] for x in scores]
+            results[backend][name] = {
+                'mean': float(np.mean(values)),
+                'std': float(np.std(values)),
+                'folds': values
+            }
+
+        logging.info("%s: %s %.4f (+/- %.4f)" % (
+            backend, SELECTION_METRIC,
+            results[backend][SELECTION_METRIC]['mean'],
+            results[backend][SELECTION_METRIC]['std']))
+
+    return results
+
+def train_model(filepath, work_dir, backends=None, folds=5, threads=1,
+                chunk_size=100000, seed=0, negative_ratio=None,
+                hard_negative_window=0):
+    """Trains a classifier on a stored training set
+
+    Each backend is cross-validated, and the one with the best mean
+    SELECTION_METRIC is refit on the complete training set.
+
+    Parameters
+    ----------
+    filepath : str
+        Location of the stored training set (a combined matrix with an
+        additional 'actual' column holding the true allele of each site).
+    work_dir : str
+        Directory used for the encoded training set, which is removed
+        afterwards.
+    backends : list
+        Training backends to compare (default: ['forest']).
+    folds : int
+        Number of cross-validation folds (0 or 1 to skip cross-validation).
+    threads : int
+        Number of worker processes (for cross-validation) or threads (for
+        the final fit) to use.
+    chunk_size : int
+        Number of sites read (and trained on by the 'forest' backend) at a
+        time.
+    seed : int
+        Random seed.
+    negative_ratio : float
+        Number of majority class sites to sample for each site of another
+        class (default: train on all sites). See `eve.sampling`.
+    hard_negative_window : int
+        Majority class sites within this many bases of a true variant are
+        always kept when sampling.
+
+    Returns
+    -------
+    model_bundle : eve.model.ModelBundle
+        Trained classifier along with its feature encoding and metrics.
+    """
+    backends = backends or ['forest']
+
+    for backend in backends:
+        if backend not in BACKENDS:
+            raise ValueError("Unknown training backend: %s (available: %s)" %
+                             (backend, ", ".join(BACKENDS)))
+
+    logging.info("Collecting feature encoding")
+    (encoder, class_counts, contigs, variant_keys) = scan_training_set(
+        filepath, chunk_size)
+
+    classes = np.array(class_counts.index, dtype=object)
+    n_classes = len(classes)
+
+    sampler = None
+
+    if negative_ratio or hard_negative_window:
+        sampler = Sampler(class_counts.values, negative_ratio,
+                          hard_negative_window, variant_keys, seed)
+
+    data = encode_training_set(filepath, encoder, classes, contigs, work_dir,
+                               max(folds, 1), sampler, chunk_size)
+
+    logging.info("Training on %d of %d sites (%d features)" % (
+        len(data.y), class_counts.sum(), len(encoder.features)))
+
+    try:
+        results = {}
+
+        if folds > 1:
+            results = cross_validate(data, backends, folds, n_classes,
+                                     threads, chunk_size, seed)
+            best = max(backends,
+                       key=lambda x: results[x][SELECTION_METRIC]['mean'])
+        else:
+            best = backends[0]
+
+        logging.info("Training %s classifier on the complete training set" %
+                     best)
+
+        classifier = create_classifier(best, n_classes, threads, seed)
+        fit_classifier(classifier, data, chunk_size=chunk_size)
+    finally:
+        data.remove()
+
+    return model.ModelBundle(classifier, encoder, classes, metrics={
+        'backend': best,
+        'selection_metric': SELECTION_METRIC,
+        'classes': [str(x) for x in classes],
+        'cross_validation': results
+    })
+
+def write_metrics(model_bundle, filepath):
+    """Writes the training metrics of a model to a JSON file"""
+    with open(filepath, 'w') as fp:
+        json.dump(model_bundle.metrics, fp, indent=2, sort_keys=True)
+
+def _site_keys(chunk, contigs):
+    """Returns the site key of each row of a training set chunk"""
+    contig_ids = pandas.Categorical(chunk.index.get_level_values('contig'),
+                                    categories=contigs).codes
+
+    return site_keys(contig_ids, chunk.index.get_level_values('position'))
+
+def _target(chunk):
+    """Returns the true allele for each row, using MISSING_ALLELE for sites
+    which are not part of the truth set"""
+    actual = chunk[TARGET].astype(object)
+    return actual.where(actual.notnull(), MISSING_ALLELE).astype(str)
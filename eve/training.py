@@ -0,0 +1,126 @@
+"""
+Training set construction
+
+Functions for loading "truth" variant sets and attaching the true alleles to
+the combined variant detector output.
+"""
+import itertools
+import numpy as np
+import pandas
+from eve import vcfio
+from eve.regions import ContigIndex, lookup_sites, site_keys
+
+BASES = ['A', 'C', 'G', 'T']
+
+def load_wgsim_truth(filename):
+    """Loads the mutations reported by wgsim
+
+    Only substitutions between unambiguous bases are kept; insertions,
+    deletions and heterozygous (IUPAC-coded) sites are skipped.
+
+    Returns
+    -------
+    truth : pandas.DataFrame
+        DataFrame with 'chrom', 'pos' and 'allele' columns.
+    """
+    wgsim_fields = ['chrom', 'pos', 'before', 'after', 'haplotype']
+
+    df = pandas.read_csv(filename, sep='\t', header=None, names=wgsim_fields,
+                         usecols=range(len(wgsim_fields)), dtype=str,
+                         keep_default_na=False)
+
+    df = df[df.before.isin(BASES) & df.after.isin(BASES)]
+
+    return pandas.DataFrame({
+        'chrom': df.chrom.values,
+        'pos': df.pos.astype(int).values,
+        'allele': df.after.values
+    })
+
+def load_vcf_truth(filename, chunk_size=100000):
+    """Loads the first alternate allele for each record in a VCF file
+    (e.g. from Genome in a Bottle)
+
+    The records are split into columns a chunk of `chunk_size` lines at a
+    time.
+
+    Returns
+    -------
+    truth : pandas.DataFrame
+        DataFrame with 'chrom', 'pos' and 'allele' columns.
+    """
+    (header, lines) = vcfio.fetch_lines(filename)
+
+    chunks = []
+
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+
+        if not chunk:
+            break
+
+        fields = pandas.Series(chunk).str.rstrip('\n').str.split(
+            '\t', n=5, expand=True)
+
+        if fields.shape[1] < 5:
+            continue
+
+        fields = fields[fields[4].notnull()]
+        alleles = fields[4].str.split(',', n=1).str[0]
+
+        chunks.append(pandas.DataFrame({
+            'chrom': fields[0].values,
+            'pos': fields[1].astype(np.int64).values,
+            'allele': alleles.where(alleles != '.', None).values
+        }))
+
+    if not chunks:
+        return pandas.DataFrame({'chrom': [], 'pos': np.array([], np.int64),
+                                 'allele': []})
+
+    return pandas.concat(chunks, ignore_index=True)
+
+def label_sites(df, truth):
+    """Attaches the true allele for each site in the combined matrix
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Combined variant detector output, indexed by (contig, position) or
+        by (sample, contig, position).
+    truth : pandas.DataFrame
+        True variants, as returned by `load_wgsim_truth` or
+        `load_vcf_truth`. If a site is listed multiple times, the last entry
+        is used.
+
+    Returns
+    -------
+    actual : numpy.ndarray
+        True allele for each row of `df`, or NaN if the site is not part of
+        the truth set.
+    """
+    level = df.index.names.index('contig')
+    contigs = ContigIndex(list(df.index.levels[level]))
+
+    # sorted, unique keys for the truth set (sites on contigs not present in
+    # the combined matrix are ignored)
+    contig_ids = contigs.encode(truth.chrom.values)
+    known = contig_ids >= 0
+
+    keys = site_keys(contig_ids[known], truth.pos.values[known])
+    alleles = truth.allele.values[known]
+
+    # keep the last entry for each site
+    order = np.argsort(keys, kind='stable')[::-1]
+    (keys, first) = np.unique(keys[order], return_index=True)
+    alleles = alleles[order][first]
+
+    # look up each site of the combined matrix
+    query = site_keys(df.index.codes[level],
+                      df.index.get_level_values('position'))
+    indices = lookup_sites(keys, query)
+
+    actual = np.full(len(df), np.nan, dtype=object)
+    actual[indices >= 0] = alleles[indices[indices >= 0]]
+
+    return actual
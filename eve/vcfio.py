@@ -0,0 +1,610 @@
+"""
+VCF input/output
+
+Readers for the VCF files generated by the variant detectors. EVE only needs
+a handful of fields from each record, so rather than building full PyVCF
+record objects for every line, the files are read in chunks and the relevant
+columns are extracted in bulk. Records which cannot be handled this way are
+parsed with PyVCF instead.
+
+The final ensemble calls are written as a BGZF-compressed VCF, which is
+indexed with tabix so that it can be queried by region.
+"""
+import os
+import re
+import gzip
+import zlib
+import math
+import struct
+import logging
+import vcf
+import itertools
+import numpy as np
+import pandas
+from eve import execution
+
+# VCF columns used by EVE (first sample only)
+VCF_COLUMNS = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO',
+               'FORMAT', 'SAMPLE']
+
+def open_vcf(filename):
+    """Opens a plain-text or gzip/bgzip-compressed VCF file for reading"""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    return open(filename)
+
+def read_header(fp):
+    """Reads the header lines from an open VCF file
+
+    Returns
+    -------
+    header : list
+        Header lines, including the #CHROM line.
+    line : str
+        The first record line, or an empty string if there are no records.
+    """
+    header = []
+
+    for line in fp:
+        if not line.startswith('#'):
+            return header, line
+        header.append(line)
+
+    return header, ''
+
+def fetch_lines(filename, region=None):
+    """Returns the header and an iterator over the record lines of a VCF
+
+    If a region is specified, the VCF must be bgzip-compressed and indexed
+    with tabix, and only records overlapping the region are returned. This
+    requires pysam.
+    """
+    if region is None:
+        fp = open_vcf(filename)
+        header, first = read_header(fp)
+
+        if not first:
+            return header, iter([])
+
+        return header, _chain_line(first, fp)
+
+    try:
+        import pysam
+    except ImportError:
+        raise ImportError("pysam is required for region queries on "
+                          "tabix-indexed VCF files")
+
+    tabix = pysam.TabixFile(filename)
+    header = ["%s\n" % x for x in tabix.header]
+
+    return header, ("%s\n" % x for x in tabix.fetch(str(region)))
+
+def _chain_line(first, fp):
+    """Yields a line followed by the remaining lines of a file"""
+    yield first
+    for line in fp:
+        yield line
+
+def record_to_site(record):
+    """Extracts the fields used by EVE from a PyVCF record
+
+    Returns None for records which are filtered or are not SNPs, and a
+    (chrom, pos, alt, qual_score, depth) tuple otherwise.
+    """
+    # Remove filtered entries and (for now) non-SNPs
+    if not record.is_snp:
+        return None
+    if record.FILTER and len(record.FILTER) > 0:
+        return None
+
+    # @TODO: decide how to deal with multiple alleles
+    # i.e.: len(record.ALT) > 1
+
+    # Determine quality score to use
+    try:
+        # GATK
+        qual_score = record.INFO['QD']
+    except KeyError:
+        try:
+            # VarScan
+            # http://varscan.sourceforge.net/support-faq.html#output-confidence
+            qual_score = record.samples[0]['GQ']
+        except:
+            # mpileup
+            # Also contains the Genotype Quality score used for
+            # VarScan above...
+            qual_score = record.QUAL / record.INFO['DP']
+
+    # Determine read depth
+    try:
+        # GATK / mpileup
+        depth = record.INFO['DP']
+    except KeyError:
+        # VarScan
+        depth = record.INFO['ADP']
+
+    return (record.CHROM, record.POS, str(record.ALT[0]), qual_score, depth)
+
+def pyvcf_sites(filename):
+    """Iterates over the unfiltered SNPs in a VCF file using PyVCF"""
+    for record in vcf.Reader(filename=filename):
+        site = record_to_site(record)
+
+        if site is not None:
+            yield site
+
+def read_sites(filename, region=None, chunk_size=100000):
+    """Iterates over the unfiltered SNPs in a VCF file in chunks
+
+    Parameters
+    ----------
+    filename : str
+        VCF file to read; may be bgzip-compressed.
+    region : str
+        Optional region to restrict to (requires a tabix index).
+    chunk_size : int
+        Number of lines to process at a time.
+
+    Yields
+    ------
+    chunk : tuple
+        (chroms, positions, alts, qual_scores, depths) tuple of NumPy arrays
+        for the SNPs in each chunk which passed all filters.
+    """
+    header, lines = fetch_lines(filename, region)
+
+    # records which can't be handled in bulk are parsed using PyVCF
+    fallback = PyVCFLineParser(header)
+
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+
+        if not chunk:
+            break
+
+        sites = parse_lines(chunk, fallback)
+
+        if len(sites[0]) > 0:
+            yield sites
+
+def parse_lines(lines, fallback):
+    """Extracts the fields used by EVE from a list of VCF record lines
+
+    Parameters
+    ----------
+    lines : list
+        VCF record lines
+    fallback : PyVCFLineParser
+        Parser to use for records which can't be handled in bulk.
+
+    Returns
+    -------
+    sites : tuple
+        (chroms, positions, alts, qual_scores, depths) tuple of NumPy arrays
+        for the SNPs which passed all filters.
+    """
+    rows = [x.rstrip('\n').split('\t', 10) for x in lines if x.strip()]
+    rows = [x + [''] * (10 - len(x)) for x in rows]
+
+    if not rows:
+        return _empty_sites()
+
+    cols = dict(zip(VCF_COLUMNS, (np.array(x, dtype=object)
+                                  for x in list(zip(*rows))[:10])))
+
+    # Remove filtered entries and (for now) non-SNPs
+    # (see vcf.model._Record.is_snp)
+    keep = np.array([len(ref) == 1 and _SNP_ALT.fullmatch(alt) is not None
+                     for (ref, alt) in zip(cols['REF'], cols['ALT'])],
+                    dtype=bool)
+    keep &= np.isin(cols['FILTER'], ['.', 'PASS'])
+
+    cols = {k:v[keep] for k, v in cols.items()}
+    lines = [x for (x, k) in zip(rows, keep) if k]
+
+    if not lines:
+        return _empty_sites()
+
+    # INFO and FORMAT fields needed to determine quality and depth
+    info = [_parse_info(x) for x in cols['INFO']]
+    qd = np.array([x.get('QD') for x in info], dtype=object)
+    dp = np.array([x.get('DP') for x in info], dtype=object)
+    adp = np.array([x.get('ADP') for x in info], dtype=object)
+    gq = np.array([_format_field(fmt, sample, 'GQ') for (fmt, sample) in
+                   zip(cols['FORMAT'], cols['SAMPLE'])], dtype=object)
+
+    has_qd = qd != None
+    has_dp = dp != None
+    has_adp = adp != None
+    has_gq = gq != None
+
+    qd = _to_float(qd)
+    dp = _to_float(dp)
+    adp = _to_float(adp)
+    gq = _to_float(gq)
+    qual = _to_float(cols['QUAL'])
+
+    # Determine quality score to use: GATK (QD), VarScan (GQ) or mpileup
+    # (QUAL / DP)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        qual_score = np.where(has_qd, qd, np.where(has_gq, gq, qual / dp))
+
+    # Determine read depth: GATK / mpileup (DP) or VarScan (ADP)
+    depth = np.where(has_dp, dp, adp)
+
+    # records where the values are missing are handed to PyVCF, which
+    # either knows how to deal with them or raises an appropriate error
+    mpileup = ~has_qd & ~has_gq
+    invalid = ((mpileup & (np.isnan(qual) | np.isnan(dp))) |
+               (~has_dp & ~has_adp))
+
+    chroms = cols['CHROM']
+    positions = np.array(cols['POS'], dtype=np.int64)
+    alts = np.array([x.split(',', 1)[0] for x in cols['ALT']], dtype=object)
+
+    valid = np.ones(len(chroms), dtype=bool)
+
+    for i in np.flatnonzero(invalid):
+        site = fallback.parse("\t".join(lines[i]))
+
+        if site is None:
+            valid[i] = False
+            continue
+
+        qual_score[i] = np.nan if site[3] is None else site[3]
+        depth[i] = np.nan if site[4] is None else site[4]
+
+    return (chroms[valid], positions[valid], alts[valid], qual_score[valid],
+            depth[valid])
+
+class PyVCFLineParser(object):
+    """Parses individual VCF record lines using PyVCF"""
+    def __init__(self, header):
+        self.header = header
+
+    def parse(self, line):
+        """Parses a single VCF record line and returns the same site tuple as
+        `record_to_site`"""
+        reader = vcf.Reader(iter(self.header + [line + '\n']))
+        return record_to_site(next(reader))
+
+class BGZFWriter(object):
+    """Writes a BGZF-compressed (blocked gzip) file
+
+    BGZF files are made up of independently compressed gzip blocks of at most
+    64KB, which allows tools such as tabix to seek directly to the block
+    containing a given record. They can be read like any other gzip file.
+    """
+    # maximum amount of uncompressed data per block (as used by htslib)
+    BLOCK_SIZE = 0xff00
+
+    # empty block marking the end of the file
+    EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b00'
+                              '03000000000000000000')
+
+    def __init__(self, filepath, level=6):
+        self.fp = open(filepath, 'wb')
+        self.level = level
+        self.buffer = bytearray()
+
+    def write(self, text):
+        """Writes a string to the file"""
+        self.buffer += text.encode('utf-8')
+
+        while len(self.buffer) >= self.BLOCK_SIZE:
+            self._write_block(bytes(self.buffer[:self.BLOCK_SIZE]))
+            del self.buffer[:self.BLOCK_SIZE]
+
+    def _write_block(self, data):
+        """Compresses and writes a single block"""
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+
+        # gzip header with a 'BC' extra field holding the total block size
+        # minus one
+        header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6,
+                             ord('B'), ord('C'), 2, len(compressed) + 25)
+        footer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+        self.fp.write(header + compressed + footer)
+
+    def close(self):
+        """Writes any remaining data and the end-of-file marker"""
+        if self.buffer:
+            self._write_block(bytes(self.buffer))
+            self.buffer = bytearray()
+
+        self.fp.write(self.EOF_BLOCK)
+        self.fp.close()
+
+def index_vcf(filepath):
+    """Creates a tabix index for a BGZF-compressed VCF file
+
+    pysam is used if it is available, and the tabix command-line tool
+    otherwise.
+
+    Returns
+    -------
+    success : bool
+        Whether the index was created.
+    """
+    try:
+        import pysam
+    except ImportError:
+        pysam = None
+
+    if pysam is not None:
+        pysam.tabix_index(filepath, preset='vcf', force=True)
+        return True
+
+    cmd = "tabix -f -p vcf %s" % filepath
+
+    try:
+        execution.run_command(cmd, stage='Indexing', retries=0)
+    except execution.CommandError:
+        logging.warning("Unable to create tabix index for %s" % filepath)
+        return False
+
+    return True
+
+class EnsembleVCFWriter(object):
+    """Writes the variants predicted by the ensemble classifier to a
+    BGZF-compressed, tabix-indexed VCF file
+
+    Predictions are written as they are made, one chunk at a time, and must
+    be passed in coordinate order (as in the combined matrix). The file is
+    written to a temporary location and only moved into place and indexed
+    once it is complete.
+    """
+    # INFO fields added to each record
+    INFO_FIELDS = [
+        ('EP', 1, 'Float', 'Ensemble probability of the called allele'),
+        ('NC', 1, 'Integer', 'Number of detectors calling the allele'),
+        ('CALLERS', '.', 'String', 'Detectors calling the allele'),
+        ('DP', 1, 'Integer', 'Read depth reported by the detectors')
+    ]
+
+    # maximum QUAL value (used when the ensemble probability is 1)
+    MAX_QUAL = 999
+
+    def __init__(self, filepath, reference, contigs):
+        """Create a VCF writer
+
+        Parameters
+        ----------
+        filepath : str
+            Location of the output VCF (.vcf.gz).
+        reference : eve.regions.FastaReference
+            Reference sequence, used to look up the reference base at each
+            site.
+        contigs : list
+            (contig, length) tuples for the reference sequences.
+        """
+        self.filepath = filepath
+        self.reference = reference
+        self.tmp = "%s.tmp%d" % (filepath, os.getpid())
+        self.writer = BGZFWriter(self.tmp)
+        self.num_records = 0
+
+        self._write_header(contigs)
+
+    def _write_header(self, contigs):
+        lines = ['##fileformat=VCFv4.2', '##source=EVE',
+                 '##reference=file://%s' %
+                 os.path.abspath(self.reference.filepath)]
+
+        for (name, length) in contigs:
+            lines.append('##contig=<ID=%s,length=%d>' % (name, length))
+
+        for (key, number, kind, description) in self.INFO_FIELDS:
+            lines.append('##INFO=<ID=%s,Number=%s,Type=%s,Description="%s">' %
+                         (key, number, kind, description))
+
+        lines.append('#' + '\t'.join(VCF_COLUMNS[:8]))
+
+        self.writer.write('\n'.join(lines) + '\n')
+
+    def write(self, chunk, predictions, probabilities):
+        """Writes the variants predicted for a chunk of the combined matrix
+
+        Sites which are predicted to match the reference (or for which no
+        allele is predicted) are skipped.
+        """
+        # detector allele columns
+        detectors = [x for x in chunk.columns
+                     if x != 'depth' and not x.endswith('_qual')]
+
+        predictions = np.asarray(predictions, dtype=object)
+        called = np.flatnonzero((predictions != 'X') &
+                                pandas.notnull(predictions))
+
+        if len(called) == 0:
+            return
+
+        contigs = chunk.index.get_level_values('contig')[called]
+        positions = chunk.index.get_level_values('position')[called]
+        depth = chunk['depth'].values[called]
+        alleles = [chunk[x].astype(object).values[called] for x in detectors]
+
+        lines = []
+
+        for (i, j) in enumerate(called):
+            (contig, pos, alt) = (contigs[i], int(positions[i]),
+                                  predictions[j])
+            ref = self.reference.base(contig, pos)
+
+            if alt == ref:
+                continue
+
+            callers = [name for (name, x) in zip(detectors, alleles)
+                       if x[i] == alt]
+
+            prob = float(probabilities[j])
+            qual = (self.MAX_QUAL if prob >= 1 else
+                    min(self.MAX_QUAL, -10 * math.log10(1 - prob)))
+
+            info = ["EP=%.4f" % prob, "NC=%d" % len(callers)]
+
+            if callers:
+                info.append("CALLERS=%s" % ",".join(callers))
+            if depth[i] >= 0:
+                info.append("DP=%d" % depth[i])
+
+            lines.append("%s\t%d\t.\t%s\t%s\t%.2f\tPASS\t%s\n" % (
+                contig, pos, ref, alt, qual, ";".join(info)))
+
+        self.writer.write("".join(lines))
+        self.num_records += len(lines)
+
+    def close(self):
+        """Finishes writing the VCF, moves it into place and indexes it"""
+        self.writer.close()
+        os.replace(self.tmp, self.filepath)
+
+        logging.info("Wrote %d variants to %s" % (self.num_records,
+                                                  self.filepath))
+
+        index_vcf(self.filepath)
+
+    def abort(self):
+        """Discards the partially written VCF"""
+        self.writer.close()
+        os.unlink(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class CohortVCFWriter(object):
+    """Writes the variants predicted for a cohort matrix, with one VCF for
+    each sample
+
+    The rows of a cohort matrix are grouped by sample (see
+    `eve.cohort.combine_samples`), so only the VCF of the current sample is
+    open at any time.
+    """
+    def __init__(self, filepath, reference, contigs):
+        """Create a cohort VCF writer
+
+        Parameters
+        ----------
+        filepath : callable
+            Function returning the location of the output VCF for a sample.
+        reference : eve.regions.FastaReference
+            Reference sequence.
+        contigs : list
+            (contig, length) tuples for the reference sequences.
+        """
+        self.filepath = filepath
+        self.reference = reference
+        self.contigs = contigs
+        self.writer = None
+        self.samples = []
+        self.filepaths = []
+
+    def write(self, chunk, predictions, probabilities):
+        """Writes the variants predicted for a chunk of the cohort matrix"""
+        level = chunk.index.names.index('sample')
+        codes = chunk.index.codes[level]
+        names = chunk.index.levels[level]
+
+        predictions = np.asarray(predictions, dtype=object)
+        probabilities = np.asarray(probabilities)
+
+        # runs of rows belonging to the same sample
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        ends = np.r_[starts[1:], len(codes)]
+
+        for (start, end) in zip(starts, ends):
+            writer = self._writer(names[codes[start]])
+            writer.write(chunk.iloc[start:end], predictions[start:end],
+                         probabilities[start:end])
+
+    def _writer(self, sample):
+        """Returns the VCF writer for a sample, finishing the VCF of the
+        previous sample"""
+        if self.samples and self.samples[-1] == sample:
+            return self.writer
+
+        if sample in self.samples:
+            raise ValueError("Rows for sample %s are not contiguous" % sample)
+
+        self.close()
+
+        filepath = self.filepath(sample)
+
+        self.writer = EnsembleVCFWriter(filepath, self.reference,
+                                        self.contigs)
+        self.samples.append(sample)
+        self.filepaths.append(filepath)
+
+        return self.writer
+
+    def close(self):
+        """Finishes writing the VCF of the current sample"""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def abort(self):
+        """Discards the partially written VCF of the current sample"""
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+# ALT alleles considered to be SNPs by PyVCF
+_SNP_ALT = re.compile(r'[ACGTN*](,[ACGTN*])*')
+
+def _empty_sites():
+    """Returns an empty site tuple"""
+    return (np.array([], dtype=object), np.array([], dtype=np.int64),
+            np.array([], dtype=object), np.array([], dtype=np.float64),
+            np.array([], dtype=np.float64))
+
+def _parse_info(info):
+    """Splits a VCF INFO field into a dict of (unparsed) values"""
+    fields = {}
+
+    for entry in info.split(';'):
+        (key, sep, value) = entry.partition('=')
+        if sep:
+            fields[key] = value
+
+    return fields
+
+def _format_field(fmt, sample, key):
+    """Returns the (unparsed) value of a FORMAT field for a sample, or None if
+    the field is not present"""
+    if not sample:
+        return None
+
+    keys = fmt.split(':')
+
+    if key not in keys:
+        return None
+
+    values = sample.split(':')
+    i = keys.index(key)
+
+    # trailing fields may be dropped
+    return values[i] if i < len(values) else '.'
+
+def _to_float(values):
+    """Converts an array of VCF strings to floats, with missing values
+    (None or '.') converted to NaN"""
+    return pandas.to_numeric(pandas.Series(values, dtype=object),
+                             errors='coerce').values.astype(np.float64)
@@ -0,0 +1,20 @@
+import os
+import sys
+import importlib.util
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# make the eve package importable when running the tests from any directory
+sys.path.insert(0, REPO_DIR)
+
+@pytest.fixture(scope='session')
+def eve_main():
+    """The `eve.py` script, loaded under a name which does not clash with the
+    `eve` package"""
+    spec = importlib.util.spec_from_file_location(
+        'eve_main', os.path.join(REPO_DIR, 'eve.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
@@ -0,0 +1,29 @@
+"""
+Tests for the command-line arguments
+"""
+
+def make_reads(directory):
+    reads = [str(directory / 'reads_1.fastq'), str(directory / 'reads_2.fastq')]
+
+    for filepath in reads:
+        open(filepath, 'w').close()
+
+    return reads
+
+def test_training_options(tmp_path, eve_main):
+    reads = make_reads(tmp_path)
+
+    # as used in the README examples
+    args = eve_main.EVE.parse_args(['eve.py', '-f', 'genome.fasta',
+                                    '--train=actual_snps.vcf',
+                                    '--training-backend=forest,boosting'] +
+                                   reads)
+
+    assert args.training_set == 'actual_snps.vcf'
+    assert args.training_backend == 'forest,boosting'
+    assert 'bam' not in args
+
+    for option in ['-t', '--training-set']:
+        args = eve_main.EVE.parse_args(['eve.py', '-f', 'genome.fasta',
+                                        option, 'actual_snps.vcf'] + reads)
+        assert args.training_set == 'actual_snps.vcf'
@@ -0,0 +1,42 @@
+"""
+Tests for running samples in batch worker processes
+"""
+import os
+import numpy as np
+import pandas
+from eve import batch, storage, trainer
+
+def training_set(filepath, sites=200):
+    """Writes a small training set, with a variant at every fourth site"""
+    positions = np.arange(1, sites + 1)
+    variant = positions % 4 == 0
+
+    index = pandas.MultiIndex.from_arrays([
+        np.where(positions <= sites // 2, 'chr1', 'chr2'), positions
+    ], names=['contig', 'position'])
+
+    df = pandas.DataFrame({
+        'gatk': np.where(variant, 'T', None),
+        'depth': np.full(sites, 20.0),
+        'gatk_qual': np.where(variant, 50.0, np.nan),
+        'actual': np.where(variant, 'T', None)
+    }, index=index)
+
+    storage.write_matrix(df, filepath)
+
+def train(job):
+    """Trains a model in a batch worker, as a sample's pipeline would"""
+    (filepath, work_dir) = job
+
+    bundle = trainer.train_model(filepath, work_dir, folds=3, threads=2)
+
+    return bundle.metrics['backend']
+
+def test_training_in_batch_worker(tmp_path):
+    filepath = os.path.join(str(tmp_path), 'training_set')
+    training_set(filepath)
+
+    jobs = [(filepath, os.path.join(str(tmp_path), 'work%d' % i))
+            for i in range(2)]
+
+    assert batch.run_pool(train, jobs, 2) == ['forest', 'forest']
@@ -0,0 +1,86 @@
+"""
+Tests for the stage cache keys
+"""
+import os
+from eve import cache
+
+def make_run(root, name, reference):
+    """Creates the output directory of a run, with a BAM file created by a
+    cached mapping stage"""
+    output_dir = os.path.join(root, name)
+    bam = os.path.join(output_dir, 'mapped', 'aln.bam')
+    os.makedirs(os.path.dirname(bam))
+
+    with open(bam, 'w') as fp:
+        fp.write("alignments\n")
+
+    cache.mark_current([bam], 'mapping-key')
+
+    commands = ["samtools mpileup -f %s %s > %s" % (
+        reference, bam, os.path.join(output_dir, 'vcf', 'mpileup.vcf'))]
+
+    return (output_dir, bam, commands)
+
+def test_stage_key_shared_across_output_directories(tmp_path):
+    reference = str(tmp_path / 'genome.fasta')
+
+    with open(reference, 'w') as fp:
+        fp.write(">chr1\nACGT\n")
+
+    keys = []
+
+    for name in ['run1', 'run2']:
+        (output_dir, bam, commands) = make_run(str(tmp_path), name, reference)
+        keys.append(cache.stage_key([bam, reference], commands, output_dir))
+
+    assert keys[0] == keys[1]
+
+    # per-region (scatter) output directories within the run
+    for name in ['run1', 'run2']:
+        output_dir = os.path.join(str(tmp_path), name)
+        bam = os.path.join(output_dir, 'mapped', 'aln.bam')
+        shard_dir = os.path.join(output_dir, 'shards', 'chr1')
+        commands = ["samtools mpileup -r chr1 %s > %s/vcf/mpileup.vcf" % (
+            bam, shard_dir)]
+        keys.append(cache.stage_key([bam, reference], commands, shard_dir))
+
+    assert keys[2] == keys[3]
+
+def test_stage_key_changes_with_input(tmp_path):
+    reference = str(tmp_path / 'genome.fasta')
+
+    with open(reference, 'w') as fp:
+        fp.write(">chr1\nACGT\n")
+
+    (output_dir, bam, commands) = make_run(str(tmp_path), 'run1', reference)
+    key = cache.stage_key([bam, reference], commands, output_dir)
+
+    # output of a different mapping stage
+    cache.mark_current([bam], 'other-mapping-key')
+    assert cache.stage_key([bam, reference], commands, output_dir) != key
+
+    # file changed after it was created
+    cache.mark_current([bam], 'mapping-key')
+    os.utime(bam, ns=(0, os.stat(bam).st_mtime_ns + 10**9))
+    assert cache.stage_key([bam, reference], commands, output_dir) != key
+
+def test_fetched_outputs_keep_their_key(tmp_path):
+    stage_cache = cache.StageCache(str(tmp_path / 'cache'))
+    reference = str(tmp_path / 'genome.fasta')
+
+    with open(reference, 'w') as fp:
+        fp.write(">chr1\nACGT\n")
+
+    (output_dir, bam, commands) = make_run(str(tmp_path), 'run1', reference)
+    stage_cache.store('mapping-key', [bam])
+    key = cache.stage_key([bam, reference], commands, output_dir)
+
+    # second run fetches the mapping output from the cache
+    other = str(tmp_path / 'run2')
+    fetched = os.path.join(other, 'mapped', 'aln.bam')
+    os.makedirs(os.path.dirname(fetched))
+
+    assert stage_cache.fetch('mapping-key', [fetched])
+
+    commands = [x.replace(output_dir, other) for x in commands]
+    assert cache.stage_key([fetched, reference], commands, other) == key
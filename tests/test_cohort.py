@@ -0,0 +1,67 @@
+"""
+Tests for the cohort matrix and its use for training and prediction
+"""
+import gzip
+import numpy as np
+import pandas
+from eve import cohort, features, regions, vcfio
+
+def sample_matrix(positions, alleles, depths):
+    index = pandas.MultiIndex.from_arrays([['chr1'] * len(positions),
+                                           positions],
+                                          names=['contig', 'position'])
+    return pandas.DataFrame({
+        'gatk': alleles,
+        'depth': np.array(depths, dtype=np.float64),
+        'gatk_qual': np.full(len(positions), 30.0)
+    }, index=index)
+
+def cohort_matrix():
+    return cohort.combine_samples([
+        ('S1', sample_matrix([2, 5], ['T', None], [10, np.nan])),
+        ('S2', sample_matrix([4], ['G'], [20]))
+    ], ['chr1'])
+
+def test_missing_depth_is_nan_and_imputed():
+    df = cohort_matrix()
+
+    assert df['depth'].dtype == np.float32
+    assert np.isnan(df['depth'].values[1])
+
+    encoder = features.FeatureEncoder().fit([df])
+    assert encoder.impute['depth'] == 15.0
+
+    X = encoder.transform(df)
+    depth = X[:, encoder.features.index('depth')]
+    assert list(depth) == [10.0, 15.0, 20.0]
+
+def test_cohort_vcf_writer_splits_samples(tmp_path):
+    fasta = str(tmp_path / 'ref.fasta')
+
+    with open(fasta, 'w') as fp:
+        fp.write(">chr1\nACGTACGTAC\n")
+    with open(fasta + '.fai', 'w') as fp:
+        fp.write("chr1\t10\t6\t10\t11\n")
+
+    df = cohort_matrix()
+    reference = regions.FastaReference(fasta)
+
+    with vcfio.CohortVCFWriter(lambda x: str(tmp_path / ("%s.vcf.gz" % x)),
+                               reference, [('chr1', 10)]) as vcf:
+        # chunks split the rows of a sample
+        vcf.write(df.iloc[:1], ['T'], [0.9])
+        vcf.write(df.iloc[1:], ['X', 'G'], [0.8, 0.9])
+
+    reference.close()
+
+    assert vcf.samples == ['S1', 'S2']
+
+    records = []
+
+    for filepath in vcf.filepaths:
+        with gzip.open(filepath, 'rt') as fp:
+            records.append([x.split('\t')[:5] for x in fp
+                            if not x.startswith('#')])
+
+    assert records == [[['chr1', '2', '.', 'C', 'T']],
+                       [['chr1', '4', '.', 'T', 'G']]]
@@ -0,0 +1,73 @@
+"""
+Tests for combining variant detector output
+
+The PyVCF-based parser is used as the reference for the chunked parser: both
+must produce the same combined matrix for the same VCF files.
+"""
+import os
+import shutil
+import pandas
+from eve import combine
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data', 'combine')
+
+# GATK (QD), mpileup (QUAL / DP) and VarScan (GQ, ADP) output, including
+# multi-allelic, indel, filtered and <DEL> records, a missing QD value and
+# missing GQ values
+DETECTORS = ['gatk', 'mpileup', 'varscan']
+
+def vcf_files(directory=DATA_DIR):
+    return [os.path.join(directory, "%s.vcf" % x) for x in DETECTORS]
+
+def test_fast_parser_matches_pyvcf():
+    fast = combine.combine_vcfs(vcf_files(), fast=True)
+    reference = combine.combine_vcfs(vcf_files(), fast=False)
+
+    pandas.testing.assert_frame_equal(fast, reference)
+
+def test_fast_parser_skips_filtered_and_non_snp_records():
+    df = combine.combine_vcfs(vcf_files(), fast=True)
+
+    # indels, <DEL> records and filtered records are not included
+    assert ('chr1', 40) not in df.index
+    assert pandas.isnull(df.loc[('chr1', 55), 'gatk'])
+    assert pandas.isnull(df.loc[('chr1', 55), 'varscan'])
+    assert ('chr2', 5) not in df.index
+    assert ('chr2', 70) not in df.index
+
+    # the first alternate allele of multi-allelic records is used
+    assert df.loc[('chr1', 25), 'gatk'] == 'T'
+
+def test_small_chunks_match():
+    expected = combine.combine_vcfs(vcf_files())
+
+    pandas.testing.assert_frame_equal(
+        combine.combine_vcfs(vcf_files(), chunk_size=2), expected)
+
+def test_incremental_matches_combine_vcfs(tmp_path):
+    # copies of the input, so that one of them can be changed
+    input_dir = str(tmp_path / 'vcf')
+    shutil.copytree(DATA_DIR, input_dir)
+
+    parts_dir = str(tmp_path / 'parts')
+    files = vcf_files(input_dir)
+
+    expected = combine.combine_vcfs(files)
+
+    pandas.testing.assert_frame_equal(
+        combine.combine_vcfs_incremental(files, parts_dir), expected)
+
+    # second run re-uses the stored columns
+    pandas.testing.assert_frame_equal(
+        combine.combine_vcfs_incremental(files, parts_dir), expected)
+
+    # change the output of one detector
+    with open(files[1]) as fp:
+        lines = [x for x in fp if not x.startswith('chr1\t33\t')]
+
+    with open(files[1], 'w') as fp:
+        fp.writelines(lines)
+
+    pandas.testing.assert_frame_equal(
+        combine.combine_vcfs_incremental(files, parts_dir),
+        combine.combine_vcfs(files))
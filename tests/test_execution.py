@@ -0,0 +1,18 @@
+"""
+Tests for running external commands
+"""
+import pytest
+from eve import execution
+
+def test_failing_pipeline_raises():
+    with pytest.raises(execution.CommandError) as error:
+        execution.run_command("false | cat", retries=0)
+
+    assert error.value.returncode == 1
+
+def test_successful_pipeline(tmp_path):
+    output = tmp_path / 'out.txt'
+
+    execution.run_command("echo eve | cat > %s" % output, retries=0)
+
+    assert output.read_text() == "eve\n"
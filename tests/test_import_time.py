@@ -0,0 +1,23 @@
+"""
+Tests for the start-up time of eve.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+
+import import_time
+
+def test_heavy_modules_are_not_imported():
+    (_, modules) = import_time.measure(import_time.load_script())
+
+    for name in ['pandas', 'sklearn', 'vcf', 'matplotlib']:
+        assert name not in modules
+
+def test_import_time_budget():
+    # the fastest of several runs, to allow for a busy machine
+    seconds = min(import_time.measure(import_time.load_script())[0]
+                  for i in range(3))
+
+    assert seconds <= import_time.BUDGET
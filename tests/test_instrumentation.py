@@ -0,0 +1,57 @@
+"""
+Tests for the resource usage recorded in the run report
+"""
+import sys
+import time
+import multiprocessing
+from eve import instrumentation
+
+# memory held by each of the test processes, in MB
+HOLD_MB = 80
+
+HOLD_SCRIPT = ("import time; x = bytearray(%d * 1024 * 1024); "
+               "time.sleep(1.5)" % HOLD_MB)
+
+def busy(seconds):
+    """Uses CPU time and memory for a while (run in a worker process)"""
+    data = bytearray(HOLD_MB * 1024 * 1024)
+    end = time.process_time() + seconds
+
+    while time.process_time() < end:
+        pass
+
+    return len(data)
+
+def test_pipeline_tree_rss(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'report',
+                        instrumentation.RunReport())
+
+    # two processes holding memory at the same time
+    cmd = '%s -c "%s" | %s -c "%s"' % (sys.executable, HOLD_SCRIPT,
+                                       sys.executable, HOLD_SCRIPT)
+
+    assert instrumentation.run_command(cmd, stage='test') == 0
+
+    record = instrumentation.report.records[0]
+
+    assert record['max_process_rss_kb'] >= HOLD_MB * 1024
+    assert record['peak_tree_rss_kb'] >= 2 * HOLD_MB * 1024
+
+def test_stage_includes_workers(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'report',
+                        instrumentation.RunReport())
+
+    with instrumentation.stage('test'):
+        context = multiprocessing.get_context('fork')
+
+        with context.Pool(1) as pool:
+            pool.map(busy, [1.0])
+
+    record = instrumentation.report.records[0]
+
+    assert record['user_time'] + record['sys_time'] >= 0.8
+    assert record['max_process_rss_kb'] >= HOLD_MB * 1024
+    assert record['peak_tree_rss_kb'] >= HOLD_MB * 1024
+
+def test_tree_rss_of_missing_process():
+    assert instrumentation.tree_rss_kb(2**22 + 1) is None
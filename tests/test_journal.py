@@ -0,0 +1,74 @@
+"""
+Tests for the stage journal and resuming runs
+"""
+import os
+import argparse
+from eve import journal
+
+class FakeMapper(object):
+    """Stands in for a mapper, creating an empty BAM file and index"""
+    def __init__(self, bam):
+        self.bam_sorted_rg = bam
+        self.runs = 0
+
+    def run(self):
+        self.runs += 1
+
+        for filepath in [self.bam_sorted_rg, "%s.bai" % self.bam_sorted_rg]:
+            with open(filepath, 'w') as fp:
+                fp.write("run %d\n" % self.runs)
+
+        return self.bam_sorted_rg
+
+def make_inputs(directory):
+    inputs = []
+
+    for name in ['genome.fasta', 'reads_1.fastq', 'reads_2.fastq']:
+        filepath = os.path.join(directory, name)
+        with open(filepath, 'w') as fp:
+            fp.write("%s\n" % name)
+        inputs.append(filepath)
+
+    return inputs
+
+def test_saved_args_are_a_snapshot(tmp_path):
+    output_dir = str(tmp_path)
+    args = argparse.Namespace(fasta='genome.fasta', input_reads=['r1', 'r2'])
+
+    record = journal.Journal(output_dir)
+    record.save_args(args)
+
+    # set by the pipeline once the reads have been mapped
+    args.bam = os.path.join(output_dir, 'aln.bam')
+    record.mark_complete('mapping', [], [])
+
+    resumed = journal.load_args(output_dir)
+
+    assert 'bam' not in resumed
+    assert resumed.input_reads == ['r1', 'r2']
+
+def test_missing_output_reruns_stage(tmp_path, eve_main):
+    output_dir = str(tmp_path)
+    (fasta, reads1, reads2) = make_inputs(output_dir)
+
+    app = eve_main.EVE.__new__(eve_main.EVE)
+    app.args = argparse.Namespace(fasta=fasta, input_reads=[reads1, reads2])
+    app.journal = journal.Journal(output_dir)
+    app.mapper = FakeMapper(os.path.join(output_dir, 'aln.bam'))
+
+    app.run_mapping()
+    assert app.mapper.runs == 1
+
+    # resumed with the output in place
+    app.journal = journal.Journal(output_dir)
+    app.run_mapping()
+    assert app.mapper.runs == 1
+
+    # resumed after the output was removed
+    os.unlink(app.mapper.bam_sorted_rg)
+
+    app.journal = journal.Journal(output_dir)
+    bam = app.run_mapping()
+
+    assert app.mapper.runs == 2
+    assert os.path.exists(bam)
@@ -0,0 +1,129 @@
+"""
+Tests for streaming a BAM file to several detectors at once
+"""
+import os
+import threading
+import pytest
+from eve import execution, pileup
+
+class FakeDetector(object):
+    """Stands in for a detector whose pileup step is a shell command reading
+    the BAM file"""
+    threads = 1
+    memory = 1
+
+    def __init__(self, name, pileup_cmd, output_dir):
+        self.name = self.title = name
+        self.pileup_cmd = pileup_cmd
+        self.path = os.path.join(output_dir, "%s.out" % name)
+        self.aborted = False
+
+    def is_complete(self):
+        return False
+
+    def prepare(self):
+        pass
+
+    def build_commands(self, bam=None, staged=False):
+        return [self.pileup_cmd.format(bam=bam, output=self.path),
+                "true"]
+
+    def run_commands(self, commands):
+        for cmd in commands:
+            execution.run_command(cmd, self.title, retries=0)
+
+    def finish(self):
+        pass
+
+    def abort(self):
+        self.aborted = True
+
+    def output(self):
+        return self.path
+
+@pytest.fixture
+def bam(tmp_path):
+    """Input file spanning several blocks"""
+    filepath = str(tmp_path / 'reads.bam')
+
+    with open(filepath, 'wb') as fp:
+        fp.write(os.urandom(int(2.5 * pileup.BLOCK_SIZE)))
+
+    return filepath
+
+def run_with_timeout(function, timeout=60):
+    """Runs a function in a thread, failing if it does not finish in time"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = function()
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+
+    assert not thread.is_alive(), "timed out"
+
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+def read(filepath):
+    with open(filepath, 'rb') as fp:
+        return fp.read()
+
+def test_shared_pileup_streams_to_all_detectors(tmp_path, bam):
+    detectors = [FakeDetector(x, "cat {bam} > {output}", str(tmp_path))
+                 for x in ['first', 'second']]
+
+    stage = pileup.SharedPileup(detectors, bam, str(tmp_path))
+    results = run_with_timeout(stage.run)
+
+    assert results == {x.name: x.path for x in detectors}
+
+    for detector in detectors:
+        assert read(detector.path) == read(bam)
+
+@pytest.mark.parametrize('pileup_cmd', [
+    "exit 3",                              # fails before reading
+    "head -c 100 {bam} > {output}",        # stops reading part-way
+    "cat {bam} | head -c 100 > {output}"   # fails part-way (pipefail)
+])
+def test_shared_pileup_consumer_exits_early(tmp_path, bam, pileup_cmd):
+    complete = FakeDetector('complete', "cat {bam} > {output}", str(tmp_path))
+    early = FakeDetector('early', pileup_cmd, str(tmp_path))
+
+    stage = pileup.SharedPileup([early, complete], bam, str(tmp_path))
+    results = run_with_timeout(stage.run)
+
+    # the other detector still receives the whole file
+    assert results == {'complete': complete.path}
+    assert read(complete.path) == read(bam)
+
+    assert early.aborted
+    assert not complete.aborted
+
+def test_tee_file_raises_for_early_exit(tmp_path, bam):
+    fifos = []
+
+    for name in ['complete', 'early']:
+        fifo = str(tmp_path / name)
+        os.mkfifo(fifo)
+        fifos.append(fifo)
+
+    output = str(tmp_path / 'complete.out')
+    readers = [pileup.CommandThread("cat %s > %s" % (fifos[0], output)),
+               pileup.CommandThread("head -c 100 %s > /dev/null" % fifos[1])]
+
+    for reader in readers:
+        reader.start()
+
+    with pytest.raises(pileup.TeeError) as error:
+        run_with_timeout(lambda: pileup.tee_file(bam, fifos, readers))
+
+    assert error.value.outputs == [fifos[1]]
+    assert [x.wait() for x in readers] == [0, 0]
+    assert read(output) == read(bam)
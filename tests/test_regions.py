@@ -0,0 +1,65 @@
+"""
+Tests for splitting the genome into regions for scatter/gather
+"""
+from eve import regions
+
+def write_index(tmp_path):
+    filepath = str(tmp_path / 'genome.fasta.fai')
+
+    with open(filepath, 'w') as fp:
+        fp.write("chr1\t2500\t6\t60\t61\n"
+                 "chrM\t16\t2554\t16\t17\n"
+                 "\n"
+                 "chr2\t1000\t2578\t60\t61\n")
+
+    return filepath
+
+def check_tiling(shards, contigs):
+    """Checks that the regions of each contig are contiguous, do not overlap
+    and cover the whole contig"""
+    for (contig, length) in contigs:
+        parts = [x for x in shards if x.contig == contig]
+
+        assert parts[0].start == 1
+        assert parts[-1].end == length
+
+        for (previous, current) in zip(parts, parts[1:]):
+            assert current.start == previous.end + 1
+
+        for region in parts:
+            assert region.start <= region.end
+
+def test_read_fasta_index(tmp_path):
+    contigs = regions.read_fasta_index(write_index(tmp_path))
+
+    assert contigs == [('chr1', 2500), ('chrM', 16), ('chr2', 1000)]
+
+def test_one_region_per_contig(tmp_path):
+    contigs = regions.read_fasta_index(write_index(tmp_path))
+    shards = regions.split_genome(contigs)
+
+    assert [str(x) for x in shards] == ['chr1:1-2500', 'chrM:1-16',
+                                        'chr2:1-1000']
+    check_tiling(shards, contigs)
+
+def test_fixed_size_windows(tmp_path):
+    contigs = regions.read_fasta_index(write_index(tmp_path))
+    shards = regions.split_genome(contigs, window_size=1000)
+
+    # long contigs are split, and short contigs are kept whole
+    assert [str(x) for x in shards] == ['chr1:1-1000', 'chr1:1001-2000',
+                                        'chr1:2001-2500', 'chrM:1-16',
+                                        'chr2:1-1000']
+    check_tiling(shards, contigs)
+
+    for size in [1, 7, 999, 1001, 5000]:
+        shards = regions.split_genome(contigs, window_size=size)
+
+        check_tiling(shards, contigs)
+        assert all(x.end - x.start + 1 <= size for x in shards)
+
+def test_region_names():
+    region = regions.Region('HLA-A*01:01', 1, 100)
+
+    assert region.name == 'HLA-A_01_01_1-100'
+    assert str(region) == 'HLA-A*01:01:1-100'
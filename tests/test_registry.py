@@ -0,0 +1,105 @@
+"""
+Tests for the detector registry
+"""
+import os
+from eve import detectors, registry
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(REPO_DIR, 'config')
+
+def load_default(tools=None):
+    return registry.load_registry([os.path.join(CONFIG_DIR, 'detectors.cfg')],
+                                  tools)
+
+def test_default_registry():
+    specs = load_default({'GATK_jar': '/opt/GenomeAnalysisTK.jar'})
+
+    assert sorted(specs) == ['gatk', 'mpileup', 'varscan']
+
+    gatk = specs['gatk']
+    assert gatk.title == 'GATK'
+    assert gatk.commands == os.path.join(CONFIG_DIR, 'detectors', 'gatk.cmd')
+    assert gatk.files == {'vcf_unfiltered': 'gatk_unfiltered.vcf',
+                          'vcf_filtered': 'gatk_filtered.vcf'}
+    assert gatk.outputs == ['vcf_filtered']
+    assert gatk.temporary == ['gatk_unfiltered.vcf',
+                              'gatk_unfiltered.vcf.idx']
+    assert gatk.tool == '/opt/GenomeAnalysisTK.jar'
+    assert gatk.region_option == '-L {region}'
+    assert not gatk.shared_pileup
+    assert (gatk.max_threads, gatk.memory) == (16, 4.0)
+    assert gatk.cls is detectors.VariantDetector
+
+    mpileup = specs['mpileup']
+    assert mpileup.files == {'bcf_output': 'var.raw.bcf',
+                             'output': 'mpileup.vcf'}
+    assert mpileup.outputs == ['output']
+    assert mpileup.tool is None
+    assert mpileup.region_option == '-r {region}'
+    assert mpileup.shared_pileup
+    assert (mpileup.max_threads, mpileup.memory) == (1, 1.0)
+
+    varscan = specs['varscan']
+    assert varscan.outputs == ['varscan_snps']
+    # tools which are not listed in the configuration are used as-is
+    assert varscan.tool == 'VarScan_jar'
+    assert varscan.shared_pileup
+    assert (varscan.max_threads, varscan.memory) == (2, 2.0)
+
+    for spec in specs.values():
+        assert os.path.isfile(spec.commands)
+
+def test_additional_registry(tmp_path):
+    filepath = str(tmp_path / 'detectors.cfg')
+
+    with open(filepath, 'w') as fp:
+        fp.write("[mpileup]\n"
+                 "commands = mpileup.cmd\n"
+                 "output   = vcf\n"
+                 "files    = vcf=mpileup.vcf\n"
+                 "memory   = 3\n"
+                 "[freebayes]\n"
+                 "title    = FreeBayes\n"
+                 "commands = freebayes.cmd\n"
+                 "files    = vcf=freebayes.vcf\n"
+                 "output   = vcf\n"
+                 "class    = eve.detectors.VariantDetector\n")
+
+    specs = registry.load_registry([os.path.join(CONFIG_DIR, 'detectors.cfg'),
+                                    filepath])
+
+    assert sorted(specs) == ['freebayes', 'gatk', 'mpileup', 'varscan']
+
+    # later registry files replace earlier declarations
+    assert specs['mpileup'].memory == 3.0
+    assert not specs['mpileup'].shared_pileup
+    assert specs['mpileup'].commands == str(tmp_path / 'detectors' /
+                                            'mpileup.cmd')
+
+    freebayes = specs['freebayes']
+    assert freebayes.title == 'FreeBayes'
+    assert (freebayes.max_threads, freebayes.memory) == (1, 1.0)
+    assert freebayes.cls is detectors.VariantDetector
+
+def test_allocate_threads():
+    specs = [load_default()[x] for x in ['gatk', 'mpileup', 'varscan']]
+
+    # the whole budget is used, within each detector's maximum
+    for budget in range(3, 20):
+        threads = registry.allocate_threads(specs, budget)
+
+        assert sum(threads.values()) == budget
+        for spec in specs:
+            assert 1 <= threads[spec.name] <= spec.max_threads
+
+    assert registry.allocate_threads(specs, 10) == {'gatk': 7, 'mpileup': 1,
+                                                    'varscan': 2}
+
+    # more threads than the detectors can use
+    assert registry.allocate_threads(specs, 100) == {'gatk': 16,
+                                                     'mpileup': 1,
+                                                     'varscan': 2}
+
+    # every detector gets at least one thread
+    assert registry.allocate_threads(specs, 1) == {'gatk': 1, 'mpileup': 1,
+                                                   'varscan': 1}
@@ -0,0 +1,89 @@
+"""
+Tests for down-sampling the majority class of a training set
+"""
+import numpy as np
+from eve.regions import site_keys
+from eve.sampling import Sampler, near_sites
+
+def training_labels(sites=100000, variants=1000, seed=1):
+    """Class labels with the majority class (0) at all but a few sites"""
+    labels = np.zeros(sites, dtype=np.int32)
+    labels[np.random.default_rng(seed).choice(sites, variants,
+                                              replace=False)] = 1
+    return labels
+
+def test_sampling_rate_and_weights():
+    labels = training_labels()
+    counts = np.bincount(labels)
+
+    sampler = Sampler(counts, ratio=10)
+    assert abs(sampler.rate - 10 * 1000 / 99000.0) < 1e-12
+
+    (mask, weights) = sampler.select(labels)
+    kept = labels[mask]
+
+    # all minority sites are kept, with a weight of one
+    assert (kept == 1).sum() == 1000
+    assert np.all(weights[kept == 1] == 1)
+
+    # about ten majority sites for each minority site
+    assert abs((kept == 0).sum() - 10000) < 400
+
+    # the weighted class balance matches the complete training set
+    np.testing.assert_allclose(weights[kept == 0], 1 / sampler.rate,
+                               rtol=1e-6)
+    assert abs(weights[kept == 0].sum() - counts[0]) < 0.05 * counts[0]
+
+def test_sampling_is_reproducible():
+    labels = training_labels()
+    chunks = np.array_split(labels, 7)
+
+    def run(seed):
+        sampler = Sampler(np.bincount(labels), ratio=5, seed=seed)
+        return np.concatenate([sampler.select(x)[0] for x in chunks])
+
+    assert np.array_equal(run(3), run(3))
+    assert not np.array_equal(run(3), run(4))
+
+def test_no_down_sampling():
+    labels = training_labels(sites=1000, variants=100)
+
+    for ratio in [0, None, 100]:
+        sampler = Sampler(np.bincount(labels), ratio=ratio)
+        (mask, weights) = sampler.select(labels)
+
+        assert sampler.rate == 1
+        assert mask.all()
+        assert np.all(weights == 1)
+
+def test_hard_negatives_are_kept():
+    positions = np.arange(1, 1001)
+    contigs = np.repeat([0, 1], 500)
+    keys = site_keys(contigs, positions)
+
+    labels = np.zeros(1000, dtype=np.int32)
+    labels[[100, 700]] = 1
+
+    sampler = Sampler(np.bincount(labels), ratio=1, window=5,
+                      positive_keys=np.sort(keys[labels == 1]))
+    (mask, weights) = sampler.select(labels, keys)
+
+    near = np.zeros(1000, dtype=bool)
+    near[95:106] = True
+    near[695:706] = True
+
+    # every site within the window is kept with a weight of one
+    assert mask[near].all()
+    assert np.all(weights[near[mask]] == 1)
+
+    # only a couple of the other majority sites are sampled
+    assert mask[~near].sum() < 20
+
+def test_near_sites():
+    keys = np.sort(site_keys([0, 0, 1], [100, 200, 100]))
+    query = site_keys([0, 0, 0, 0, 1, 1, 2],
+                      [94, 95, 205, 206, 105, 150, 100])
+
+    assert list(near_sites(keys, query, 5)) == [False, True, True, False,
+                                                True, False, False]
+    assert not near_sites(np.array([], np.int64), query, 5).any()
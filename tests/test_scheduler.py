@@ -0,0 +1,130 @@
+"""
+Tests for the task scheduler
+"""
+import time
+import threading
+import pytest
+from eve.scheduler import Scheduler, Task
+
+class Tracker(object):
+    """Keeps track of the tasks running at the same time"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_threads = 0
+        self.max_memory = 0
+        self.max_tasks = 0
+        self.calls = []
+
+    def task(self, name, threads=1, memory=0, requires=None, fail=False):
+        def run():
+            with self.lock:
+                self.calls.append(name)
+                self.running[name] = (threads, memory)
+                self.max_threads = max(self.max_threads, sum(
+                    x[0] for x in self.running.values()))
+                self.max_memory = max(self.max_memory, sum(
+                    x[1] for x in self.running.values()))
+                self.max_tasks = max(self.max_tasks, len(self.running))
+
+            time.sleep(0.05)
+
+            with self.lock:
+                del self.running[name]
+
+            if fail:
+                raise RuntimeError("%s failed" % name)
+
+            return name.upper()
+
+        return Task(name, run, threads=threads, requires=requires,
+                    memory=memory)
+
+def test_thread_budget():
+    tracker = Tracker()
+    scheduler = Scheduler(max_threads=4)
+
+    for i in range(6):
+        scheduler.add(tracker.task("t%d" % i, threads=2))
+
+    (results, failed) = scheduler.run()
+
+    assert failed == []
+    assert results == {"t%d" % i: "T%d" % i for i in range(6)}
+    assert tracker.max_threads == 4
+
+def test_memory_budget():
+    tracker = Tracker()
+    scheduler = Scheduler(max_threads=8, max_memory=5)
+
+    for i in range(4):
+        scheduler.add(tracker.task("t%d" % i, memory=2))
+
+    # more than the whole budget; run once nothing else is running
+    scheduler.add(tracker.task("large", memory=8))
+
+    (results, failed) = scheduler.run()
+
+    assert len(results) == 5
+    assert tracker.max_tasks == 2
+    assert tracker.max_memory == 8
+
+def test_oversized_task_runs_alone():
+    tracker = Tracker()
+    scheduler = Scheduler(max_threads=2)
+
+    scheduler.add(tracker.task("small1"))
+    scheduler.add(tracker.task("large", threads=16))
+    scheduler.add(tracker.task("small2"))
+
+    scheduler.run()
+
+    assert tracker.max_threads == 16
+    assert tracker.max_tasks == 2
+
+def test_failure_skips_dependents_only():
+    tracker = Tracker()
+    scheduler = Scheduler(max_threads=4)
+
+    scheduler.add(tracker.task("mapping", fail=True))
+    scheduler.add(tracker.task("gatk", requires=["mapping"]))
+    scheduler.add(tracker.task("gather", requires=["gatk"]))
+    scheduler.add(tracker.task("reference"))
+    scheduler.add(tracker.task("index", requires=["reference"]))
+
+    (results, failed) = scheduler.run()
+
+    assert results == {"reference": "REFERENCE", "index": "INDEX"}
+    assert sorted(failed) == ["gather", "gatk", "mapping"]
+
+    # dependents of the failed task are never started
+    assert "gatk" not in tracker.calls
+    assert "gather" not in tracker.calls
+
+def test_dependencies_run_in_order():
+    tracker = Tracker()
+    scheduler = Scheduler(max_threads=4)
+
+    scheduler.add(tracker.task("combine", requires=["gatk", "mpileup"]))
+    scheduler.add(tracker.task("gatk"))
+    scheduler.add(tracker.task("mpileup"))
+
+    (results, failed) = scheduler.run()
+
+    assert len(results) == 3
+    assert tracker.calls[-1] == "combine"
+
+def test_invalid_dependencies():
+    scheduler = Scheduler(max_threads=2)
+    scheduler.add(Task("a", lambda: None, requires=["b"]))
+
+    with pytest.raises(ValueError):
+        scheduler.run()
+
+    scheduler.add(Task("b", lambda: None, requires=["a"]))
+
+    with pytest.raises(ValueError):
+        scheduler.run()
+
+    with pytest.raises(ValueError):
+        scheduler.add(Task("a", lambda: None))
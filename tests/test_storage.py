@@ -0,0 +1,102 @@
+"""
+Tests for storing and reading back combined matrices
+"""
+import os
+import numpy as np
+import pandas
+import pytest
+from eve import storage
+
+def matrix_chunks():
+    """Chunks of a combined matrix, whose allele columns use different sets
+    of categories"""
+    def chunk(contigs, positions, alleles, quals):
+        index = pandas.MultiIndex.from_arrays(
+            [pandas.Categorical(contigs), np.array(positions, np.int32)],
+            names=['contig', 'position'])
+
+        return pandas.DataFrame({
+            'gatk': pandas.Categorical(alleles),
+            'depth': np.arange(len(positions), dtype=np.float64),
+            'gatk_qual': np.array(quals, dtype=np.float32)
+        }, index=index)
+
+    return [chunk(['chr1', 'chr1', 'chr1'], [3, 7, 9], ['A', None, 'T'],
+                  [10.5, np.nan, 30]),
+            chunk(['chr1', 'chr2'], [12, 4], ['G', 'C'], [20, 40]),
+            chunk(['chr2'], [8], [None], [np.nan])]
+
+def check_round_trip(filepath):
+    chunks = matrix_chunks()
+
+    with storage.MatrixWriter(filepath) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+
+    expected = pandas.concat(chunks)
+    path = storage.find_matrix(filepath)
+
+    assert storage.matrix_length(path) == len(expected)
+    assert storage.matrix_index_names(path) == ['contig', 'position']
+
+    df = storage.read_matrix(filepath)
+    assert_matrix_equal(df, expected)
+
+    # chunk boundaries need not match those used for writing
+    for chunk_size in [1, 2, 4]:
+        read = list(storage.iter_matrix(filepath, chunk_size=chunk_size))
+
+        assert [len(x) for x in read[:-1]] == [chunk_size] * (len(read) - 1)
+        assert_matrix_equal(pandas.concat(read), expected)
+
+    # column selection
+    df = storage.read_matrix(filepath, columns=['gatk_qual'])
+
+    assert list(df.columns) == ['gatk_qual']
+    assert list(df.index.names) == ['contig', 'position']
+
+    return path
+
+def assert_matrix_equal(df, expected):
+    """Compares matrices by value, ignoring the categories of categorical
+    columns"""
+    assert list(df.columns) == list(expected.columns)
+    assert list(df.index.get_level_values('contig').astype(object)) == \
+        list(expected.index.get_level_values('contig').astype(object))
+    assert np.array_equal(df.index.get_level_values('position'),
+                          expected.index.get_level_values('position'))
+
+    alleles = df['gatk'].astype(object)
+    assert list(alleles.where(alleles.notnull(), None)) == \
+        ['A', None, 'T', 'G', 'C', None]
+
+    for name in ['depth', 'gatk_qual']:
+        assert df[name].dtype == expected[name].dtype
+        np.testing.assert_array_equal(df[name].values, expected[name].values)
+
+def test_numpy_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'have_pyarrow', lambda: False)
+
+    path = check_round_trip(os.path.join(str(tmp_path), 'combined'))
+
+    assert path.endswith(storage.NUMPY_EXT)
+    assert not [x for x in os.listdir(str(tmp_path)) if '.tmp' in x]
+
+def test_feather_round_trip(tmp_path):
+    pytest.importorskip('pyarrow')
+
+    path = check_round_trip(os.path.join(str(tmp_path), 'combined'))
+
+    assert path.endswith(storage.FEATHER_EXT)
+
+def test_aborted_matrix_is_discarded(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'have_pyarrow', lambda: False)
+    filepath = os.path.join(str(tmp_path), 'combined')
+
+    with pytest.raises(RuntimeError):
+        with storage.MatrixWriter(filepath) as writer:
+            writer.write(matrix_chunks()[0])
+            raise RuntimeError("combining failed")
+
+    assert storage.find_matrix(filepath) is None
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,48 @@
+"""
+Tests for loading truth sets and labelling the combined matrix
+"""
+import os
+import pandas
+from eve import combine, training
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data', 'combine')
+
+def test_load_vcf_truth_in_chunks():
+    filename = os.path.join(DATA_DIR, 'gatk.vcf')
+    truth = training.load_vcf_truth(filename)
+
+    assert len(truth) == 7
+    assert list(truth.pos[:3]) == [10, 25, 40]
+
+    # first alternate allele of multi-allelic records
+    assert truth.allele[1] == 'T'
+
+    for chunk_size in [1, 2, 3]:
+        chunked = training.load_vcf_truth(filename, chunk_size=chunk_size)
+        assert chunked.equals(truth)
+
+def test_load_wgsim_truth_skips_ambiguous_sites(tmp_path):
+    filename = str(tmp_path / 'wgsim.txt')
+
+    with open(filename, 'w') as fp:
+        fp.write("chr1\t10\tA\tG\t-\n"
+                 "chr1\t25\tC\tY\t+\n"     # heterozygous (IUPAC)
+                 "chr1\t33\tG\t-\t-\n"     # deletion
+                 "chr2\t15\tC\tA\t-\n")
+
+    truth = training.load_wgsim_truth(filename)
+
+    assert list(zip(truth.chrom, truth.pos, truth.allele)) == [
+        ('chr1', 10, 'G'), ('chr2', 15, 'A')]
+
+def test_label_sites():
+    df = combine.combine_vcfs([os.path.join(DATA_DIR, 'varscan.vcf')])
+    truth = training.load_vcf_truth(os.path.join(DATA_DIR, 'gatk.vcf'))
+
+    actual = training.label_sites(df, truth)
+    labels = dict(zip(df.index, actual))
+
+    assert labels[('chr1', 10)] == 'G'
+    assert labels[('chr2', 15)] == 'A'
+    assert all(pandas.isnull(x) for (site, x) in labels.items()
+               if site not in [('chr1', 10), ('chr2', 15)])
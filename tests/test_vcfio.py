@@ -0,0 +1,161 @@
+"""
+Tests for writing the BGZF-compressed ensemble VCF
+"""
+import os
+import gzip
+import zlib
+import struct
+import numpy as np
+import pandas
+import pytest
+from eve import regions, vcfio
+
+def read_blocks(filepath):
+    """Splits a BGZF file into its blocks, checking the header of each
+
+    Returns
+    -------
+    blocks : list
+        (raw block, uncompressed data) tuples.
+    """
+    with open(filepath, 'rb') as fp:
+        data = fp.read()
+
+    blocks = []
+    offset = 0
+
+    while offset < len(data):
+        (id1, id2, method, flags, _, xlen, si1, si2, slen, bsize) = (
+            struct.unpack('<4BI2xH2BHH', data[offset:offset + 18]))
+
+        assert (id1, id2, method, flags) == (0x1f, 0x8b, 8, 4)
+        assert (xlen, si1, si2, slen) == (6, ord('B'), ord('C'), 2)
+
+        # the BC field holds the total block size minus one
+        block = data[offset:offset + bsize + 1]
+        assert len(block) == bsize + 1
+        (crc, size) = struct.unpack('<II', block[-8:])
+        uncompressed = zlib.decompress(block[18:-8], -15)
+
+        assert len(uncompressed) == size
+        assert zlib.crc32(uncompressed) & 0xffffffff == crc
+
+        blocks.append((block, uncompressed))
+        offset += bsize + 1
+
+    return blocks
+
+def test_bgzf_blocks(tmp_path):
+    filepath = str(tmp_path / 'test.gz')
+    lines = ["line %d\t%s\n" % (i, 'ACGT' * (i % 20)) for i in range(5000)]
+
+    writer = vcfio.BGZFWriter(filepath)
+    for line in lines:
+        writer.write(line)
+    writer.close()
+
+    blocks = read_blocks(filepath)
+
+    # several data blocks, followed by the empty end-of-file block
+    assert len(blocks) > 2
+    assert blocks[-1] == (vcfio.BGZFWriter.EOF_BLOCK, b'')
+
+    for (_, data) in blocks[:-1]:
+        assert 0 < len(data) <= 0xff00
+
+    with gzip.open(filepath, 'rt') as fp:
+        assert fp.read() == "".join(lines)
+
+@pytest.fixture
+def reference(tmp_path):
+    fasta = str(tmp_path / 'ref.fasta')
+
+    with open(fasta, 'w') as fp:
+        fp.write(">chr1\nACGTACGTAC\n")
+    with open(fasta + '.fai', 'w') as fp:
+        fp.write("chr1\t10\t6\t10\t11\n")
+
+    reference = regions.FastaReference(fasta)
+    yield reference
+    reference.close()
+
+def combined_chunk(positions, gatk, mpileup, depth, sample=None):
+    arrays = [['chr1'] * len(positions), positions]
+    names = ['contig', 'position']
+
+    if sample is not None:
+        arrays.insert(0, sample)
+        names.insert(0, 'sample')
+
+    return pandas.DataFrame({
+        'gatk': gatk,
+        'mpileup': mpileup,
+        'depth': np.array(depth, dtype=np.float32),
+        'gatk_qual': np.full(len(positions), 30.0),
+        'mpileup_qual': np.full(len(positions), 20.0)
+    }, index=pandas.MultiIndex.from_arrays(arrays, names=names))
+
+def read_records(filepath):
+    with gzip.open(filepath, 'rt') as fp:
+        return [x.rstrip('\n').split('\t') for x in fp
+                if not x.startswith('#')]
+
+def test_ensemble_vcf_records(tmp_path, reference):
+    filepath = str(tmp_path / 'eve.vcf.gz')
+
+    # reference: A C G T A C G T A C
+    chunk = combined_chunk([1, 2, 3, 4, 5],
+                           ['G', 'T', None, 'C', 'A'],
+                           ['G', None, 'T', 'C', None],
+                           [12, np.nan, 7, 30, 5])
+
+    with vcfio.EnsembleVCFWriter(filepath, reference,
+                                 [('chr1', 10)]) as vcf:
+        # site 3 is predicted to match the reference and site 5 to have no
+        # variant, so neither is written
+        vcf.write(chunk, ['G', 'T', 'G', 'C', 'X'],
+                  [0.99, 1.0, 0.9, 0.5, 0.8])
+
+    assert vcf.num_records == 3
+    assert not os.path.exists(vcf.tmp)
+
+    with gzip.open(filepath, 'rt') as fp:
+        header = [x for x in fp if x.startswith('#')]
+
+    assert '##contig=<ID=chr1,length=10>\n' in header
+
+    assert read_records(filepath) == [
+        ['chr1', '1', '.', 'A', 'G', '20.00', 'PASS',
+         'EP=0.9900;NC=2;CALLERS=gatk,mpileup;DP=12'],
+        ['chr1', '2', '.', 'C', 'T', '999.00', 'PASS',
+         'EP=1.0000;NC=1;CALLERS=gatk'],
+        ['chr1', '4', '.', 'T', 'C', '3.01', 'PASS',
+         'EP=0.5000;NC=2;CALLERS=gatk,mpileup;DP=30']
+    ]
+
+def test_ensemble_vcf_abort(tmp_path, reference):
+    filepath = str(tmp_path / 'eve.vcf.gz')
+
+    with pytest.raises(RuntimeError):
+        with vcfio.EnsembleVCFWriter(filepath, reference,
+                                     [('chr1', 10)]) as vcf:
+            raise RuntimeError("prediction failed")
+
+    assert not os.path.exists(vcf.tmp)
+    assert not os.path.exists(filepath)
+
+def test_cohort_vcf_non_contiguous_samples(tmp_path, reference):
+    chunk = combined_chunk([1, 2, 3], ['G', 'T', 'G'], [None] * 3, [10] * 3,
+                           sample=['S1', 'S2', 'S1'])
+
+    with pytest.raises(ValueError):
+        with vcfio.CohortVCFWriter(
+                lambda x: str(tmp_path / ("%s.vcf.gz" % x)), reference,
+                [('chr1', 10)]) as vcf:
+            vcf.write(chunk, ['G', 'T', 'G'], [0.9] * 3)
+
+    # the VCF being written when the error occurred is discarded
+    assert vcf.filepaths == [str(tmp_path / 'S1.vcf.gz'),
+                             str(tmp_path / 'S2.vcf.gz')]
+    assert os.path.exists(vcf.filepaths[0])
+    assert not os.path.exists(vcf.filepaths[1])